@@ -0,0 +1,403 @@
+"""
+分析查询后端模块
+全市场排行这类整表扫描、窗口函数和分组关联的查询，可以交给嵌入式 DuckDB 以列式向量化方式执行
+（默认使用全部 CPU 核心），StockMonitor 的接口不变。后端由环境变量 ANALYTICS_BACKEND 切换：
+
+- sqlite（默认）：只用 SQLite
+- duckdb：分析查询走 DuckDB，出错时记录日志并退回 SQLite
+- compare：两个后端都执行，比较结果和耗时并记录日志，返回 SQLite 的结果
+
+DuckDB 的数据来源（DUCKDB_SOURCE）：
+- sqlite（默认）：通过 DuckDB 的 sqlite 扩展只读挂载当前数据库文件（读只读快照时挂载快照文件）；
+  扩展首次使用时需要下载，离线环境请预先放到 DuckDB 扩展目录
+- parquet：读取 DUCKDB_PARQUET_DIR 下导出的 Parquet 文件，刷新进程在数据更新后、计算榜单前重新导出
+
+查询统一写成 SQLite 和 DuckDB 共有的 SQL 子集，参数用 :name，列表参数写作 IN :name。
+
+duckdb 是可选依赖，只在真正使用时导入；未安装时 duckdb / compare 模式记录告警并只用 SQLite。
+
+    python analytics.py export                 # 导出 Parquet（DUCKDB_SOURCE=parquet 时使用）
+    python analytics.py compare --n 10 30      # 对比两个后端的排行结果和耗时
+"""
+import argparse
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import bindparam, text
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from database import Base, get_db_path
+from metrics import ANALYTICS_QUERY_SECONDS
+
+BACKEND_SQLITE = 'sqlite'
+BACKEND_DUCKDB = 'duckdb'
+BACKEND_COMPARE = 'compare'
+BACKENDS = (BACKEND_SQLITE, BACKEND_DUCKDB, BACKEND_COMPARE)
+
+SOURCE_SQLITE = 'sqlite'
+SOURCE_PARQUET = 'parquet'
+
+ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', BACKEND_SQLITE)
+DUCKDB_SOURCE = os.getenv('DUCKDB_SOURCE', SOURCE_SQLITE)
+PARQUET_DIR = os.getenv('DUCKDB_PARQUET_DIR', os.path.join('data', 'parquet'))
+# DuckDB 使用的线程数，0 表示全部核心
+DUCKDB_THREADS = int(os.getenv('DUCKDB_THREADS', '0'))
+# 分析查询涉及的表
+ANALYTICS_TABLES = ('stock_basic', 'stock_daily_data', 'index_daily_data', 'trade_cal')
+# 每个进程缓存的 DuckDB 连接数（按数据库文件区分，快照切换后旧连接被淘汰）
+MAX_BACKENDS = 2
+# 不能挂载 SQLite 时，经 pandas 分批导出的行数
+EXPORT_BATCH_ROWS = 200000
+# compare 模式下认为两个浮点结果相同的相对误差
+COMPARE_TOLERANCE = 1e-9
+
+_PARAM_RE = re.compile(r'(?<![:\w]):(\w+)')
+_LIST_PARAM_RE = re.compile(r'\bIN\s+:(\w+)', re.IGNORECASE)
+_DUCKDB_TYPES = {'String': 'VARCHAR', 'Float': 'DOUBLE', 'Integer': 'BIGINT'}
+
+_duckdb_missing_logged = False
+
+
+class AnalyticsUnavailable(RuntimeError):
+    """DuckDB 后端不可用（未安装 duckdb、扩展无法加载或 Parquet 尚未导出）"""
+
+
+def import_duckdb():
+    """导入 duckdb，未安装时抛出 AnalyticsUnavailable"""
+    try:
+        import duckdb
+    except ImportError as e:
+        raise AnalyticsUnavailable(
+            "未安装 duckdb，请安装可选依赖组 analytics：uv sync --extra analytics（镜像构建参数 UV_EXTRAS=analytics）"
+        ) from e
+    return duckdb
+
+
+def sql_path(path):
+    """文件路径转为 DuckDB SQL 字符串字面量"""
+    return "'" + os.path.abspath(path).replace("'", "''") + "'"
+
+
+def to_duckdb_sql(sql):
+    """把 :name / IN :name 形式的参数改写为 DuckDB 的 $name / IN (SELECT UNNEST($name))"""
+    sql = _LIST_PARAM_RE.sub(r'IN (SELECT UNNEST($\1))', sql)
+    return _PARAM_RE.sub(r'$\1', sql)
+
+
+class DuckDBBackend:
+    """
+    DuckDB 连接（每个进程、每个数据来源一个）
+
+    连接在第一次查询时创建；fork 出的子进程会重新创建自己的连接。
+    每次查询使用独立的 cursor，可以在多个线程中并发调用。
+    """
+
+    def __init__(self, db_path=None, source=None, parquet_dir=None, threads=None):
+        self.db_path = db_path or get_db_path()
+        self.source = source or DUCKDB_SOURCE
+        self.parquet_dir = parquet_dir or PARQUET_DIR
+        self.threads = DUCKDB_THREADS if threads is None else threads
+        self._con = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        duckdb = import_duckdb()
+        con = duckdb.connect(':memory:')
+        try:
+            if self.threads:
+                con.execute(f"SET threads = {int(self.threads)}")
+            if self.source == SOURCE_PARQUET:
+                for table in ANALYTICS_TABLES:
+                    path = os.path.join(self.parquet_dir, f"{table}.parquet")
+                    if not os.path.exists(path):
+                        raise AnalyticsUnavailable(f"Parquet 文件不存在: {path}，请先运行 python analytics.py export")
+                    con.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet({sql_path(path)})")
+            else:
+                attach_sqlite(con, self.db_path)
+                for table in ANALYTICS_TABLES:
+                    con.execute(f"CREATE VIEW {table} AS SELECT * FROM src.{table}")
+        except Exception:
+            con.close()
+            raise
+        logger.info(f"DuckDB 分析后端已连接（{self.source}: "
+                    f"{self.parquet_dir if self.source == SOURCE_PARQUET else self.db_path}）")
+        return con
+
+    def cursor(self):
+        with self._lock:
+            if self._con is None or self._pid != os.getpid():
+                self._con = self._connect()
+                self._pid = os.getpid()
+            return self._con.cursor()
+
+    def fetch(self, sql, params):
+        """执行查询，返回 dict 列表"""
+        duckdb_sql = to_duckdb_sql(sql)
+        used = set(re.findall(r'\$(\w+)', duckdb_sql))
+        # DuckDB 无法推断空列表的元素类型
+        params = {key: (list(value) or [None]) if isinstance(value, (list, tuple)) else value
+                  for key, value in params.items() if key in used}
+        cursor = self.cursor()
+        try:
+            cursor.execute(duckdb_sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def close(self):
+        with self._lock:
+            if self._con is not None and self._pid == os.getpid():
+                self._con.close()
+            self._con = None
+
+
+def attach_sqlite(con, db_path):
+    """通过 sqlite 扩展把数据库文件只读挂载为 src"""
+    try:
+        con.execute("INSTALL sqlite")
+        con.execute("LOAD sqlite")
+    except Exception as e:
+        raise AnalyticsUnavailable(f"无法加载 DuckDB sqlite 扩展: {e}") from e
+    con.execute(f"ATTACH {sql_path(db_path)} AS src (TYPE sqlite, READ_ONLY)")
+
+
+_backends = OrderedDict()
+_backends_lock = threading.Lock()
+
+
+def get_backend(db_path=None):
+    """获取（并缓存）指定数据库文件对应的 DuckDB 后端"""
+    key = (DUCKDB_SOURCE, os.path.abspath(db_path or get_db_path()))
+    with _backends_lock:
+        backend = _backends.get(key)
+        if backend is None:
+            backend = _backends[key] = DuckDBBackend(db_path=key[1])
+            while len(_backends) > MAX_BACKENDS:
+                _, evicted = _backends.popitem(last=False)
+                evicted.close()
+        _backends.move_to_end(key)
+        return backend
+
+
+def _fetch_sqlite(session, sql, params):
+    lists = [bindparam(key, expanding=True) for key, value in params.items() if isinstance(value, (list, tuple))]
+    statement = text(sql).bindparams(*lists)
+    return [dict(row) for row in session.execute(statement, params).mappings().all()]
+
+
+def _fetch_duckdb(session, sql, params):
+    return get_backend(session.info.get('db_path')).fetch(sql, params)
+
+
+def _timed(fn, backend, name, *args):
+    started = time.perf_counter()
+    rows = fn(*args)
+    elapsed = time.perf_counter() - started
+    ANALYTICS_QUERY_SECONDS.observe(elapsed, backend=backend, query=name)
+    return rows, elapsed
+
+
+def fetch_rows(session, sql, params, name='query', backend=None):
+    """
+    按 ANALYTICS_BACKEND 执行分析查询
+
+    参数:
+        session: SQLite 会话（sqlite 后端直接使用；duckdb 后端挂载会话对应的数据库文件）
+        sql: SQLite / DuckDB 共有的 SQL，参数写作 :name，列表参数写作 IN :name
+        params: 参数 dict
+        name: 查询名称，用于日志和指标
+        backend: 覆盖 ANALYTICS_BACKEND；显式指定时 DuckDB 出错直接抛出，不退回 SQLite
+
+    返回:
+        dict 列表
+    """
+    global _duckdb_missing_logged
+    explicit = backend is not None
+    backend = backend or ANALYTICS_BACKEND
+    if backend == BACKEND_SQLITE:
+        return _timed(_fetch_sqlite, BACKEND_SQLITE, name, session, sql, params)[0]
+
+    try:
+        duck_rows, duck_seconds = _timed(_fetch_duckdb, BACKEND_DUCKDB, name, session, sql, params)
+    except AnalyticsUnavailable as e:
+        if explicit:
+            raise
+        if not _duckdb_missing_logged:
+            logger.warning(f"DuckDB 分析后端不可用，改用 SQLite: {e}")
+            _duckdb_missing_logged = True
+        return _timed(_fetch_sqlite, BACKEND_SQLITE, name, session, sql, params)[0]
+    except Exception as e:
+        if explicit:
+            raise
+        logger.error(f"DuckDB 执行 {name} 失败，改用 SQLite: {e}")
+        return _timed(_fetch_sqlite, BACKEND_SQLITE, name, session, sql, params)[0]
+
+    if backend == BACKEND_DUCKDB:
+        return duck_rows
+
+    sqlite_rows, sqlite_seconds = _timed(_fetch_sqlite, BACKEND_SQLITE, name, session, sql, params)
+    differences = compare_rows(sqlite_rows, duck_rows)
+    summary = (f"分析查询对比（{name}）: SQLite {sqlite_seconds * 1000:.0f}ms，"
+               f"DuckDB {duck_seconds * 1000:.0f}ms，{len(sqlite_rows)} / {len(duck_rows)} 行")
+    if differences:
+        logger.warning(f"{summary}，{len(differences)} 处不一致，例如: {differences[:3]}")
+    else:
+        logger.info(f"{summary}，结果一致")
+    return sqlite_rows
+
+
+def _same_value(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        if a is None or b is None:
+            return a is b
+        return math.isclose(float(a), float(b), rel_tol=COMPARE_TOLERANCE, abs_tol=COMPARE_TOLERANCE)
+    return a == b
+
+
+def compare_rows(expected, actual, key='ts_code'):
+    """
+    比较两个后端的结果（按 key 对齐，浮点按相对误差比较，不比较顺序）
+
+    返回:
+        不一致项列表 [(key, 字段, 期望值, 实际值), ...]；行集合不同的记为字段 None
+    """
+    expected_by_key = {row[key]: row for row in expected}
+    actual_by_key = {row[key]: row for row in actual}
+    differences = [(k, None, k in expected_by_key, k in actual_by_key)
+                   for k in sorted(set(expected_by_key) ^ set(actual_by_key))]
+    for k, row in expected_by_key.items():
+        other = actual_by_key.get(k)
+        if other is None:
+            continue
+        differences.extend((k, field, value, other.get(field))
+                           for field, value in row.items() if not _same_value(value, other.get(field)))
+    return differences
+
+
+# ---------- Parquet 导出 ----------
+
+def _duckdb_schema(table):
+    columns = Base.metadata.tables[table].columns
+    return ', '.join(f"{column.name} {_DUCKDB_TYPES.get(type(column.type).__name__, 'VARCHAR')}"
+                     for column in columns)
+
+
+def _copy_table_via_pandas(con, db_path, table, dest):
+    """不能挂载 SQLite 时，用 pandas 分批读出再交给 DuckDB 写 Parquet"""
+    import sqlite3
+    import pandas as pd
+
+    con.execute(f"CREATE OR REPLACE TEMP TABLE export_{table} ({_duckdb_schema(table)})")
+    src = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        for batch in pd.read_sql_query(f"SELECT * FROM {table}", src, chunksize=EXPORT_BATCH_ROWS):
+            con.register('export_batch', batch)
+            con.execute(f"INSERT INTO export_{table} BY NAME SELECT * FROM export_batch")
+            con.unregister('export_batch')
+    finally:
+        src.close()
+    con.execute(f"COPY export_{table} TO {sql_path(dest)} (FORMAT parquet, COMPRESSION zstd)")
+    con.execute(f"DROP TABLE export_{table}")
+
+
+def export_parquet(dest_dir=None, db_path=None, tables=ANALYTICS_TABLES):
+    """
+    把分析查询用到的表导出为 Parquet（每表一个 zstd 压缩文件，先写临时文件再 rename）
+
+    优先通过 DuckDB sqlite 扩展直接复制；扩展不可用时经 pandas 分批读取。
+
+    返回:
+        {表名: 行数}
+    """
+    duckdb = import_duckdb()
+    dest_dir = dest_dir or PARQUET_DIR
+    db_path = db_path or get_db_path()
+    os.makedirs(dest_dir, exist_ok=True)
+
+    con = duckdb.connect(':memory:')
+    counts = {}
+    try:
+        try:
+            attach_sqlite(con, db_path)
+            attached = True
+        except AnalyticsUnavailable as e:
+            logger.info(f"{e}，改用 pandas 分批导出")
+            attached = False
+
+        for table in tables:
+            started = time.perf_counter()
+            dest = os.path.join(dest_dir, f"{table}.parquet")
+            tmp_path = f"{dest}.{os.getpid()}.tmp"
+            if attached:
+                con.execute(f"COPY (SELECT * FROM src.{table}) TO {sql_path(tmp_path)} "
+                            f"(FORMAT parquet, COMPRESSION zstd)")
+            else:
+                _copy_table_via_pandas(con, db_path, table, tmp_path)
+            counts[table] = con.execute(f"SELECT COUNT(*) FROM read_parquet({sql_path(tmp_path)})").fetchone()[0]
+            os.replace(tmp_path, dest)
+            logger.info(f"已导出 {table}: {counts[table]} 行，{time.perf_counter() - started:.1f}s -> {dest}")
+    finally:
+        con.close()
+    return counts
+
+
+def needs_parquet_export():
+    """当前配置下刷新数据后是否需要重新导出 Parquet"""
+    return ANALYTICS_BACKEND != BACKEND_SQLITE and DUCKDB_SOURCE == SOURCE_PARQUET
+
+
+# ---------- 命令行 ----------
+
+def _compare_ranking(n_values, repeat):
+    from monitor import StockMonitor
+
+    monitor = StockMonitor()
+    for n in n_values:
+        timings = {}
+        results = {}
+        for backend in (BACKEND_SQLITE, BACKEND_DUCKDB):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                results[backend] = monitor.get_deviation_ranking(n, backend=backend)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[backend] = best
+        differences = compare_rows(results[BACKEND_SQLITE], results[BACKEND_DUCKDB])
+        print(f"n={n}: SQLite {timings[BACKEND_SQLITE] * 1000:.0f}ms，DuckDB {timings[BACKEND_DUCKDB] * 1000:.0f}ms，"
+              f"{len(results[BACKEND_SQLITE])} / {len(results[BACKEND_DUCKDB])} 行，{len(differences)} 处不一致")
+        for difference in differences[:10]:
+            print(f"  {difference}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DuckDB 分析后端")
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help="把分析用的表导出为 Parquet")
+    export.add_argument('--dest', default=PARQUET_DIR, help=f"导出目录，默认 {PARQUET_DIR}")
+    compare = sub.add_parser('compare', help="对比 SQLite 和 DuckDB 的排行结果和耗时")
+    compare.add_argument('--n', type=int, nargs='+', default=[10, 30], help="榜单天数，默认 10 30")
+    compare.add_argument('--repeat', type=int, default=3, help="每个后端重复次数（取最快一次），默认 3")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'export':
+            counts = export_parquet(args.dest)
+            print(f"已导出到 {args.dest}: {counts}")
+        elif args.command == 'compare':
+            import_duckdb()
+            _compare_ranking(args.n, args.repeat)
+    except AnalyticsUnavailable as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,25 +2,37 @@
 Flask 应用主程序
 提供 API 接口和静态网页
 使用 Jinja2 模板渲染静态网页
+
+Web 进程只读取刷新进程发布的结果，导入时没有任何副作用；
+数据刷新和定时任务由独立的刷新进程负责（python -m refresh_worker）
 """
+import math
 import os
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
 # 必须在导入其他模块之前加载环境变量
 load_dotenv()
 
-from flask import Flask, jsonify, render_template
+from flask import Flask, Response, g, jsonify, render_template, request
 from flask_cors import CORS
 import logger_config  # 必须在导入 logger 之前
 from loguru import logger
-from database import init_db
-from data_manager import DataManager
-from trade_calendar import TradeCalendarManager
-from monitor import INDEX_CODES
-from cache_manager import CacheManager
-from apscheduler.schedulers.background import BackgroundScheduler
+from board_service import (
+    BOARD_THRESHOLDS, BOARD_TOP_N, BOARD_MAX_N, BOARD_MAX_RESULTS, CACHE_KEY_BOTH, CACHE_KEY_SUMMARY,
+    get_stock_detail, get_board, get_board_delta, get_board_universe, get_data_generation, get_generation_info,
+    get_published, get_window_ranking, board_markets, DELTA_MODE_UNCHANGED,
+)
 from config import CHANGELOG, COPYRIGHT, WATERMARK
+from database import close_session, get_data_watermarks, get_read_session, SNAPSHOT_READER
+from archive import ARCHIVE_COLUMNS
+from export_service import MIMETYPES, check_format, export_board, export_daily
+from monitor import RANKING_ORDER_FIELDS
+from metrics import REGISTRY, HTTP_REQUESTS, HTTP_SECONDS
+from query_stats import QueryTracker
+from profiler import KIND_API, ProfileSession, should_profile_request
+from refresh_status import read_status
 
 # 初始化 Flask 应用
 # 配置静态文件和模板目录
@@ -33,137 +45,46 @@ app.config['JSON_AS_ASCII'] = False
 # 启用 CORS
 CORS(app)
 
-# 初始化数据库
-try:
-    init_db()
-    logger.info("数据库初始化成功")
-except Exception as e:
-    logger.error(f"数据库初始化失败: {e}")
-
-# 初始化定时任务
-scheduler = BackgroundScheduler()
-
-
-def refresh_data():
-    """定期刷新数据的任务"""
-    try:
-        logger.info("开始刷新股票和指数数据...")
-        dm = DataManager()
-        tcm = TradeCalendarManager()
-        cache_mgr = CacheManager()
-
-        # 更新交易日历
-        logger.info("更新交易日历...")
-        dm.update_trade_cal_if_needed('SSE', days_threshold=180)
-        dm.update_trade_cal_if_needed('SZSE', days_threshold=180)
-
-        # 更新股票基本信息
-        logger.info("更新股票基本信息...")
-        dm.fetch_stock_basic()
-
-        # 获取过去40个交易日的数据
-        logger.info("获取过去40个交易日的股票数据...")
-        try:
-            # 判断今天是否为交易日且在17:00之后
-            today = datetime.now().strftime('%Y%m%d')
-            current_hour = datetime.now().hour
-
-            # 如果今天是交易日且在17:00之后，则包括今天；否则从上一个交易日开始
-            if tcm.is_trading_day(today, 'SSE') and current_hour >= 17:
-                end_date = today
-                logger.info(f"今天 {today} 是交易日且已过17:00，包括今天")
-            else:
-                end_date = tcm.get_prev_trading_day(today, 'SSE')
-                logger.info(f"使用上一个交易日 {end_date} 作为结束日期")
-
-            # 获取最后40个交易日
-            trading_days = tcm.get_last_n_trading_days(40, end_date, 'SSE')
-
-            if trading_days:
-                start_date = trading_days[0]
-                end_date = trading_days[-1]
-                logger.info(f"获取 {start_date} 到 {end_date} 的股票数据")
-
-                # 获取所有上市股票列表
-                stocks = dm.get_stock_list()
-                if stocks:
-                    ts_codes = [stock.ts_code for stock in stocks]
-                    logger.info(f"准备获取 {len(ts_codes)} 只股票的数据")
-
-                    # 批量获取日线数据
-                    dm.fetch_stock_daily_batch(
-                        ts_codes,
-                        start_date=start_date,
-                        end_date=end_date,
-                        exchange='SSE'
-                    )
-                    logger.info("股票日线数据获取完成")
-                else:
-                    logger.warning("未找到任何股票")
-            else:
-                logger.warning("未获取到交易日数据")
-        except Exception as e:
-            logger.error(f"获取股票日线数据失败: {e}")
-
-        # 刷新指数日线数据（最近40个交易日）
-        logger.info("刷新指数日线数据...")
-        try:
-            logger.info(f"准备刷新 {len(INDEX_CODES)} 个指数的数据")
-
-            # 使用与股票相同的日期范围（过去40个交易日）
-            if trading_days:
-                start_date = trading_days[0]
-                end_date = trading_days[-1]
-                logger.info(f"获取 {start_date} 到 {end_date} 的指数数据")
-
-                dm.fetch_index_daily_batch(
-                    INDEX_CODES,
-                    start_date=start_date,
-                    end_date=end_date,
-                    exchange='SSE'
-                )
-                logger.info("指数日线数据刷新完成")
-            else:
-                logger.warning("未获取到交易日数据，跳过指数数据刷新")
-        except Exception as e:
-            logger.error(f"刷新指数日线数据失败: {e}")
-
-        # 数据刷新完成后，填充缓存
-        logger.info("填充双榜缓存...")
-        try:
-            from monitor import StockMonitor
-            monitor = StockMonitor()
-
-            # 获取10日数据
-            logger.info("获取10日榜数据...")
-            results_10 = monitor.query_stocks(n=10, threshold=100)
-            results_10.sort(key=lambda x: x['deviation'], reverse=True)
-            results_10 = results_10[:50]
-
-            # 获取30日数据
-            logger.info("获取30日榜数据...")
-            results_30 = monitor.query_stocks(n=30, threshold=200)
-            results_30.sort(key=lambda x: x['deviation'], reverse=True)
-            results_30 = results_30[:50]
-
-            # 缓存数据
-            cache_data = {
-                'stocks_10': results_10,
-                'stocks_30': results_30
-            }
-
-            # 同时填充当天缓存和上一天缓存
-            cache_mgr.set('stocks_both', cache_data, ttl_hours=24)
-            cache_mgr.set('stocks_both_prev', cache_data, ttl_hours=24)
-
-            logger.info(f"双榜缓存填充完成，10日榜 {len(results_10)} 只，30日榜 {len(results_30)} 只")
-        except Exception as e:
-            logger.error(f"填充双榜缓存失败: {e}")
-
-        logger.info("股票和指数数据刷新完成")
-    except Exception as e:
-        logger.error(f"数据刷新失败: {e}")
 
+def _request_endpoint():
+    # 按路由模板（而不是实际路径）记录，避免标签基数失控
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+    g.query_tracker = QueryTracker(f"http:{_request_endpoint()}").start()
+    if should_profile_request(_request_endpoint()):
+        g.profile_session = ProfileSession(_request_endpoint(), KIND_API).start()
+
+
+@app.after_request
+def _record_request(response):
+    """记录请求数、耗时和本次请求执行的 SQL 语句数"""
+    endpoint = _request_endpoint()
+    tracker = g.pop('query_tracker', None)
+    if tracker is not None:
+        tracker.stop()
+    session = g.pop('profile_session', None)
+    if session is not None:
+        session.stop()
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def _stop_query_tracker(exc):
+    # after_request 未执行（如响应生成中途出错）时，确保统计器从当前线程移除、采样线程退出
+    tracker = g.pop('query_tracker', None)
+    if tracker is not None:
+        tracker.stop()
+    session = g.pop('profile_session', None)
+    if session is not None:
+        session.stop()
 
 # ============ 配置数据 ============
 # 页面配置
@@ -182,47 +103,35 @@ def index():
 
 # ============ API 路由 ============
 
-@app.route('/api/stocks/both')
-def api_stocks_both():
-    """API: 同时获取10日和30日偏离值榜数据（智能缓存策略）"""
-    try:
-        cache_mgr = CacheManager()
-        current_hour = datetime.now().hour
-
-        # 确定要查询的缓存 key
-        # 如果在 17 点之前，查询上一天的数据；否则查询当天的数据
-        if current_hour < 17:
-            cache_key = 'stocks_both_prev'
-            logger.info(f"当前时间 {current_hour}:00，查询上一天的缓存数据")
-        else:
-            cache_key = 'stocks_both'
-            logger.info(f"当前时间 {current_hour}:00，查询当天的缓存数据")
+def _get_board_cache(base_key):
+    """从缓存读取刷新进程发布的最新一版双榜数据"""
+    cached_data, generation = get_published(base_key)
+    if cached_data:
+        logger.debug(f"API 从缓存获取双榜数据 (key: {base_key}, generation: {generation})")
+    else:
+        # Web 进程不触发刷新，等待刷新进程发布
+        logger.warning(f"API 缓存未命中 (key: {base_key}, generation: {generation})，等待刷新进程发布数据")
+    return cached_data, generation
 
-        # 尝试从缓存获取数据
-        cached_data = cache_mgr.get(cache_key)
 
-        if cached_data:
-            logger.info(f"API 从缓存获取双榜数据 (key: {cache_key})")
-            return jsonify({
-                'code': 0,
-                'message': 'success',
-                'data': cached_data,
-                'count': {
-                    '10': len(cached_data.get('stocks_10', [])),
-                    '30': len(cached_data.get('stocks_30', []))
-                },
-                'from_cache': True
-            })
+def _not_modified(generation):
+    """请求头 If-None-Match 与当前数据版本一致时返回 304 响应，否则返回 None"""
+    if generation and request.if_none_match.contains(generation):
+        response = Response(status=304)
+        response.set_etag(generation)
+        return response
+    return None
 
-        # 缓存未命中，执行 refresh_data 填充缓存
-        logger.warning(f"API 缓存未命中 (key: {cache_key})，执行 refresh_data 填充缓存")
-        refresh_data()
 
-        # 再次尝试从缓存获取数据
-        cached_data = cache_mgr.get(cache_key)
+def _board_response(base_key):
+    """双榜接口的统一响应（ETag 为数据版本号，客户端版本未变时返回 304）"""
+    try:
+        not_modified = _not_modified(get_data_generation())
+        if not_modified is not None:
+            return not_modified
+        cached_data, generation = _get_board_cache(base_key)
         if cached_data:
-            logger.info(f"API 从新填充的缓存获取双榜数据 (key: {cache_key})")
-            return jsonify({
+            response = jsonify({
                 'code': 0,
                 'message': 'success',
                 'data': cached_data,
@@ -230,11 +139,13 @@ def api_stocks_both():
                     '10': len(cached_data.get('stocks_10', [])),
                     '30': len(cached_data.get('stocks_30', []))
                 },
+                'generation': generation,
                 'from_cache': True
             })
+            response.set_etag(generation)
+            return response
 
-        # 缓存仍未命中，返回空数据
-        logger.warning("API 缓存仍未命中，返回空数据")
+        # 缓存未命中，返回空数据
         return jsonify({
             'code': 0,
             'message': 'no cache',
@@ -254,6 +165,375 @@ def api_stocks_both():
         }), 500
 
 
+@app.route('/api/stocks/both')
+def api_stocks_both():
+    """API: 同时获取10日和30日偏离值榜数据（含完整价格数据）"""
+    return _board_response(CACHE_KEY_BOTH)
+
+
+@app.route('/api/stocks/both/summary')
+def api_stocks_both_summary():
+    """API: 精简双榜，仅包含汇总指标和预计算的 T+1~T+5 数据，价格数据通过详情接口获取"""
+    return _board_response(CACHE_KEY_SUMMARY)
+
+
+@app.route('/api/stocks/both/delta')
+def api_stocks_both_delta():
+    """
+    API: 双榜增量，只返回相对客户端版本上榜、下榜和变化的行（价格数组只给出新追加的点）
+
+    查询参数:
+        since: 客户端持有的数据版本号，缺省时取请求头 If-None-Match
+        summary: 1 时基于精简榜单，默认 0（完整榜单，含价格数组）
+
+    since 为上一版本时 mode=delta；为当前版本时 mode=unchanged（通过 If-None-Match 请求时返回 304）；
+    过旧或未知时 mode=full，data 为完整双榜
+    """
+    try:
+        try:
+            summary = _arg_bool('summary', False)
+        except ValueError as e:
+            return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+        since = request.args.get('since') or None
+        from_header = since is None
+        if from_header and request.if_none_match:
+            since = next(iter(request.if_none_match), None)
+
+        base_key = CACHE_KEY_SUMMARY if summary else CACHE_KEY_BOTH
+        mode, data, generation = get_board_delta(base_key, since)
+        if mode == DELTA_MODE_UNCHANGED and from_header:
+            return _not_modified(generation)
+        response = jsonify({
+            'code': 0,
+            'message': 'success' if generation else 'no cache',
+            'mode': mode,
+            'since': since,
+            'generation': generation,
+            'data': data,
+        })
+        if generation:
+            response.set_etag(generation)
+        return response
+    except Exception as e:
+        logger.error(f"API 获取增量双榜失败: {e}")
+        return jsonify({'code': 500, 'message': str(e), 'data': None}), 500
+
+
+def _arg_bool(name, default):
+    """解析布尔查询参数：1/true/yes/on 为真，0/false/no/off 为假"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    value = value.strip().lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"参数 {name} 不是合法的布尔值: {value}")
+
+
+def _arg_int(name, default):
+    """解析整数查询参数（不合法时报错，而不是像 type=int 那样静默使用默认值）"""
+    value = request.args.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"参数 {name} 不是合法的整数: {value}") from None
+
+
+def _arg_float(name, default):
+    """解析数值查询参数（不合法或非有限值时报错）"""
+    value = request.args.get(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"参数 {name} 不是合法的数值: {value}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"参数 {name} 不是合法的数值: {value}")
+    return number
+
+
+@app.route('/api/stocks/board')
+def api_stocks_board():
+    """
+    API: 参数化偏离值榜
+
+    查询参数（含义同 StockMonitor.query_stocks）:
+        n: 过去 n 个交易日，默认 10
+        threshold: 异动阈值（%），默认按 n 取 10日榜 100 / 30日榜 200
+        is_sg: 是否包含新股，默认 0
+        include_cyb / include_kcb / include_bj: 是否包含创业板/科创板/北交所，默认 1/0/0
+        top_n: 返回数量，默认 50
+    """
+    try:
+        try:
+            n = _arg_int('n', 10)
+            threshold = _arg_float('threshold', None)
+            top_n = _arg_int('top_n', BOARD_TOP_N)
+            is_sg = _arg_bool('is_sg', False)
+            include_cyb = _arg_bool('include_cyb', True)
+            include_kcb = _arg_bool('include_kcb', False)
+            include_bj = _arg_bool('include_bj', False)
+            if not 2 <= n <= BOARD_MAX_N:
+                raise ValueError(f"n 取值范围为 2 ~ {BOARD_MAX_N}")
+            if not 1 <= top_n <= BOARD_MAX_RESULTS:
+                raise ValueError(f"top_n 取值范围为 1 ~ {BOARD_MAX_RESULTS}")
+        except ValueError as e:
+            return jsonify({'code': 400, 'message': str(e), 'data': []}), 400
+
+        rows, params, generation, from_cache = get_board(
+            n, threshold=threshold, is_sg=is_sg, include_cyb=include_cyb,
+            include_kcb=include_kcb, include_bj=include_bj, top_n=top_n
+        )
+        return jsonify({
+            'code': 0,
+            'message': 'success',
+            'data': rows,
+            'count': len(rows),
+            'params': params,
+            'generation': generation,
+            'from_cache': from_cache
+        })
+    except Exception as e:
+        logger.error(f"API 获取参数化榜单失败: {e}")
+        return jsonify({
+            'code': 500,
+            'message': str(e),
+            'data': []
+        }), 500
+
+
+def _arg_date(name):
+    """解析 YYYYMMDD 日期查询参数"""
+    value = request.args.get(name) or None
+    if value is not None and not (len(value) == 8 and value.isdigit()):
+        raise ValueError(f"参数 {name} 应为 YYYYMMDD 格式: {value}")
+    return value
+
+
+@app.route('/api/stocks/window')
+def api_stocks_window():
+    """
+    API: 任意窗口的偏离值排行（基于区间索引，不重新扫描日线）
+
+    查询参数:
+        n: 窗口交易日数（与 start_date 二选一）
+        start_date / end_date: 窗口起止日期 YYYYMMDD，end_date 默认最新交易日
+        threshold / is_sg / include_cyb / include_kcb / include_bj / top_n: 同 /api/stocks/board
+        order_by: 排序字段 deviation（默认）或 price_change_low_pct
+    """
+    try:
+        try:
+            n = _arg_int('n', None)
+            start_date = _arg_date('start_date')
+            end_date = _arg_date('end_date')
+            threshold = _arg_float('threshold', None)
+            top_n = _arg_int('top_n', BOARD_TOP_N)
+            order_by = request.args.get('order_by', 'deviation')
+            is_sg = _arg_bool('is_sg', False)
+            include_cyb = _arg_bool('include_cyb', True)
+            include_kcb = _arg_bool('include_kcb', False)
+            include_bj = _arg_bool('include_bj', False)
+            if n is None and start_date is None:
+                raise ValueError("需要指定 n 或 start_date")
+            if n is not None and n < 2:
+                raise ValueError("n 至少为 2")
+            if not 1 <= top_n <= BOARD_MAX_RESULTS:
+                raise ValueError(f"top_n 取值范围为 1 ~ {BOARD_MAX_RESULTS}")
+            if order_by not in RANKING_ORDER_FIELDS:
+                raise ValueError(f"order_by 仅支持 {', '.join(RANKING_ORDER_FIELDS)}")
+            rows, params, generation = get_window_ranking(
+                n, start_date=start_date, end_date=end_date, threshold=threshold, is_sg=is_sg,
+                include_cyb=include_cyb, include_kcb=include_kcb, include_bj=include_bj,
+                top_n=top_n, order_by=order_by
+            )
+        except ValueError as e:
+            return jsonify({'code': 400, 'message': str(e), 'data': []}), 400
+
+        return jsonify({
+            'code': 0,
+            'message': 'success',
+            'data': rows,
+            'count': len(rows),
+            'params': params,
+            'generation': generation
+        })
+    except Exception as e:
+        logger.error(f"API 获取窗口排行失败: {e}")
+        return jsonify({
+            'code': 500,
+            'message': str(e),
+            'data': []
+        }), 500
+
+
+@app.route('/api/stocks/<ts_code>/detail')
+def api_stock_detail(ts_code):
+    """API: 获取单只股票的 n 日价格数据和 T+n 数据（n=10 或 30）"""
+    try:
+        try:
+            n = _arg_int('n', 10)
+        except ValueError as e:
+            return jsonify({'code': 400, 'message': str(e), 'data': None}), 400
+        if n not in BOARD_THRESHOLDS:
+            return jsonify({
+                'code': 400,
+                'message': f"n 仅支持 {', '.join(str(k) for k in BOARD_THRESHOLDS)}",
+                'data': None
+            }), 400
+
+        detail, from_cache = get_stock_detail(ts_code.upper(), n)
+        if detail is None:
+            return jsonify({'code': 404, 'message': f'未找到 {ts_code}', 'data': None}), 404
+
+        return jsonify({
+            'code': 0,
+            'message': 'success',
+            'data': detail,
+            'from_cache': from_cache
+        })
+    except Exception as e:
+        logger.error(f"API 获取 {ts_code} 详情失败: {e}")
+        return jsonify({
+            'code': 500,
+            'message': str(e),
+            'data': None
+        }), 500
+
+
+def _arg_list(name):
+    """解析逗号分隔的列表查询参数，未指定时返回 None"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()] or None
+
+
+def _arg_ts_codes():
+    codes = _arg_list('ts_codes')
+    return [code.upper() for code in codes] if codes else None
+
+
+def _export_response(chunks, fmt, filename, headers=None):
+    """流式导出的统一响应（逐块发送，不设置 Content-Length）"""
+    headers = dict(headers or {})
+    headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    headers['X-Accel-Buffering'] = 'no'
+    return Response(chunks, mimetype=MIMETYPES[fmt], headers=headers)
+
+
+@app.route('/api/export/daily')
+def api_export_daily():
+    """
+    API: 流式导出日线（热表 + 冷数据归档），按 trade_date、ts_code 排序
+
+    查询参数:
+        ts_codes: 逗号分隔的股票代码，默认全部
+        markets: 逗号分隔的市场（主板/创业板/科创板/北交所），默认全部
+        start_date / end_date: 日期区间 YYYYMMDD（含两端），默认不限
+        columns: 逗号分隔的列，默认全部列
+        format: csv（默认）或 ndjson
+    """
+    try:
+        fmt = check_format(request.args.get('format'))
+        ts_codes = _arg_ts_codes()
+        markets = _arg_list('markets')
+        start_date = _arg_date('start_date')
+        end_date = _arg_date('end_date')
+        columns = _arg_list('columns') or ARCHIVE_COLUMNS
+        unknown = [column for column in columns if column not in ARCHIVE_COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的列: {', '.join(unknown)}")
+        if start_date and end_date and start_date > end_date:
+            raise ValueError("start_date 不能晚于 end_date")
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e), 'data': []}), 400
+
+    chunks = export_daily(ts_codes, start_date, end_date, markets, fmt, columns)
+    return _export_response(chunks, fmt, f"daily_{start_date or 'all'}_{end_date or 'latest'}")
+
+
+@app.route('/api/export/board')
+def api_export_board():
+    """
+    API: 流式导出全市场 n 日榜（不截断），按偏离值从高到低排序
+
+    查询参数:
+        n: 过去 n 个交易日，默认 10
+        is_sg / include_cyb / include_kcb / include_bj: 同 /api/stocks/board
+        ts_codes: 逗号分隔的股票代码，默认全部
+        format: csv（默认）或 ndjson
+    """
+    try:
+        try:
+            fmt = check_format(request.args.get('format'))
+            n = _arg_int('n', 10)
+            is_sg = _arg_bool('is_sg', False)
+            markets = board_markets(_arg_bool('include_cyb', True), _arg_bool('include_kcb', False),
+                                    _arg_bool('include_bj', False))
+            ts_codes = _arg_ts_codes()
+            if not 2 <= n <= BOARD_MAX_N:
+                raise ValueError(f"n 取值范围为 2 ~ {BOARD_MAX_N}")
+        except ValueError as e:
+            return jsonify({'code': 400, 'message': str(e), 'data': []}), 400
+
+        generation = get_data_generation()
+        universe = get_board_universe(n, is_sg, generation)
+        chunks = export_board(universe, markets, ts_codes, fmt)
+        return _export_response(chunks, fmt, f"board_{n}_{generation or 'latest'}",
+                                headers={'X-Data-Generation': generation or ''})
+    except Exception as e:
+        logger.error(f"API 导出榜单失败: {e}")
+        return jsonify({'code': 500, 'message': str(e), 'data': []}), 500
+
+
+# 数据水位在进程内缓存的秒数（/api/status 供负载均衡和前端轮询）
+STATUS_CACHE_SECONDS = 5
+_watermark_cache = {'expires': 0.0, 'value': None}
+
+
+def _get_watermarks():
+    if time.monotonic() >= _watermark_cache['expires']:
+        session = get_read_session()
+        try:
+            _watermark_cache['value'] = get_data_watermarks(session)
+        finally:
+            close_session(session)
+        _watermark_cache['expires'] = time.monotonic() + STATUS_CACHE_SECONDS
+    return _watermark_cache['value']
+
+
+@app.route('/api/status')
+def api_status():
+    """API: 数据新鲜度（发布版本、各表最新交易日、日历覆盖范围）和刷新进度，只读，不触发刷新"""
+    try:
+        generation = get_generation_info()
+        return jsonify({
+            'code': 0,
+            'message': 'success',
+            'data': {
+                'generation': generation.get('generation') if generation else None,
+                'board_end_date': generation.get('end_date') if generation else None,
+                'board_computed_at': generation.get('computed_at') if generation else None,
+                'watermarks': _get_watermarks(),
+                'snapshot': SNAPSHOT_READER.current(),
+                'refresh': read_status(),
+                'server_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            }
+        })
+    except Exception as e:
+        logger.error(f"API 获取状态失败: {e}")
+        return jsonify({
+            'code': 500,
+            'message': str(e),
+            'data': None
+        }), 500
+
+
 @app.route('/api/changelog')
 def api_changelog():
     """API: 获取更新日志"""
@@ -277,13 +557,10 @@ def get_changelog():
     return CHANGELOG
 
 
-# 启动定时任务（无论用什么方式启动都会执行）
-scheduler.add_job(refresh_data, 'cron', hour=17, minute=0)
-scheduler.start()
-
-# 应用启动时立即刷新一次数据
-refresh_data()
-logger.info("定时任务已启动，每天 17:00 自动刷新数据")
+@app.route('/metrics')
+def metrics():
+    """Prometheus 指标：合并所有 Web worker 和刷新进程的快照"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 # ============ SPA 路由处理 ============
@@ -307,5 +584,6 @@ def serve_spa(path):
 if __name__ == '__main__':
     logger.info("Flask 应用启动 - 使用前后端一体化模式")
     logger.info("访问地址: http://127.0.0.1:5000")
+    logger.info("数据刷新请另行启动刷新进程: python -m refresh_worker")
     app.run(debug=True, host='127.0.0.1', port=5000)
 
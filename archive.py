@@ -0,0 +1,480 @@
+"""
+日线冷数据归档模块
+stock_daily_data 只保留最近 ARCHIVE_HOT_DAYS 个交易日（热数据），更早的日线按年 / 月分区写成
+zstd 压缩的 Parquet（ARCHIVE_DIR/year=YYYY/month=MM/data.parquet，按 ts_code、trade_date 排序，
+带行组 min / max 统计），再从 SQLite 删除。热表至少保留 MIN_HOT_DAYS 个交易日，
+榜单（n 最大 120）和区间索引只读热表，不受影响。
+
+归档顺序保证任何时刻都能读到完整数据：先写分区文件（临时文件 + rename），再更新清单
+ARCHIVE_DIR/_manifest.json 中的分界日期 cutoff，最后按月删除热表中早于 cutoff 的行。
+中途失败时两边可能暂时重复，读取时以热表为准，下次归档会继续删除。
+
+get_daily_bars() 透明地读取热表和冷数据：查询区间早于 cutoff 时才访问 Parquet，
+且只打开与区间相交的月份分区；股票代码和日期条件下推给 DuckDB，按行组统计跳过无关数据。
+iter_daily_bars() 是它的流式版本（导出接口使用），按日期逐批读取、归并两边，内存占用与结果大小无关。
+
+ARCHIVE_HOT_DAYS 为 0（默认）时不归档。写入和读取冷数据需要 duckdb（可选依赖组 analytics）。
+
+    python archive.py run [--hot-days 250] [--vacuum]   # 归档
+    python archive.py status                            # 查看分界日期和各分区行数
+    python archive.py query 000001.SZ --start 20200101 --end 20201231
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func, select, text
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from database import (
+    engine, get_session, close_session, get_db_path, write_json_atomic, StockDailyData, TradeCal
+)
+from analytics import AnalyticsUnavailable, import_duckdb, attach_sqlite, sql_path
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join('data', 'archive', 'stock_daily_data'))
+# 热表保留的交易日数，0 表示不归档
+ARCHIVE_HOT_DAYS = int(os.getenv('ARCHIVE_HOT_DAYS', '0'))
+# 热表至少保留的交易日数：参数化榜单和导出（/api/stocks/board、/api/export/board，n 最大为
+# board_service.BOARD_MAX_N=120）只读热表，区间索引默认覆盖 RANGE_INDEX_DAYS=250 个交易日
+MIN_HOT_DAYS = 250
+# 判断交易日使用的交易所
+ARCHIVE_EXCHANGE = 'SSE'
+MANIFEST_NAME = '_manifest.json'
+PARTITION_FILE = 'data.parquet'
+# Parquet 行组大小（行），行组越小按股票代码跳过的数据越精细
+ROW_GROUP_SIZE = 100000
+# 归档的列（不含自增 id 和创建 / 更新时间）
+ARCHIVE_COLUMNS = ('ts_code', 'trade_date', 'open', 'high', 'low', 'close', 'pre_close',
+                   'change', 'pct_chg', 'vol', 'amount')
+_KEY_COLUMNS = ('ts_code', 'trade_date')
+_ARCHIVE_SCHEMA = ', '.join(f"{column} {'VARCHAR' if column in _KEY_COLUMNS else 'DOUBLE'}"
+                            for column in ARCHIVE_COLUMNS)
+
+
+# ---------- 清单和分区 ----------
+
+_manifest_cache = {}
+
+
+def read_manifest(archive_dir=None):
+    """
+    读取归档清单（按文件修改时间缓存）
+
+    返回:
+        {'cutoff': 'YYYYMMDD', 'archived_at', 'partitions': {'YYYYMM': 行数}}，尚未归档时返回 None
+    """
+    path = os.path.join(archive_dir or ARCHIVE_DIR, MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    cached = _manifest_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"读取归档清单失败: {e}")
+        return None
+    _manifest_cache[path] = (mtime, manifest)
+    return manifest
+
+
+def _partition_path(archive_dir, month):
+    return os.path.join(archive_dir, f"year={month[:4]}", f"month={month[4:]}", PARTITION_FILE)
+
+
+def _next_month(month):
+    year, mon = int(month[:4]), int(month[4:])
+    return f"{year + mon // 12:04d}{mon % 12 + 1:02d}"
+
+
+def _partitions_in_range(manifest, archive_dir, start_date, end_date):
+    """与 [start_date, end_date] 相交的分区文件（分区裁剪）"""
+    months = sorted(manifest.get('partitions') or {})
+    return [_partition_path(archive_dir, month) for month in months
+            if (not start_date or month >= start_date[:6]) and (not end_date or month <= end_date[:6])]
+
+
+# ---------- 归档 ----------
+
+def hot_cutoff(session, hot_days):
+    """
+    热表的起始交易日：最新日线往前第 hot_days 个交易日，早于该日的日线会被归档
+
+    返回:
+        'YYYYMMDD'，数据不足时返回 None
+    """
+    latest = session.query(func.max(StockDailyData.trade_date)).scalar()
+    if not latest:
+        return None
+    row = session.query(TradeCal.cal_date).filter(
+        TradeCal.exchange == ARCHIVE_EXCHANGE,
+        TradeCal.is_open == '1',
+        TradeCal.cal_date <= latest
+    ).order_by(TradeCal.cal_date.desc()).offset(hot_days - 1).first()
+    return row[0] if row else None
+
+
+def _load_hot_rows(con, attached, db_path, start_date, end_date):
+    """把热表中 [start_date, end_date) 的日线读入 DuckDB 临时表 hot_rows"""
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    if attached:
+        con.execute(f"CREATE OR REPLACE TEMP TABLE hot_rows AS SELECT {columns} FROM src.stock_daily_data "
+                    f"WHERE trade_date >= $start AND trade_date < $end", {'start': start_date, 'end': end_date})
+        return
+
+    import sqlite3
+    import pandas as pd
+
+    con.execute(f"CREATE OR REPLACE TEMP TABLE hot_rows ({_ARCHIVE_SCHEMA})")
+    src = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+    try:
+        frame = pd.read_sql_query(f"SELECT {columns} FROM stock_daily_data WHERE trade_date >= ? AND trade_date < ?",
+                                  src, params=(start_date, end_date))
+    finally:
+        src.close()
+    con.register('hot_batch', frame)
+    con.execute("INSERT INTO hot_rows BY NAME SELECT * FROM hot_batch")
+    con.unregister('hot_batch')
+
+
+def _write_partition(con, attached, db_path, archive_dir, month, cutoff):
+    """
+    把热表中该月早于 cutoff 的日线合并进月份分区（已有分区中同一股票同一天的行以热表为准）
+
+    返回:
+        (本次归档的行数, 分区总行数)
+    """
+    _load_hot_rows(con, attached, db_path, f"{month}01", min(cutoff, f"{_next_month(month)}01"))
+    moved = con.execute("SELECT COUNT(*) FROM hot_rows").fetchone()[0]
+
+    path = _partition_path(archive_dir, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    source = "SELECT * FROM hot_rows"
+    if os.path.exists(path):
+        source += (f" UNION ALL SELECT {', '.join(ARCHIVE_COLUMNS)} FROM read_parquet({sql_path(path)}) c "
+                   f"WHERE NOT EXISTS (SELECT 1 FROM hot_rows h "
+                   f"WHERE h.ts_code = c.ts_code AND h.trade_date = c.trade_date)")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    con.execute(f"COPY ({source} ORDER BY ts_code, trade_date) TO {sql_path(tmp_path)} "
+                f"(FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {ROW_GROUP_SIZE})")
+    total = con.execute(f"SELECT COUNT(*) FROM read_parquet({sql_path(tmp_path)})").fetchone()[0]
+    if total < moved:
+        os.remove(tmp_path)
+        raise RuntimeError(f"分区 {month} 写入行数 {total} 少于待归档行数 {moved}")
+    os.replace(tmp_path, path)
+    return moved, total
+
+
+def _vacuum():
+    """归档删除大量行后回收数据库文件空间（需要独占数据库，耗时与库大小相关）"""
+    started = time.perf_counter()
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("VACUUM"))
+    logger.info(f"VACUUM 完成，耗时 {time.perf_counter() - started:.1f}s")
+
+
+def archive_daily(session=None, hot_days=None, archive_dir=None, vacuum=False):
+    """
+    把早于热数据窗口的日线归档到 Parquet 并从 stock_daily_data 删除
+
+    参数:
+        session: 主库会话，默认新建
+        hot_days: 热表保留的交易日数，默认 ARCHIVE_HOT_DAYS；为 0 时不归档，小于 MIN_HOT_DAYS 时按 MIN_HOT_DAYS
+        archive_dir: 归档目录，默认 ARCHIVE_DIR
+        vacuum: 删除后是否 VACUUM
+
+    返回:
+        {'YYYYMM': 归档行数}，没有需要归档的数据时为空 dict
+    """
+    hot_days = ARCHIVE_HOT_DAYS if hot_days is None else hot_days
+    if hot_days <= 0:
+        logger.info("未设置 ARCHIVE_HOT_DAYS，跳过日线归档")
+        return {}
+    if hot_days < MIN_HOT_DAYS:
+        logger.warning(f"热表保留 {hot_days} 个交易日不足以覆盖榜单和区间索引，改为 {MIN_HOT_DAYS}")
+        hot_days = MIN_HOT_DAYS
+    archive_dir = archive_dir or ARCHIVE_DIR
+    duckdb = import_duckdb()
+
+    own_session = session is None
+    session = session or get_session()
+    try:
+        cutoff = hot_cutoff(session, hot_days)
+        if not cutoff:
+            logger.info("交易日历或日线数据不足，跳过日线归档")
+            return {}
+        months = [row[0] for row in session.query(func.substr(StockDailyData.trade_date, 1, 6)).filter(
+            StockDailyData.trade_date < cutoff
+        ).distinct().order_by(func.substr(StockDailyData.trade_date, 1, 6)).all()]
+        if not months:
+            logger.info(f"没有早于 {cutoff} 的日线，无需归档")
+            return {}
+
+        # 1. 写分区文件
+        manifest = dict(read_manifest(archive_dir) or {'cutoff': None, 'partitions': {}})
+        partitions = dict(manifest.get('partitions') or {})
+        con = duckdb.connect(':memory:')
+        try:
+            db_path = get_db_path()
+            try:
+                attach_sqlite(con, db_path)
+                attached = True
+            except AnalyticsUnavailable as e:
+                logger.info(f"{e}，改用 pandas 读取待归档日线")
+                attached = False
+            for month in months:
+                moved, partitions[month] = _write_partition(con, attached, db_path, archive_dir, month, cutoff)
+                logger.info(f"已归档 {month}: {moved} 行，分区共 {partitions[month]} 行")
+        finally:
+            con.close()
+
+        # 2. 更新清单，此后读取早于 cutoff 的日线走 Parquet
+        write_json_atomic(os.path.join(archive_dir, MANIFEST_NAME), {
+            'cutoff': max(cutoff, manifest.get('cutoff') or ''),
+            'archived_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'partitions': partitions,
+        })
+
+        # 3. 按月删除热表中已归档的行
+        archived = {}
+        for month in months:
+            archived[month] = session.query(StockDailyData).filter(
+                StockDailyData.trade_date >= f"{month}01",
+                StockDailyData.trade_date < min(cutoff, f"{_next_month(month)}01")
+            ).delete(synchronize_session=False)
+            session.commit()
+        logger.info(f"日线归档完成: 早于 {cutoff} 的 {sum(archived.values())} 行已移至 {archive_dir}")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if own_session:
+            close_session(session)
+
+    if vacuum:
+        _vacuum()
+    return archived
+
+
+# ---------- 读取 ----------
+
+class _ColdReader:
+    """读取冷数据的 DuckDB 连接（每个进程一个，第一次读冷数据时创建）"""
+
+    def __init__(self):
+        self._con = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def cursor(self):
+        with self._lock:
+            if self._con is None or self._pid != os.getpid():
+                self._con = import_duckdb().connect(':memory:')
+                self._pid = os.getpid()
+            return self._con.cursor()
+
+    def fetch(self, paths, columns, ts_codes, start_date, end_date, cutoff):
+        conditions = ["trade_date < ?"]
+        params = [cutoff]
+        if start_date:
+            conditions.append("trade_date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("trade_date <= ?")
+            params.append(end_date)
+        if ts_codes:
+            conditions.append(f"ts_code IN ({', '.join('?' * len(ts_codes))})")
+            params.extend(ts_codes)
+        sql = (f"SELECT {', '.join(columns)} FROM read_parquet([{', '.join(sql_path(p) for p in paths)}]) "
+               f"WHERE {' AND '.join(conditions)}")
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql, params)
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+
+    def iter_month(self, path, columns, ts_codes, start_date, end_date, cutoff, batch_rows):
+        """逐批读取一个分区，按 trade_date、ts_code 排序，产出元组"""
+        conditions = ["trade_date < ?"]
+        params = [cutoff]
+        if start_date:
+            conditions.append("trade_date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("trade_date <= ?")
+            params.append(end_date)
+        if ts_codes:
+            conditions.append(f"ts_code IN ({', '.join('?' * len(ts_codes))})")
+            params.extend(ts_codes)
+        sql = (f"SELECT {', '.join(columns)} FROM read_parquet({sql_path(path)}) "
+               f"WHERE {' AND '.join(conditions)} ORDER BY trade_date, ts_code")
+        cursor = self.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+
+_cold_reader = _ColdReader()
+
+
+def _fetch_hot(session, columns, ts_codes, start_date, end_date):
+    query = session.query(*[getattr(StockDailyData, column) for column in columns])
+    if ts_codes:
+        query = query.filter(StockDailyData.ts_code.in_(ts_codes))
+    if start_date:
+        query = query.filter(StockDailyData.trade_date >= start_date)
+    if end_date:
+        query = query.filter(StockDailyData.trade_date <= end_date)
+    return [dict(zip(columns, row)) for row in query.all()]
+
+
+def get_daily_bars(session, ts_codes=None, start_date=None, end_date=None, columns=ARCHIVE_COLUMNS,
+                   archive_dir=None):
+    """
+    读取日线（热表 + 冷数据归档）
+
+    参数:
+        session: 数据库会话（主库或只读快照）
+        ts_codes: 股票代码或代码列表，None 表示全部股票
+        start_date / end_date: 日期区间（含两端，YYYYMMDD），None 表示不限
+        columns: 返回的列（ARCHIVE_COLUMNS 的子集，总会包含 ts_code 和 trade_date）
+        archive_dir: 归档目录，默认 ARCHIVE_DIR
+
+    返回:
+        dict 列表，按 ts_code、trade_date 排序；同一股票同一天在两边都有时以热表为准
+    """
+    if isinstance(ts_codes, str):
+        ts_codes = [ts_codes]
+    columns = list(dict.fromkeys(_KEY_COLUMNS + tuple(columns)))
+    rows = _fetch_hot(session, columns, ts_codes, start_date, end_date)
+
+    archive_dir = archive_dir or ARCHIVE_DIR
+    manifest = read_manifest(archive_dir)
+    cutoff = manifest and manifest.get('cutoff')
+    if cutoff and not (start_date and start_date >= cutoff):
+        paths = [path for path in _partitions_in_range(manifest, archive_dir, start_date, end_date)
+                 if os.path.exists(path)]
+        if paths:
+            hot_keys = {(row['ts_code'], row['trade_date']) for row in rows}
+            cold = _cold_reader.fetch(paths, columns, ts_codes, start_date, end_date, cutoff)
+            rows.extend(row for row in cold if (row['ts_code'], row['trade_date']) not in hot_keys)
+
+    rows.sort(key=lambda row: (row['ts_code'], row['trade_date']))
+    return rows
+
+
+def _iter_hot(session, columns, ts_codes, start_date, end_date, batch_rows):
+    query = select(*[getattr(StockDailyData, column) for column in columns])
+    if ts_codes:
+        query = query.where(StockDailyData.ts_code.in_(ts_codes))
+    if start_date:
+        query = query.where(StockDailyData.trade_date >= start_date)
+    if end_date:
+        query = query.where(StockDailyData.trade_date <= end_date)
+    query = query.order_by(StockDailyData.trade_date, StockDailyData.ts_code)
+    result = session.execute(query.execution_options(yield_per=batch_rows))
+    for partition in result.partitions():
+        yield from (tuple(row) for row in partition)
+
+
+def iter_daily_bars(session, ts_codes=None, start_date=None, end_date=None, columns=ARCHIVE_COLUMNS,
+                    archive_dir=None, batch_rows=5000):
+    """
+    流式读取日线（热表 + 冷数据归档），不在内存中保留完整结果
+
+    热表按 trade_date 索引逐批读取，冷数据按月份分区逐个读取，两路按 (trade_date, ts_code)
+    归并，同一股票同一天在两边都有时以热表为准。参数含义同 get_daily_bars。
+
+    返回:
+        元组迭代器（列顺序同 columns，总以 ts_code、trade_date 开头），按 trade_date、ts_code 排序
+    """
+    if isinstance(ts_codes, str):
+        ts_codes = [ts_codes]
+    columns = list(dict.fromkeys(_KEY_COLUMNS + tuple(columns)))
+    hot = _iter_hot(session, columns, ts_codes, start_date, end_date, batch_rows)
+
+    archive_dir = archive_dir or ARCHIVE_DIR
+    manifest = read_manifest(archive_dir)
+    cutoff = manifest and manifest.get('cutoff')
+    paths = []
+    if cutoff and not (start_date and start_date >= cutoff):
+        paths = [path for path in _partitions_in_range(manifest, archive_dir, start_date, end_date)
+                 if os.path.exists(path)]
+    if not paths:
+        yield from hot
+        return
+
+    # 分区按月份升序，逐个读取即整体有序
+    cold = (row for path in paths
+            for row in _cold_reader.iter_month(path, columns, ts_codes, start_date, end_date, cutoff, batch_rows))
+    last_key = None
+    for key, _, row in heapq.merge((((row[1], row[0]), 0, row) for row in hot),
+                                   (((row[1], row[0]), 1, row) for row in cold)):
+        if key != last_key:
+            last_key = key
+            yield row
+
+
+# ---------- 命令行 ----------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日线冷数据归档")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="归档早于热数据窗口的日线")
+    run.add_argument('--hot-days', type=int, default=ARCHIVE_HOT_DAYS or None,
+                     help=f"热表保留的交易日数，默认 ARCHIVE_HOT_DAYS（{ARCHIVE_HOT_DAYS}）")
+    run.add_argument('--vacuum', action='store_true', help="删除后 VACUUM 回收空间")
+    sub.add_parser('status', help="查看归档分界日期和分区")
+    query = sub.add_parser('query', help="读取一只股票的日线（热表 + 归档）")
+    query.add_argument('ts_code')
+    query.add_argument('--start')
+    query.add_argument('--end')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'run':
+            archived = archive_daily(hot_days=args.hot_days or 0, vacuum=args.vacuum)
+            print(f"已归档 {sum(archived.values())} 行: {archived}")
+        elif args.command == 'status':
+            manifest = read_manifest()
+            if not manifest:
+                print(f"{ARCHIVE_DIR} 下尚无归档")
+                return 0
+            partitions = manifest.get('partitions') or {}
+            print(f"分界日期 {manifest.get('cutoff')}，最近归档 {manifest.get('archived_at')}，"
+                  f"{len(partitions)} 个分区共 {sum(partitions.values())} 行")
+            for month, rows in sorted(partitions.items()):
+                print(f"  {month}: {rows}")
+        elif args.command == 'query':
+            session = get_session()
+            try:
+                started = time.perf_counter()
+                rows = get_daily_bars(session, args.ts_code, args.start, args.end)
+            finally:
+                close_session(session)
+            for row in rows:
+                print(row)
+            print(f"{len(rows)} 行，{(time.perf_counter() - started) * 1000:.1f}ms")
+    except AnalyticsUnavailable as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
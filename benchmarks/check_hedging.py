@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+日线对冲请求校验
+
+用本地桩数据源（StubProvider，按函数名模拟各数据源的延迟、失败和返回）驱动
+daily_sources.HedgedDailyFetcher，不访问网络、不需要回放存储，校验：
+
+- 主源超过 P90 等待时间仍未返回时才发出对冲请求，且不早于 P90
+- 先返回有效结果的数据源胜出；无效结果（日期重复等）不会胜出
+- 主源报错时立即切换到备用源，不等待 P90
+- 对冲预算用尽时不再对冲，只等待主源
+- 各数据源的返回统一为 DAILY_COLUMNS，pre_close / change / pct_chg 由相邻收盘价计算
+- 所有数据源都失败时抛出 DailySourcesError
+
+任一项不通过时以非 0 退出，可直接用于 CI。
+
+用法:
+    python benchmarks/check_hedging.py
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pandas as pd
+from daily_sources import (
+    DAILY_COLUMNS, DailySourcesError, HedgedDailyFetcher, LatencyTracker,
+    SOURCE_SINA, SOURCE_TENCENT, SOURCES,
+)
+
+TS_CODE = '000001.SZ'
+START_DATE = '20250102'
+END_DATE = '20250106'
+# 桩数据源中主源的 P90 耗时（秒）和慢请求耗时（秒）；两者相差足够大，CPU 繁忙时也能区分先后
+PRIMARY_P90 = 0.15
+PRIMARY_SLOW = 0.8
+# 对冲请求发出时间允许的误差（秒）
+LAUNCH_TOLERANCE = 0.25
+
+SINA_FUNC = SOURCES[SOURCE_SINA].func_name
+TENCENT_FUNC = SOURCES[SOURCE_TENCENT].func_name
+
+
+class StubProvider:
+    """按函数名返回预设结果的桩数据源：{func_name: (延迟秒数, DataFrame 或异常)}，记录每次调用的开始时间"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def call(self, func_name, **kwargs):
+        with self._lock:
+            self.calls.append((func_name, time.perf_counter() - self._started))
+        delay, result = self.responses[func_name]
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result.copy()
+
+    def started_at(self, func_name):
+        return next((at for name, at in self.calls if name == func_name), None)
+
+
+def _sina_raw(closes):
+    """新浪原始字段（volume 为股，amount 为元）"""
+    dates = ['2025-01-02', '2025-01-03', '2025-01-06'][:len(closes)]
+    return pd.DataFrame({
+        'date': dates, 'open': closes, 'high': closes, 'low': closes, 'close': closes,
+        'volume': [10000.0] * len(closes), 'amount': [1000000.0] * len(closes),
+    })
+
+
+def _tencent_raw(closes, duplicate=False):
+    """腾讯原始字段（amount 实为成交量，单位手）"""
+    dates = ['2025-01-02', '2025-01-03', '2025-01-06'][:len(closes)]
+    if duplicate:
+        dates = [dates[0]] * len(closes)
+    return pd.DataFrame({
+        'date': dates, 'open': closes, 'close': closes, 'high': closes, 'low': closes,
+        'amount': [100.0] * len(closes),
+    })
+
+
+def _fetcher(provider, **kwargs):
+    tracker = LatencyTracker(min_samples=5, default_ms=PRIMARY_P90 * 1000)
+    for _ in range(10):
+        tracker.observe(SOURCE_SINA, PRIMARY_P90)
+    sources = [SOURCES[SOURCE_SINA], SOURCES[SOURCE_TENCENT]]
+    return HedgedDailyFetcher(sources, tracker=tracker, provider=provider, **kwargs)
+
+
+def _fetch(fetcher):
+    started = time.perf_counter()
+    df = fetcher.fetch(TS_CODE, START_DATE, END_DATE)
+    return df, time.perf_counter() - started
+
+
+def check_hedge_after_p90():
+    """主源变慢：P90 后发出对冲，备用源先返回胜出"""
+    provider = StubProvider({
+        SINA_FUNC: (PRIMARY_SLOW, _sina_raw([10.0, 11.0, 12.0])),
+        TENCENT_FUNC: (0.0, _tencent_raw([20.0, 21.0, 22.0])),
+    })
+    df, elapsed = _fetch(_fetcher(provider))
+    problems = []
+    launched = provider.started_at(TENCENT_FUNC)
+    if launched is None:
+        problems.append("主源超过 P90 未返回，但没有发出对冲请求")
+    elif not PRIMARY_P90 <= launched <= PRIMARY_P90 + LAUNCH_TOLERANCE:
+        problems.append(f"对冲请求在 {launched * 1000:.0f}ms 发出，应在 P90 {PRIMARY_P90 * 1000:.0f}ms 之后不久")
+    if list(df['close']) != [20.0, 21.0, 22.0]:
+        problems.append(f"应由先返回的备用源胜出，实际收盘价 {list(df['close'])}")
+    if elapsed >= PRIMARY_SLOW:
+        problems.append(f"对冲后仍等待了慢主源（{elapsed * 1000:.0f}ms）")
+    return problems
+
+
+def check_no_hedge_when_fast():
+    """主源在 P90 内返回：不发出对冲请求"""
+    provider = StubProvider({
+        SINA_FUNC: (0.0, _sina_raw([10.0, 11.0, 12.0])),
+        TENCENT_FUNC: (0.0, _tencent_raw([20.0, 21.0, 22.0])),
+    })
+    df, _ = _fetch(_fetcher(provider))
+    problems = []
+    if provider.started_at(TENCENT_FUNC) is not None:
+        problems.append("主源在 P90 内返回，却发出了对冲请求")
+    if list(df['close']) != [10.0, 11.0, 12.0]:
+        problems.append(f"应返回主源结果，实际收盘价 {list(df['close'])}")
+    return problems
+
+
+def check_invalid_result_loses():
+    """备用源先返回无效结果（日期重复）：继续等待主源的有效结果"""
+    provider = StubProvider({
+        SINA_FUNC: (PRIMARY_SLOW, _sina_raw([10.0, 11.0, 12.0])),
+        TENCENT_FUNC: (0.0, _tencent_raw([20.0, 21.0, 22.0], duplicate=True)),
+    })
+    df, _ = _fetch(_fetcher(provider))
+    if list(df['close']) != [10.0, 11.0, 12.0]:
+        return [f"无效的备用源结果不应胜出，实际收盘价 {list(df['close'])}"]
+    return []
+
+
+def check_failover():
+    """主源报错：立即切换备用源，不等待 P90"""
+    provider = StubProvider({
+        SINA_FUNC: (0.0, ConnectionError("stub sina down")),
+        TENCENT_FUNC: (0.0, _tencent_raw([20.0, 21.0, 22.0])),
+    })
+    # P90 设得很长，切换若等待 P90 会被发现
+    fetcher = _fetcher(provider)
+    fetcher.tracker = LatencyTracker(default_ms=5000)
+    try:
+        df, elapsed = _fetch(fetcher)
+    except DailySourcesError as e:
+        return [f"主源失败后没有切换到备用源: {e}"]
+    problems = []
+    if list(df['close']) != [20.0, 21.0, 22.0]:
+        problems.append(f"主源失败后应切换到备用源，实际收盘价 {list(df['close'])}")
+    if elapsed >= 1.0:
+        problems.append(f"失败切换等待了 {elapsed * 1000:.0f}ms")
+    return problems
+
+
+def check_budget_exhausted():
+    """对冲预算为 0：不对冲，等待慢主源返回"""
+    provider = StubProvider({
+        SINA_FUNC: (PRIMARY_SLOW, _sina_raw([10.0, 11.0, 12.0])),
+        TENCENT_FUNC: (0.0, _tencent_raw([20.0, 21.0, 22.0])),
+    })
+    df, _ = _fetch(_fetcher(provider, budget_ratio=0.0, budget_burst=0.0))
+    problems = []
+    if provider.started_at(TENCENT_FUNC) is not None:
+        problems.append("对冲预算为 0 时仍发出了对冲请求")
+    if list(df['close']) != [10.0, 11.0, 12.0]:
+        problems.append(f"应返回主源结果，实际收盘价 {list(df['close'])}")
+    return problems
+
+
+def check_schema():
+    """各数据源统一为 DAILY_COLUMNS，pre_close / change / pct_chg 由相邻收盘价计算"""
+    problems = []
+    for func_name, raw in ((SINA_FUNC, _sina_raw([10.0, 11.0, 12.1])),
+                           (TENCENT_FUNC, _tencent_raw([10.0, 11.0, 12.1]))):
+        provider = StubProvider({func_name: (0.0, raw)})
+        source = next(source for source in SOURCES.values() if source.func_name == func_name)
+        df = source.fetch(provider, TS_CODE, START_DATE, END_DATE)
+        if list(df.columns) != DAILY_COLUMNS:
+            problems.append(f"{source.name} 字段不一致: {list(df.columns)}")
+            continue
+        if list(df['trade_date']) != ['20250102', '20250103', '20250106'] or (df['ts_code'] != TS_CODE).any():
+            problems.append(f"{source.name} 日期或代码转换错误: {list(df['trade_date'])}")
+        if df['pre_close'].iloc[1:].round(4).tolist() != [10.0, 11.0] or round(df['pct_chg'].iat[2], 4) != 10.0:
+            problems.append(f"{source.name} pre_close / pct_chg 计算错误")
+        if df['vol'].iat[0] != 100.0:
+            problems.append(f"{source.name} 成交量单位应为手，实际 {df['vol'].iat[0]}")
+    return problems
+
+
+def check_all_failed():
+    """所有数据源都失败：抛出 DailySourcesError"""
+    provider = StubProvider({
+        SINA_FUNC: (0.0, ConnectionError("stub sina down")),
+        TENCENT_FUNC: (0.0, ConnectionError("stub tencent down")),
+    })
+    try:
+        _fetch(_fetcher(provider))
+    except DailySourcesError:
+        return []
+    return ["所有数据源失败时应抛出 DailySourcesError"]
+
+
+CHECKS = (
+    check_hedge_after_p90,
+    check_no_hedge_when_fast,
+    check_invalid_result_loses,
+    check_failover,
+    check_budget_exhausted,
+    check_schema,
+    check_all_failed,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日线对冲请求校验（本地桩数据源）")
+    parser.parse_args(argv)
+
+    failed = 0
+    for check in CHECKS:
+        problems = check()
+        name = check.__doc__.split('：')[0]
+        if problems:
+            failed += 1
+            for problem in problems:
+                print(f"❌ {name}: {problem}")
+        else:
+            print(f"✅ {name}")
+    if failed:
+        raise RuntimeError(f"{failed} 项对冲校验未通过")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
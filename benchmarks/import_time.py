@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Web 入口导入耗时基准
+
+在子进程中用 `python -X importtime -c "import app"` 导入 Web 入口，统计：
+- 总导入耗时（app 模块的累计耗时）及最慢的模块
+- 子进程峰值 RSS
+- 是否导入了 Web 进程不应加载的抓取依赖（akshare / pandas 等）
+
+超出预算或导入了禁止模块时以非 0 退出，可直接用于 CI。
+
+用法:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 800 --top 20
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Web 入口
+ENTRY_MODULE = 'app'
+# 导入耗时预算（毫秒），可用环境变量 IMPORT_TIME_BUDGET_MS 覆盖
+IMPORT_TIME_BUDGET_MS = int(os.getenv('IMPORT_TIME_BUDGET_MS', '1500'))
+# Web 进程只读缓存，不应加载抓取链路
+FORBIDDEN_MODULES = ('akshare', 'pandas', 'numpy', 'tqdm', 'data_manager', 'apscheduler', 'refresh_worker')
+
+
+def measure(module=ENTRY_MODULE):
+    """
+    在干净的子进程中导入 module
+
+    返回:
+        {'total_us', 'max_rss_kb', 'modules': [(name, self_us, cumulative_us), ...]}
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{proc.stderr[-2000:]}")
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|').split('|')]
+        modules.append((name, int(self_us), int(cumulative_us)))
+
+    total_us = next((cumulative for name, _, cumulative in reversed(modules) if name == module), 0)
+    max_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'total_us': total_us, 'max_rss_kb': max_rss_kb, 'modules': modules}
+
+
+def check(result, budget_ms=IMPORT_TIME_BUDGET_MS):
+    """返回违反预算的原因列表（为空表示通过）"""
+    problems = []
+    total_ms = result['total_us'] / 1000
+    if total_ms > budget_ms:
+        problems.append(f"导入耗时 {total_ms:.0f}ms 超出预算 {budget_ms}ms")
+    loaded = {name for name, _, _ in result['modules']}
+    for name in FORBIDDEN_MODULES:
+        if name in loaded:
+            problems.append(f"Web 入口导入了 {name}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Web 入口导入耗时基准")
+    parser.add_argument('--module', default=ENTRY_MODULE, help="要导入的模块，默认 app")
+    parser.add_argument('--budget-ms', type=int, default=IMPORT_TIME_BUDGET_MS, help="导入耗时预算（毫秒）")
+    parser.add_argument('--top', type=int, default=15, help="显示累计耗时最高的 N 个模块")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出")
+    args = parser.parse_args(argv)
+
+    result = measure(args.module)
+    problems = check(result, args.budget_ms)
+    slowest = sorted(result['modules'], key=lambda item: item[2], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            'module': args.module,
+            'total_ms': round(result['total_us'] / 1000, 1),
+            'max_rss_mb': round(result['max_rss_kb'] / 1024, 1),
+            'budget_ms': args.budget_ms,
+            'slowest': [{'module': name, 'cumulative_ms': round(cumulative / 1000, 1)} for name, _, cumulative in slowest],
+            'problems': problems,
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(f"import {args.module}: {result['total_us'] / 1000:.0f}ms（预算 {args.budget_ms}ms），"
+              f"峰值 RSS {result['max_rss_kb'] / 1024:.1f}MB")
+        print(f"累计耗时最高的 {len(slowest)} 个模块:")
+        for name, _, cumulative in slowest:
+            print(f"  {cumulative / 1000:8.1f}ms  {name}")
+        for problem in problems:
+            print(f"❌ {problem}")
+        if not problems:
+            print("✅ 符合导入预算")
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
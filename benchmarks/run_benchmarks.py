@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+"""
+基准测试套件
+
+在合成行情库（benchmarks/synthetic_market.py）上测量关键路径：
+- StockMonitor.get_price_change_ranking / get_deviation_ranking / query_stocks（n=10/30）
+- CacheManager.get / set
+- /api/stocks/both 接口，以及相同榜单连续发布两版时的增量接口（增量必须为空）
+- 股票日线 upsert（常规 / 批量导入模式）
+- fetch_stock_daily_batch：经回放数据源（data_provider）离线运行，另一项注入延迟和失败；
+  主源注入慢请求长尾时分别测量单数据源和多数据源对冲（daily_sources）
+
+每项同时统计单轮执行的 SQL 语句数（query_stats.QueryBudget）。
+结果写入 JSON（默认 benchmarks/results/latest.json），并与基线
+（benchmarks/baseline.json）逐项对比，中位数变慢超过阈值、或语句数超出基线
+QUERY_REGRESSION_THRESHOLD 以上记为回退（同时输出最常重复的语句形状）。
+
+用法:
+    python benchmarks/run_benchmarks.py                     # 默认 5000 只 × 1000 天
+    python benchmarks/run_benchmarks.py --stocks 500 --days 250 --repeat 3
+    python benchmarks/run_benchmarks.py --only ranking query_stocks
+    python benchmarks/run_benchmarks.py --save-baseline      # 把本次结果保存为基线
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BENCH_DATA_DIR = os.path.join(ROOT, 'data', 'bench')
+RESULTS_PATH = os.path.join(ROOT, 'benchmarks', 'results', 'latest.json')
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+# 中位数变慢超过该比例记为回退
+REGRESSION_THRESHOLD = 0.25
+# SQL 语句数超出基线该比例记为回退（语句数基本确定，阈值只容纳重试等少量波动）
+QUERY_REGRESSION_THRESHOLD = 0.10
+# upsert 基准写入的行数
+UPSERT_ROWS = 100000
+# fetch_stock_daily_batch 基准的股票数和天数
+FETCH_STOCKS = 500
+FETCH_DAYS = 40
+# CacheManager 基准每轮的操作次数
+CACHE_OPS = 50
+# 回放数据源注入的延迟、抖动和失败率
+FAULT_LATENCY_MS = 20
+FAULT_JITTER_MS = 5
+FAULT_ERROR_RATE = 0.02
+DEFAULT_FAULT_SEED = 1
+# 长尾场景：网络延迟为主，只有主源（新浪）5% 的请求额外慢 2 秒
+TAIL_LATENCY_MS = 150
+TAIL_JITTER_MS = 30
+TAIL_SLOW_RATE = 0.05
+TAIL_SLOW_MS = 2000
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    注册基准测试
+
+    被装饰函数接收 ctx，返回 (run, before_each)：
+    run() 被计时，可返回附加信息 dict；before_each() 在每轮计时前执行（可为 None）
+    """
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return decorator
+
+
+class Context:
+    """基准测试共享的状态（合成库路径、临时目录、懒加载的中间结果）"""
+
+    def __init__(self, db_path, scratch_dir):
+        self.db_path = db_path
+        self.scratch_dir = scratch_dir
+        self._memo = {}
+
+    def memo(self, key, fn):
+        if key not in self._memo:
+            self._memo[key] = fn()
+        return self._memo[key]
+
+    def scratch_engine(self, name):
+        """创建一个全新的空库（表结构同 database.py）"""
+        from sqlalchemy import create_engine
+        from database import Base
+
+        path = os.path.join(self.scratch_dir, f"{name}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        return engine
+
+    def daily_rows(self, limit):
+        """从合成库读取 limit 行股票日线（dict 列表，字段同 upsert 入参）"""
+        def load():
+            conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+            try:
+                rows = conn.execute(
+                    "SELECT ts_code, trade_date, open, high, low, close, pre_close, change, pct_chg, vol, amount "
+                    "FROM stock_daily_data ORDER BY ts_code, trade_date LIMIT ?", (limit,)
+                ).fetchall()
+            finally:
+                conn.close()
+            return [dict(row) for row in rows]
+        return self.memo(('daily_rows', limit), load)
+
+
+# ---------- 查询 ----------
+
+def _ranking(n):
+    def setup(ctx):
+        from board_service import ALL_MARKETS
+        from monitor import StockMonitor
+
+        def run():
+            rows = StockMonitor().get_price_change_ranking(n, market_filter=list(ALL_MARKETS))
+            return {'rows': len(rows)}
+        return run, None
+    return setup
+
+
+def _query_stocks(n):
+    def setup(ctx):
+        from monitor import StockMonitor
+
+        def run():
+            rows = StockMonitor().query_stocks(n)
+            return {'rows': len(rows)}
+        return run, None
+    return setup
+
+
+def _deviation_ranking(n):
+    def setup(ctx):
+        from monitor import StockMonitor
+
+        def run():
+            rows = StockMonitor().get_deviation_ranking(n)
+            return {'rows': len(rows)}
+        return run, None
+    return setup
+
+
+@benchmark('window_ranking')
+def bench_window_ranking(ctx):
+    from database import get_session
+    from monitor import StockMonitor
+    from range_index import build_range_index
+
+    index = ctx.memo('range_index', lambda: build_range_index(get_session()))
+    monitor = StockMonitor()
+
+    def run():
+        # 任意窗口（不在预计算的 10 / 30 日榜中）的全市场排行，取前 50
+        rows = monitor.get_window_ranking(index, n=45, limit=50)
+        return {'rows': len(rows)}
+    return run, None
+
+
+benchmark('ranking_n10')(_ranking(10))
+benchmark('ranking_n30')(_ranking(30))
+benchmark('ranking_sql_n10')(_deviation_ranking(10))
+benchmark('ranking_sql_n30')(_deviation_ranking(30))
+benchmark('query_stocks_n10')(_query_stocks(10))
+benchmark('query_stocks_n30')(_query_stocks(30))
+
+
+# ---------- 缓存和接口 ----------
+
+def _board_payload(ctx):
+    from board_service import compute_board
+    from monitor import StockMonitor
+
+    def compute():
+        monitor = StockMonitor()
+        return compute_board(monitor, 10), compute_board(monitor, 30)
+    return ctx.memo('boards', compute)
+
+
+@benchmark('cache_set')
+def bench_cache_set(ctx):
+    from cache_manager import CacheManager
+
+    results_10, results_30 = _board_payload(ctx)
+    payload = {'10': results_10, '30': results_30}
+
+    def run():
+        cache_mgr = CacheManager()
+        for i in range(CACHE_OPS):
+            cache_mgr.set(f'bench_cache_{i % 5}', payload)
+        return {'ops': CACHE_OPS, 'bytes': len(json.dumps(payload, ensure_ascii=False))}
+    return run, None
+
+
+@benchmark('cache_get')
+def bench_cache_get(ctx):
+    from cache_manager import CacheManager
+
+    results_10, results_30 = _board_payload(ctx)
+    CacheManager().set('bench_cache_get', {'10': results_10, '30': results_30})
+
+    def run():
+        cache_mgr = CacheManager()
+        hits = sum(cache_mgr.get('bench_cache_get') is not None for _ in range(CACHE_OPS))
+        return {'ops': CACHE_OPS, 'hits': hits}
+    return run, None
+
+
+@benchmark('api_stocks_both')
+def bench_api_stocks_both(ctx):
+    from board_service import publish_boards
+    from app import app
+
+    publish_boards(*_board_payload(ctx))
+    client = app.test_client()
+
+    def run():
+        response = client.get('/api/stocks/both')
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/stocks/both 返回 {response.status_code}")
+        return {'bytes': len(response.data)}
+    return run, None
+
+
+@benchmark('api_stocks_both_delta')
+def bench_api_stocks_both_delta(ctx):
+    from board_service import get_generation_info, publish_boards
+    from app import app
+
+    # 连续发布两版相同的榜单：增量必须为空，否则说明两边数据形式不一致
+    publish_boards(*_board_payload(ctx))
+    publish_boards(*_board_payload(ctx))
+    since = get_generation_info()['previous']
+    client = app.test_client()
+
+    def run():
+        response = client.get(f'/api/stocks/both/delta?since={since}&summary=1')
+        data = response.get_json()
+        if response.status_code != 200 or data['mode'] != 'delta':
+            raise RuntimeError(f"/api/stocks/both/delta 返回 {response.status_code} {data.get('mode')}")
+        changed = sum(len(board[kind]) for board in data['data'].values()
+                      for kind in ('entered', 'exited', 'changed'))
+        if changed:
+            raise RuntimeError(f"相同榜单的增量不为空: {changed} 行")
+        return {'bytes': len(response.data)}
+    return run, None
+
+
+# ---------- 写库 ----------
+
+@benchmark('upsert_stock_daily')
+def bench_upsert_stock_daily(ctx):
+    from sqlalchemy.orm import Session
+    from data_manager import _upsert_stock_daily
+
+    rows = ctx.daily_rows(UPSERT_ROWS)
+    state = {}
+
+    def before_each():
+        state['engine'] = ctx.scratch_engine('upsert')
+
+    def run():
+        with Session(bind=state['engine']) as session:
+            for i in range(0, len(rows), 2000):
+                _upsert_stock_daily(session, rows[i:i + 2000])
+                session.commit()
+        state['engine'].dispose()
+        return {'rows': len(rows)}
+    return run, before_each
+
+
+@benchmark('upsert_stock_daily_bulk')
+def bench_upsert_stock_daily_bulk(ctx):
+    from database import bulk_load_session, StockDailyData
+    from data_manager import _upsert_stock_daily
+
+    rows = ctx.daily_rows(UPSERT_ROWS)
+    state = {}
+
+    def before_each():
+        state['engine'] = ctx.scratch_engine('upsert_bulk')
+
+    def run():
+        with bulk_load_session([StockDailyData.__table__], bind=state['engine']) as session:
+            _upsert_stock_daily(session, rows)
+            session.commit()
+        state['engine'].dispose()
+        return {'rows': len(rows)}
+    return run, before_each
+
+
+def _replay_store(ctx):
+    """
+    把合成库最近 FETCH_DAYS 天、前 FETCH_STOCKS 只股票的日线按新浪、腾讯原始格式写入回放存储
+
+    返回:
+        (存储目录, 代码列表, 开始日期, 结束日期)
+    """
+    def build():
+        import pandas as pd
+        from daily_sources import SOURCES, SOURCE_SINA, SOURCE_TENCENT
+        from data_provider import ResponseStore
+
+        store_dir = os.path.join(ctx.scratch_dir, 'provider_store')
+        store = ResponseStore(store_dir)
+        conn = sqlite3.connect(ctx.db_path)
+        try:
+            codes = [row[0] for row in conn.execute(
+                "SELECT ts_code FROM stock_basic ORDER BY ts_code LIMIT ?", (FETCH_STOCKS,))]
+            dates = sorted(row[0] for row in conn.execute(
+                "SELECT DISTINCT trade_date FROM stock_daily_data ORDER BY trade_date DESC LIMIT ?", (FETCH_DAYS,)))
+            for code in codes:
+                raw = pd.read_sql_query(
+                    "SELECT trade_date AS date, open, high, low, close, vol * 100 AS volume, amount * 1000 AS amount "
+                    "FROM stock_daily_data WHERE ts_code = ? AND trade_date >= ? ORDER BY trade_date",
+                    conn, params=(code, dates[0]))
+                sina, tencent = SOURCES[SOURCE_SINA], SOURCES[SOURCE_TENCENT]
+                store.put(sina.func_name, sina.request(code, dates[0], dates[-1]), raw)
+                # 腾讯的 amount 字段是成交量（手），没有成交额
+                tencent_raw = raw[['date', 'open', 'close', 'high', 'low']].assign(amount=raw['volume'] / 100)
+                store.put(tencent.func_name, tencent.request(code, dates[0], dates[-1]), tencent_raw)
+        finally:
+            conn.close()
+        return store_dir, codes, dates[0], dates[-1]
+    return ctx.memo('replay_store', build)
+
+
+def _fetch_benchmark(name, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                     slow_rate=0.0, slow_ms=0.0, fault_funcs=None, sources=None, hedge=True):
+    """通过回放数据源运行 fetch_stock_daily_batch（含失败重试）"""
+    def setup(ctx):
+        from sqlalchemy.orm import Session
+        from daily_sources import DEFAULT_SOURCES, HedgedDailyFetcher, set_daily_fetcher, sources_from_names
+        from data_manager import DataManager
+        from data_provider import DataProvider, MODE_REPLAY, set_provider
+
+        store_dir, codes, start_date, end_date = _replay_store(ctx)
+        state = {}
+
+        def before_each():
+            state['engine'] = ctx.scratch_engine(name)
+            set_provider(DataProvider(MODE_REPLAY, store_dir, latency_ms=latency_ms, jitter_ms=jitter_ms,
+                                      error_rate=error_rate, seed=DEFAULT_FAULT_SEED,
+                                      slow_rate=slow_rate, slow_ms=slow_ms, fault_funcs=fault_funcs))
+            # 每轮重新统计耗时，对冲等待时间从默认值开始
+            set_daily_fetcher(HedgedDailyFetcher(sources_from_names(sources or DEFAULT_SOURCES), hedge=hedge))
+
+        def run():
+            dm = DataManager(session=Session(bind=state['engine']))
+            rows = dm.fetch_stock_daily_batch(codes, start_date, end_date, return_data=False)
+            failed = dm.retry_failed_stock_daily()
+            dm.session.close()
+            state['engine'].dispose()
+            set_provider(None)
+            set_daily_fetcher(None)
+            return {'rows': rows, 'failed_after_retry': failed}
+        return run, before_each
+    return setup
+
+
+# 只测量并发抓取之后的写库链路
+benchmark('fetch_stock_daily_batch')(_fetch_benchmark('fetch', sources=['sina']))
+# 模拟网络延迟和 2% 失败率，测量并发抓取和重试
+benchmark('fetch_stock_daily_batch_faults')(
+    _fetch_benchmark('fetch_faults', latency_ms=FAULT_LATENCY_MS, jitter_ms=FAULT_JITTER_MS, error_rate=FAULT_ERROR_RATE,
+                     sources=['sina'])
+)
+# 只用新浪时慢请求占住抓取线程，对冲时由腾讯补位
+benchmark('fetch_stock_daily_batch_tail_single')(
+    _fetch_benchmark('fetch_tail_single', latency_ms=TAIL_LATENCY_MS, jitter_ms=TAIL_JITTER_MS,
+                     slow_rate=TAIL_SLOW_RATE, slow_ms=TAIL_SLOW_MS, fault_funcs=['stock_zh_a_daily'],
+                     sources=['sina'])
+)
+benchmark('fetch_stock_daily_batch_tail_hedged')(
+    _fetch_benchmark('fetch_tail_hedged', latency_ms=TAIL_LATENCY_MS, jitter_ms=TAIL_JITTER_MS,
+                     slow_rate=TAIL_SLOW_RATE, slow_ms=TAIL_SLOW_MS, fault_funcs=['stock_zh_a_daily'])
+)
+
+
+# ---------- 运行和对比 ----------
+
+def query_budget_for(name, baseline, threshold=QUERY_REGRESSION_THRESHOLD):
+    """按基线语句数计算单轮的查询预算（基线没有记录时不限制）"""
+    base = (baseline or {}).get('results', {}).get(name, {})
+    if 'queries' not in base:
+        return None
+    return int(base['queries'] * (1 + threshold))
+
+
+def run_benchmark(name, ctx, repeat, max_queries=None):
+    from query_stats import QueryBudget
+
+    run, before_each = BENCHMARKS[name](ctx)
+    timings = []
+    extra = {}
+    queries = []
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        # 超出预算时记录最常重复的语句形状，是否回退由 compare 判定
+        budget = QueryBudget(max_queries=max_queries, name=f"benchmark:{name}", raise_error=False)
+        started = time.perf_counter()
+        with budget:
+            extra = run() or {}
+        timings.append((time.perf_counter() - started) * 1000)
+        queries.append(budget.queries)
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'repeat': repeat,
+        'queries': max(queries),
+        'query_max_repeats': budget.max_repeats(),
+        **extra,
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, query_threshold=QUERY_REGRESSION_THRESHOLD):
+    """
+    与基线逐项对比
+
+    返回:
+        [(name, baseline_ms, current_ms, ratio, baseline_queries, current_queries, regressed)]
+    """
+    rows = []
+    for name, current in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        ratio = current['median_ms'] / base['median_ms'] if base['median_ms'] else 1.0
+        regressed = ratio > 1 + threshold
+        base_queries = base.get('queries')
+        if base_queries is not None and current['queries'] > base_queries * (1 + query_threshold):
+            regressed = True
+        rows.append((name, base['median_ms'], current['median_ms'], ratio, base_queries, current['queries'], regressed))
+    return rows
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def main(argv=None):
+    from synthetic_market import DEFAULT_DAYS, DEFAULT_SEED, DEFAULT_STOCKS, generate
+
+    parser = argparse.ArgumentParser(description="基准测试套件")
+    parser.add_argument('--stocks', type=int, default=DEFAULT_STOCKS, help=f"合成股票数量，默认 {DEFAULT_STOCKS}")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help=f"合成交易日数量，默认 {DEFAULT_DAYS}")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="随机种子")
+    parser.add_argument('--regenerate', action='store_true', help="重新生成合成库")
+    parser.add_argument('--repeat', type=int, default=3, help="每项重复次数，默认 3")
+    parser.add_argument('--only', nargs='*', help="只运行名称包含这些关键字的基准")
+    parser.add_argument('--output', default=RESULTS_PATH, help="结果 JSON 路径")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基线 JSON 路径")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基线")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="回退阈值，默认 0.25")
+    parser.add_argument('--query-threshold', type=float, default=QUERY_REGRESSION_THRESHOLD,
+                        help="SQL 语句数回退阈值，默认 0.10")
+    args = parser.parse_args(argv)
+
+    # 必须在导入项目模块（包括生成合成库）之前切换数据库；基准会写入缓存表，在副本上运行
+    work_dir = tempfile.mkdtemp(prefix='pyst-bench-')
+    work_db = os.path.join(work_dir, 'market.db')
+    os.environ['DATABASE_URL'] = f"sqlite:///{work_db}"
+    # 指标快照也写到临时目录，不污染 data/runtime
+    os.environ['METRICS_DIR'] = os.path.join(work_dir, 'metrics')
+    # 快照目录同样隔离，避免读到 data/snapshots 中的生产快照
+    os.environ['SNAPSHOT_DIR'] = os.path.join(work_dir, 'snapshots')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    db_path = os.path.join(BENCH_DATA_DIR, f"market_{args.stocks}x{args.days}_{args.seed}.db")
+    if args.regenerate or not os.path.exists(db_path):
+        print(f"生成合成库 {db_path} ...")
+        generate(db_path, args.stocks, args.days, args.seed)
+    shutil.copyfile(db_path, work_db)
+
+    names = [name for name in BENCHMARKS if not args.only or any(key in name for key in args.only)]
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    results = {
+        'meta': {
+            'stocks': args.stocks,
+            'days': args.days,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': {},
+    }
+    try:
+        ctx = Context(work_db, work_dir)
+        for name in names:
+            result = run_benchmark(name, ctx, args.repeat, query_budget_for(name, baseline, args.query_threshold))
+            results['results'][name] = result
+            print(f"{name:<28} median {result['median_ms']:>10.1f}ms  min {result['min_ms']:>10.1f}ms  "
+                  f"{result['queries']:>7} 条 SQL")
+    finally:
+        # 先回收持有会话的对象并释放连接池，再删除临时库
+        ctx = None
+        gc.collect()
+        if 'database' in sys.modules:
+            sys.modules['database'].engine.dispose()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    _write_json(args.output, results)
+    print(f"结果已写入 {args.output}")
+
+    regressed = []
+    if baseline is not None:
+        if (baseline['meta']['stocks'], baseline['meta']['days']) != (args.stocks, args.days):
+            print(f"⚠️  基线规模为 {baseline['meta']['stocks']} × {baseline['meta']['days']}，与本次不同，对比仅供参考")
+        print(f"\n与基线对比（{args.baseline}，耗时阈值 +{args.threshold:.0%}，SQL 语句数阈值 +{args.query_threshold:.0%}）:")
+        for name, base_ms, current_ms, ratio, base_queries, queries, is_regressed in compare(
+                results, baseline, args.threshold, args.query_threshold):
+            mark = '❌' if is_regressed else '  '
+            query_note = f"  SQL {base_queries} -> {queries}" if base_queries is not None else ''
+            print(f"{mark} {name:<28} {base_ms:>10.1f}ms -> {current_ms:>10.1f}ms  ({ratio - 1:+.1%}){query_note}")
+            if is_regressed:
+                regressed.append(name)
+
+    if args.save_baseline:
+        # 只运行了部分基准时，合并进同规模的已有基线
+        if args.only and os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            if (baseline['meta']['stocks'], baseline['meta']['days']) == (args.stocks, args.days):
+                baseline['results'].update(results['results'])
+                results = dict(results, results=baseline['results'])
+        _write_json(args.baseline, results)
+        print(f"基线已保存到 {args.baseline}")
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
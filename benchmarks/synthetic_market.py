@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+合成行情数据生成器
+
+按 database.py 的真实表结构生成确定性的合成数据（相同参数 + 种子得到相同的库）：
+- stock_basic：沪深主板 / 创业板 / 科创板 / 北交所按比例分布，少量近期上市的新股
+- trade_cal：SSE / SZSE 两个交易所的完整日历（工作日开市）
+- stock_daily_data：按板块涨跌停幅度截断的几何随机游走，少量停牌缺失
+- index_daily_data：INDEX_CODES 中的五个指数
+
+用法:
+    python benchmarks/synthetic_market.py data/bench/market.db --stocks 5000 --days 1000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 默认规模
+DEFAULT_STOCKS = 5000
+DEFAULT_DAYS = 1000
+DEFAULT_SEED = 20240101
+# 固定结束日期，保证同一参数生成的库完全一致
+DEFAULT_END_DATE = '20250630'
+
+# (市场, 代码前缀, 交易所后缀, 占比, 涨跌停幅度%)
+MARKET_LAYOUT = (
+    ('主板', '60', 'SH', 0.32, 10),
+    ('主板', '00', 'SZ', 0.30, 10),
+    ('创业板', '30', 'SZ', 0.20, 20),
+    ('科创板', '688', 'SH', 0.11, 20),
+    ('北交所', '83', 'BJ', 0.07, 30),
+)
+# 指数代码及初始点位
+INDEX_LAYOUT = (
+    ('000001.SH', 3000.0),
+    ('399107.SZ', 2000.0),
+    ('399102.SZ', 2500.0),
+    ('000688.SH', 1000.0),
+    ('899050.BJ', 1000.0),
+)
+# 近期上市新股占比（用于覆盖 is_sg 过滤）
+NEW_LISTING_RATIO = 0.03
+# 单日停牌概率
+SUSPEND_PROB = 0.003
+# 交易日历在行情区间之外额外覆盖的天数
+CALENDAR_PADDING_DAYS = 400
+
+INSERT_CHUNK_ROWS = 50000
+
+
+def trading_days(end_date, days):
+    """返回截至 end_date 的最近 days 个工作日（YYYYMMDD 升序）"""
+    result = []
+    current = datetime.strptime(end_date, '%Y%m%d')
+    while len(result) < days:
+        if current.weekday() < 5:
+            result.append(current.strftime('%Y%m%d'))
+        current -= timedelta(days=1)
+    return result[::-1]
+
+
+def _calendar_rows(first_date, last_date):
+    start = datetime.strptime(first_date, '%Y%m%d') - timedelta(days=CALENDAR_PADDING_DAYS)
+    end = datetime.strptime(last_date, '%Y%m%d') + timedelta(days=CALENDAR_PADDING_DAYS)
+    now = datetime.now().isoformat(sep=" ")
+    rows = []
+    for exchange in ('SSE', 'SZSE'):
+        pretrade = None
+        current = start
+        while current <= end:
+            cal_date = current.strftime('%Y%m%d')
+            is_open = '1' if current.weekday() < 5 else '0'
+            rows.append((exchange, cal_date, is_open, pretrade, now, now))
+            if is_open == '1':
+                pretrade = cal_date
+            current += timedelta(days=1)
+    return rows
+
+
+def _stock_layout(stocks, rng):
+    """按比例分配代码和市场，返回 [(ts_code, market, limit_up), ...]"""
+    layout = []
+    for market, prefix, suffix, ratio, limit_up in MARKET_LAYOUT:
+        count = max(1, round(stocks * ratio))
+        width = 6 - len(prefix)
+        for i in range(count):
+            layout.append((f"{prefix}{i:0{width}d}.{suffix}", market, limit_up))
+    rng.shuffle(layout)
+    return sorted(layout[:stocks])
+
+
+def _random_walk(rng, start_price, days, limit_up, volatility):
+    """按涨跌停截断的几何随机游走，返回 (open, high, low, close) 列表"""
+    bars = []
+    close = start_price
+    limit = limit_up / 100
+    drift = rng.gauss(0, 0.0005)
+    for _ in range(days):
+        pct = max(-limit, min(limit, rng.gauss(drift, volatility)))
+        open_price = close * (1 + max(-limit, min(limit, rng.gauss(0, volatility / 3))))
+        new_close = round(close * (1 + pct), 2)
+        high = round(max(open_price, new_close) * (1 + abs(rng.gauss(0, volatility / 4))), 2)
+        low = round(min(open_price, new_close) * (1 - abs(rng.gauss(0, volatility / 4))), 2)
+        bars.append((round(open_price, 2), high, max(low, 0.01), max(new_close, 0.01)))
+        close = max(new_close, 0.01)
+    return bars
+
+
+def _insert_many(conn, sql, rows):
+    for i in range(0, len(rows), INSERT_CHUNK_ROWS):
+        conn.executemany(sql, rows[i:i + INSERT_CHUNK_ROWS])
+
+
+def generate(db_path, stocks=DEFAULT_STOCKS, days=DEFAULT_DAYS, seed=DEFAULT_SEED, end_date=DEFAULT_END_DATE):
+    """
+    生成合成行情库（已存在会被覆盖）
+
+    返回:
+        各表行数 {'stock_basic', 'trade_cal', 'stock_daily_data', 'index_daily_data'}
+    """
+    from sqlalchemy import create_engine
+    from database import Base
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    engine = create_engine(f"sqlite:///{os.path.abspath(db_path)}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    rng = random.Random(seed)
+    dates = trading_days(end_date, days)
+    now = datetime.now().isoformat(sep=" ")
+    counts = {}
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode=MEMORY")
+        conn.execute("PRAGMA synchronous=OFF")
+
+        calendar = _calendar_rows(dates[0], dates[-1])
+        _insert_many(conn, "INSERT INTO trade_cal (exchange, cal_date, is_open, pretrade_date, created_at, updated_at) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", calendar)
+        counts['trade_cal'] = len(calendar)
+
+        layout = _stock_layout(stocks, rng)
+        default_list_date = (datetime.strptime(dates[0], '%Y%m%d') - timedelta(days=365)).strftime('%Y%m%d')
+        basic_rows = []
+        for i, (ts_code, market, _) in enumerate(layout):
+            if rng.random() < NEW_LISTING_RATIO:
+                list_date = dates[-rng.randint(5, 55)]
+            else:
+                list_date = default_list_date
+            symbol, suffix = ts_code.split('.')
+            exchange = {'SH': 'SSE', 'SZ': 'SZSE', 'BJ': 'BSE'}[suffix]
+            basic_rows.append((ts_code, symbol, f"合成{i:04d}", market, exchange, 'L', list_date, now, now))
+        _insert_many(conn, "INSERT INTO stock_basic (ts_code, symbol, name, market, exchange, list_status, list_date, "
+                           "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", basic_rows)
+        counts['stock_basic'] = len(basic_rows)
+
+        daily_sql = ("INSERT INTO stock_daily_data (ts_code, trade_date, open, high, low, close, pre_close, change, "
+                     "pct_chg, vol, amount, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+        daily_count = 0
+        pending = []
+        for (ts_code, market, limit_up), basic in zip(layout, basic_rows):
+            list_date = basic[6]
+            bars = _random_walk(rng, rng.uniform(3, 80), days, limit_up, rng.uniform(0.01, 0.04))
+            pre_close = None
+            for trade_date, (open_price, high, low, close) in zip(dates, bars):
+                if trade_date < list_date or rng.random() < SUSPEND_PROB:
+                    continue
+                # 上市首日没有前收盘价，以开盘价代替
+                base = pre_close or open_price
+                change = round(close - base, 2)
+                vol = round(rng.uniform(1e4, 5e5), 0)
+                pending.append((ts_code, trade_date, open_price, high, low, close, base, change,
+                                round(change / base * 100, 4), vol, round(vol * close / 10, 2), now, now))
+                pre_close = close
+            if len(pending) >= INSERT_CHUNK_ROWS:
+                _insert_many(conn, daily_sql, pending)
+                daily_count += len(pending)
+                pending = []
+        _insert_many(conn, daily_sql, pending)
+        daily_count += len(pending)
+        counts['stock_daily_data'] = daily_count
+
+        index_rows = []
+        for ts_code, start_point in INDEX_LAYOUT:
+            pre_close = None
+            for trade_date, (open_price, high, low, close) in zip(
+                    dates, _random_walk(rng, start_point, days, 10, 0.012)):
+                base = pre_close or open_price
+                change = round(close - base, 2)
+                index_rows.append((ts_code, trade_date, open_price, high, low, close, base, change,
+                                   round(change / base * 100, 4), round(rng.uniform(1e8, 5e8), 0),
+                                   round(rng.uniform(1e11, 5e11), 2), now, now))
+                pre_close = close
+        _insert_many(conn, daily_sql.replace('stock_daily_data', 'index_daily_data'), index_rows)
+        counts['index_daily_data'] = len(index_rows)
+
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成合成行情数据库")
+    parser.add_argument('db_path', help="输出的 SQLite 文件路径（已存在会被覆盖）")
+    parser.add_argument('--stocks', type=int, default=DEFAULT_STOCKS, help=f"股票数量，默认 {DEFAULT_STOCKS}")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help=f"交易日数量，默认 {DEFAULT_DAYS}")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="随机种子")
+    parser.add_argument('--end-date', default=DEFAULT_END_DATE, help=f"最后一个交易日，默认 {DEFAULT_END_DATE}")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    counts = generate(args.db_path, args.stocks, args.days, args.seed, args.end_date)
+    elapsed = time.perf_counter() - started
+    print(f"已生成 {args.db_path}（{elapsed:.1f}s）: " + ", ".join(f"{k}={v}" for k, v in counts.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,781 @@
+"""
+榜单服务模块
+负责双榜的计算（按榜单 × 板块分片多进程并行）与缓存发布、精简榜单、
+参数化榜单（请求合并 + 按参数缓存）、任意窗口排行（区间索引）、相邻版本之间的增量榜单，
+以及单只股票详情（带进程内 LRU 缓存）
+"""
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from itertools import islice
+from sqlalchemy.orm import sessionmaker
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from cache_manager import CacheManager, generation_key
+from database import backup_database, close_session, create_readonly_engine, get_data_watermarks, get_read_session
+from metrics import BOARD_COMPUTE_SECONDS, BOARD_ROWS
+from monitor import StockMonitor, calculate_t_plus_data
+from range_index import build_range_index, load_range_index
+
+# 榜单配置：n 日榜 -> 异动阈值（%）
+BOARD_THRESHOLDS = {
+    10: 100,
+    30: 200,
+}
+# 每个榜单保留的股票数量
+BOARD_TOP_N = 50
+
+# 详情字段：只在详情接口返回，不进入精简榜单
+DETAIL_FIELDS = ('stock_prices', 'index_prices')
+
+# 缓存 key
+CACHE_KEY_BOTH = 'stocks_both'
+CACHE_KEY_SUMMARY = 'stocks_summary'
+CACHE_KEY_GENERATION = 'data_generation'
+# 增量榜单：按新版本号存放上一版本到该版本的增量（榜单 key -> 增量 key）
+DELTA_KEYS = {
+    CACHE_KEY_BOTH: 'stocks_both_delta',
+    CACHE_KEY_SUMMARY: 'stocks_summary_delta',
+}
+# 版本指针和版本化数据的过期时间：由版本号失效，TTL 只是兜底（周末、长假不刷新也不能过期）
+GENERATION_TTL_HOURS = 24 * 30
+# 保留的版本数（当前版本和上一版本：读到旧指针的请求仍能取到完整数据）
+KEEP_GENERATIONS = 2
+
+# 单只股票详情 LRU 容量（股票数 × 榜单数）
+DETAIL_CACHE_SIZE = 256
+# 参数化榜单结果 LRU 容量（参数组合数）
+BOARD_CACHE_SIZE = 64
+# 全市场榜单 LRU 容量（n × is_sg）
+UNIVERSE_CACHE_SIZE = 4
+
+# 增量接口的返回方式：增量 / 完整榜单（客户端版本过旧或未知）/ 无变化
+DELTA_MODE_DELTA = 'delta'
+DELTA_MODE_FULL = 'full'
+DELTA_MODE_UNCHANGED = 'unchanged'
+
+# 全市场板块，分片计算和参数化榜单都以板块为单位
+ALL_MARKETS = ('主板', '创业板', '科创板', '北交所')
+# 与 query_stocks 默认行为一致：按最低起涨幅排序后最多保留的数量
+BOARD_MAX_RESULTS = 100
+# 参数化榜单允许的最大 n
+BOARD_MAX_N = 120
+
+
+def compute_board(monitor, n):
+    """计算 n 日偏离值榜：按偏离值从高到低排序，保留前 BOARD_TOP_N 只"""
+    with BOARD_COMPUTE_SECONDS.time(n=n):
+        results = monitor.query_stocks(n=n, threshold=BOARD_THRESHOLDS[n])
+    results.sort(key=lambda x: x['deviation'], reverse=True)
+    BOARD_ROWS.set(len(results[:BOARD_TOP_N]), n=n, kind='board')
+    return results[:BOARD_TOP_N]
+
+
+def build_board_summary(results, n):
+    """
+    生成精简榜单：去掉价格数组，附带按默认涨停幅度预计算的 T+1~T+5 数据
+
+    参数:
+        results: compute_board 的结果（含 stock_prices/index_prices）
+        n: 榜单天数
+    """
+    summary = []
+    for item in results:
+        row = {k: v for k, v in item.items() if k not in DETAIL_FIELDS}
+        row['t_plus_data'] = calculate_t_plus_data(
+            item.get('stock_prices'),
+            item.get('index_prices'),
+            n,
+            threshold=item.get('threshold'),
+            limit_up=item.get('limit_up'),
+        )
+        summary.append(row)
+    return summary
+
+
+def next_generation(end_date, previous):
+    """
+    下一个数据版本号：<最新入库交易日>-<该交易日的发布序号>
+
+    同一交易日重复发布（补数、重算）时序号递增，交易日变化时从 1 开始。
+    """
+    seq = 1
+    if previous and previous.get('end_date') == end_date:
+        seq = int(previous.get('seq', 0)) + 1
+    return f"{end_date}-{seq}", seq
+
+
+def publish_boards(results_10, results_30, cache_mgr=None, universes=None):
+    """
+    发布双榜：先按新版本号写入完整榜单、精简榜单（和全市场结果），最后切换版本指针
+
+    读取方先读版本指针再读该版本的数据，指针切换之前新版本对读取方不可见，
+    因此总能读到最新的完整版本；版本号变化也让详情缓存等派生数据失效。
+
+    参数:
+        universes: {n: 全市场结果}，一并按新版本写入，避免 API 首次请求时重新计算
+
+    返回:
+        本次发布的 generation
+    """
+    cache_mgr = cache_mgr or CacheManager()
+    end_date = (get_data_watermarks(cache_mgr.session)['stock_daily_data']
+                or next((r['end_date'] for r in results_10 + results_30), ''))
+    previous = get_generation_info(cache_mgr)
+    previous_generation = previous.get('generation') if previous else None
+    generation, seq = next_generation(end_date, previous)
+    computed_at = datetime.now()
+
+    full = {
+        'stocks_10': results_10,
+        'stocks_30': results_30,
+    }
+    summary = {
+        'stocks_10': build_board_summary(results_10, 10),
+        'stocks_30': build_board_summary(results_30, 30),
+    }
+
+    for key, value in ((CACHE_KEY_BOTH, full), (CACHE_KEY_SUMMARY, summary)):
+        cache_mgr.set(generation_key(key, generation), value, ttl_hours=GENERATION_TTL_HOURS)
+        _publish_delta(cache_mgr, key, value, previous_generation, generation)
+    for n, rows in (universes or {}).items():
+        prime_board_universe(n, False, rows, generation, cache_mgr)
+
+    # 最后切换指针
+    cache_mgr.set(CACHE_KEY_GENERATION, {
+        'generation': generation,
+        'end_date': end_date,
+        'seq': seq,
+        'previous': previous_generation,
+        'computed_at': computed_at.strftime('%Y-%m-%d %H:%M:%S'),
+    }, ttl_hours=GENERATION_TTL_HOURS)
+
+    logger.info(f"双榜已发布，generation={generation}")
+    return generation
+
+
+def _reader_cache():
+    """读取方（Web 进程）使用的缓存管理器：有只读快照时读快照"""
+    return CacheManager(session=get_read_session())
+
+
+def get_generation_info(cache_mgr=None):
+    """获取当前发布的版本信息 {'generation', 'end_date', 'computed_at'}，尚未发布时返回 None"""
+    cache_mgr = cache_mgr or _reader_cache()
+    return cache_mgr.get(CACHE_KEY_GENERATION)
+
+
+def get_data_generation(cache_mgr=None):
+    """获取当前数据版本号，尚未发布时返回 None"""
+    info = get_generation_info(cache_mgr)
+    return info.get('generation') if info else None
+
+
+def get_published(cache_key, cache_mgr=None):
+    """
+    读取当前版本发布的数据（如 CACHE_KEY_BOTH / CACHE_KEY_SUMMARY）
+
+    返回:
+        (data, generation)，尚未发布时均为 None
+    """
+    cache_mgr = cache_mgr or _reader_cache()
+    generation = get_data_generation(cache_mgr)
+    if generation is None:
+        return None, None
+    return cache_mgr.get(generation_key(cache_key, generation)), generation
+
+
+def sweep_cache(cache_mgr=None):
+    """
+    清理过期、旧版本和超出容量的缓存，保留当前和上一版本（刷新进程定时调用）
+
+    不能与 publish_boards 并发：发布期间新版本的行已写入而版本指针尚未切换，会被当作旧版本删除。
+    """
+    cache_mgr = cache_mgr or CacheManager()
+    info = get_generation_info(cache_mgr)
+    keep = [info.get('generation'), info.get('previous')][:KEEP_GENERATIONS] if info else []
+    keys = (CACHE_KEY_BOTH, CACHE_KEY_SUMMARY) + tuple(DELTA_KEYS.values())
+    protected = [CACHE_KEY_GENERATION] + [generation_key(key, g) for key in keys for g in keep if g]
+    return cache_mgr.sweep(keep_generations=keep, protected_keys=protected)
+
+
+class GenerationLRUCache:
+    """进程内 LRU 缓存，数据版本号变化时整体失效"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            self._data.clear()
+            self._generation = generation
+
+    def get(self, key, generation):
+        with self._lock:
+            self._check_generation(generation)
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value, generation):
+        with self._lock:
+            self._check_generation(generation)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+_detail_cache = GenerationLRUCache(DETAIL_CACHE_SIZE)
+
+
+def get_stock_detail(ts_code, n):
+    """
+    获取单只股票的 n 日详情（价格窗口 + T+n 数据），优先读 LRU 缓存
+
+    返回:
+        (detail, from_cache)，未找到股票时 detail 为 None
+    """
+    generation = get_data_generation()
+    key = (ts_code, n)
+
+    detail = _detail_cache.get(key, generation)
+    if detail is not None:
+        return detail, True
+
+    detail = StockMonitor(session=get_read_session()).get_stock_detail(ts_code, n, threshold=BOARD_THRESHOLDS[n])
+    if detail is not None:
+        _detail_cache.set(key, detail, generation)
+    return detail, False
+
+
+# ---------- 参数化榜单 ----------
+
+class SingleFlight:
+    """请求合并：相同 key 的并发调用只执行一次计算，其余调用等待并共享结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        执行 fn 或等待正在执行的同 key 调用
+
+        返回:
+            (result, shared)，shared 表示结果来自其他调用
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = fn()
+            return call['result'], False
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+
+_board_cache = GenerationLRUCache(BOARD_CACHE_SIZE)
+_universe_cache = GenerationLRUCache(UNIVERSE_CACHE_SIZE)
+_board_flight = SingleFlight()
+
+
+def board_markets(include_cyb=True, include_kcb=False, include_bj=False):
+    """按板块开关得到市场列表（主板总是包含）"""
+    markets = ['主板']
+    if include_cyb:
+        markets.append('创业板')
+    if include_kcb:
+        markets.append('科创板')
+    if include_bj:
+        markets.append('北交所')
+    return markets
+
+
+def _normalize_threshold(threshold, n):
+    if threshold is None:
+        threshold = BOARD_THRESHOLDS.get(n, 100)
+    threshold = float(threshold)
+    return int(threshold) if threshold.is_integer() else threshold
+
+
+def normalize_board_params(n, threshold=None, is_sg=False, include_cyb=True,
+                           include_kcb=False, include_bj=False, top_n=BOARD_TOP_N):
+    """
+    规范化榜单参数，返回 (params, cache_key)
+
+    等价的参数组合（如 threshold=100 与 100.0）得到同一个 cache_key
+    """
+    markets = board_markets(include_cyb, include_kcb, include_bj)
+    threshold = _normalize_threshold(threshold, n)
+
+    params = {
+        'n': int(n),
+        'threshold': threshold,
+        'is_sg': bool(is_sg),
+        'markets': markets,
+        'top_n': int(top_n),
+    }
+    cache_key = (
+        f"board:n={params['n']}:threshold={threshold}:is_sg={int(params['is_sg'])}"
+        f":markets={','.join(markets)}:top_n={params['top_n']}"
+    )
+    return params, cache_key
+
+
+def _compute_board_universe(n, is_sg):
+    """计算全市场 n 日榜（不含价格数据，不截断），按最低起涨幅排序"""
+    return StockMonitor(session=get_read_session()).query_stocks(
+        n=n,
+        is_sg=is_sg,
+        include_cyb=True,
+        include_kcb=True,
+        include_bj=True,
+        max_results=None,
+        with_prices=False,
+    )
+
+
+def _universe_cache_key(n, is_sg, generation):
+    return generation_key(f"board_universe:n={n}:is_sg={int(bool(is_sg))}", generation)
+
+
+def prime_board_universe(n, is_sg, rows, generation, cache_mgr=None):
+    """写入已计算好的全市场 n 日榜（发布双榜时调用，避免 API 首次请求时重新计算）"""
+    cache_mgr = cache_mgr or CacheManager()
+    cache_mgr.set(_universe_cache_key(n, is_sg, generation), {'generation': generation, 'rows': rows},
+                  ttl_hours=GENERATION_TTL_HOURS)
+
+
+def get_board_universe(n, is_sg, generation):
+    """
+    获取全市场 n 日榜，结果按 generation 缓存在进程内 LRU 和 query_cache 中
+
+    同一进程内相同参数的并发请求只计算一次。读只读快照时不回写 query_cache，
+    按需计算的结果只留在进程内。
+    """
+    cache_key = _universe_cache_key(n, is_sg, generation)
+    rows = _universe_cache.get(cache_key, generation)
+    if rows is not None:
+        return rows
+
+    def _load():
+        cache_mgr = _reader_cache()
+        cached = cache_mgr.get(cache_key)
+        if cached and cached.get('generation') == generation:
+            rows = cached['rows']
+        else:
+            logger.info(f"计算全市场榜单 ({cache_key})")
+            rows = _compute_board_universe(n, is_sg)
+            prime_board_universe(n, is_sg, rows, generation, cache_mgr)
+        _universe_cache.set(cache_key, rows, generation)
+        return rows
+
+    rows, _ = _board_flight.do((cache_key, generation), _load)
+    return rows
+
+
+def filter_board(universe, params):
+    """在全市场结果上按板块过滤，并按偏离值排序取前 top_n 只"""
+    markets = set(params['markets'])
+    rows = [row for row in universe if row['market'] in markets][:BOARD_MAX_RESULTS]
+    rows = [dict(row, threshold=params['threshold']) for row in rows]
+    rows.sort(key=lambda x: x['deviation'] if x['deviation'] is not None else float('-inf'), reverse=True)
+    return rows[:params['top_n']]
+
+
+def get_board(n, threshold=None, is_sg=False, include_cyb=True,
+              include_kcb=False, include_bj=False, top_n=BOARD_TOP_N):
+    """
+    获取参数化的偏离值榜（参数含义同 StockMonitor.query_stocks）
+
+    结果以规范化参数为 key 缓存，并与数据版本号绑定；
+    板块组合只是对全市场结果的过滤，不会触发重新计算。
+
+    返回:
+        (rows, params, generation, from_cache)
+    """
+    params, cache_key = normalize_board_params(
+        n, threshold, is_sg, include_cyb, include_kcb, include_bj, top_n
+    )
+    generation = get_data_generation()
+
+    rows = _board_cache.get(cache_key, generation)
+    if rows is not None:
+        return rows, params, generation, True
+
+    def _compute():
+        universe = get_board_universe(params['n'], params['is_sg'], generation)
+        result = filter_board(universe, params)
+        _board_cache.set(cache_key, result, generation)
+        return result
+
+    rows, shared = _board_flight.do((cache_key, generation), _compute)
+    return rows, params, generation, shared
+
+
+# ---------- 增量榜单 ----------
+
+def diff_series(old, new):
+    """
+    价格窗口（按 trade_date 升序）的增量
+
+    new 由 old 去掉开头 drop 个点、再在末尾追加若干点得到时返回 {'drop', 'append'}；
+    重叠部分的数据有变化（如复权）时返回 None，调用方应整体替换
+    """
+    old = old or []
+    new = new or []
+    start = next((i for i, point in enumerate(old) if new and point['trade_date'] == new[0]['trade_date']),
+                 len(old))
+    overlap = len(old) - start
+    if new[:overlap] != old[start:]:
+        return None
+    return {'drop': start, 'append': new[overlap:]}
+
+
+def diff_board(old_rows, new_rows):
+    """
+    同一榜单两个版本之间的增量
+
+    返回:
+        {
+            'entered': 新上榜的完整行,
+            'exited': 下榜的 ts_code 列表,
+            'changed': [{'ts_code', 变化的字段...}]（价格数组字段为 diff_series 的结果或新数组，
+                       新版本中不存在的字段为 None）,
+            'order': 新版本的 ts_code 顺序,
+        }
+    """
+    old_by_code = {row['ts_code']: row for row in old_rows}
+    new_codes = {row['ts_code'] for row in new_rows}
+    entered = []
+    changed = []
+    for row in new_rows:
+        prev = old_by_code.get(row['ts_code'])
+        if prev is None:
+            entered.append(row)
+            continue
+        patch = {}
+        for key, value in row.items():
+            if key in prev and prev[key] == value:
+                continue
+            if key in DETAIL_FIELDS and prev.get(key):
+                series = diff_series(prev[key], value)
+                patch[key] = series if series is not None else value
+            else:
+                patch[key] = value
+        patch.update((key, None) for key in prev if key not in row)
+        if patch:
+            changed.append(dict(patch, ts_code=row['ts_code']))
+    return {
+        'entered': entered,
+        'exited': [code for code in old_by_code if code not in new_codes],
+        'changed': changed,
+        'order': [row['ts_code'] for row in new_rows],
+    }
+
+
+def compute_board_delta(old_data, new_data):
+    """
+    双榜数据（{'stocks_10': [...], 'stocks_30': [...]}）两个版本之间的增量，按榜单分别给出
+
+    两边需是同一形式（都从 query_cache 读出，或都经过 JSON 往返），否则字典键类型不同会被当成变化
+    """
+    return {board: diff_board(old_data.get(board) or [], rows or []) for board, rows in new_data.items()}
+
+
+def _publish_delta(cache_mgr, base_key, data, previous_generation, generation):
+    """发布新版本时顺带计算并写入相对上一版本的增量（每次版本切换只计算一次）"""
+    if not previous_generation:
+        return
+    try:
+        old_data = cache_mgr.get(generation_key(base_key, previous_generation))
+        if not old_data:
+            return
+        # 上一版本从 query_cache 读出（经过 JSON），新版本也转成同样的形式再比较：
+        # 否则 t_plus_data 的 int 键与读回的 str 键不相等，每一行都会被当成变化
+        data = json.loads(json.dumps(data, ensure_ascii=False))
+        cache_mgr.set(generation_key(DELTA_KEYS[base_key], generation), {
+            'since': previous_generation,
+            'data': compute_board_delta(old_data, data),
+        }, ttl_hours=GENERATION_TTL_HOURS)
+    except Exception as e:
+        logger.error(f"计算增量榜单失败 ({base_key}, {previous_generation} -> {generation}): {e}")
+
+
+_delta_cache = GenerationLRUCache(len(DELTA_KEYS))
+
+
+def _load_delta(cache_mgr, base_key, since, generation):
+    """读取 since -> generation 的增量：进程内缓存 -> 刷新进程发布的结果 -> 由两个版本的榜单现算"""
+    delta = _delta_cache.get(base_key, generation)
+    if delta is not None:
+        return delta
+
+    def _load():
+        cached = cache_mgr.get(generation_key(DELTA_KEYS[base_key], generation))
+        if cached and cached.get('since') == since:
+            result = cached['data']
+        else:
+            old_data = cache_mgr.get(generation_key(base_key, since))
+            new_data = cache_mgr.get(generation_key(base_key, generation))
+            if not old_data or not new_data:
+                return None
+            logger.info(f"计算增量榜单 ({base_key}, {since} -> {generation})")
+            result = compute_board_delta(old_data, new_data)
+        _delta_cache.set(base_key, result, generation)
+        return result
+
+    delta, _ = _board_flight.do(('delta', base_key, generation), _load)
+    return delta
+
+
+def get_board_delta(base_key, since, cache_mgr=None):
+    """
+    获取客户端版本 since 到当前版本的双榜增量
+
+    since 是当前版本时无变化；是上一版本时返回增量；其他情况（过旧、未知、未指定）返回完整榜单。
+
+    参数:
+        base_key: CACHE_KEY_BOTH 或 CACHE_KEY_SUMMARY
+
+    返回:
+        (mode, data, generation)，mode 为 DELTA_MODE_*；尚未发布时 data 和 generation 为 None
+    """
+    cache_mgr = cache_mgr or _reader_cache()
+    info = get_generation_info(cache_mgr)
+    generation = info.get('generation') if info else None
+    if generation is None:
+        return DELTA_MODE_FULL, None, None
+    if since == generation:
+        return DELTA_MODE_UNCHANGED, None, generation
+    if since and since == info.get('previous'):
+        delta = _load_delta(cache_mgr, base_key, since, generation)
+        if delta is not None:
+            return DELTA_MODE_DELTA, delta, generation
+    return DELTA_MODE_FULL, cache_mgr.get(generation_key(base_key, generation)), generation
+
+
+# ---------- 任意窗口排行 ----------
+
+_range_index_cache = GenerationLRUCache(1)
+
+
+def get_range_index(generation=None):
+    """
+    获取当前数据版本的区间索引（进程内缓存）
+
+    优先加载刷新进程保存的索引文件，版本不符或不存在时从只读快照构建；同一进程内只构建一次。
+    """
+    generation = generation or get_data_generation()
+    index = _range_index_cache.get('range_index', generation)
+    if index is not None:
+        return index
+
+    def _load():
+        index = load_range_index(generation)
+        if index is None:
+            logger.info(f"构建区间索引 (generation={generation})")
+            session = get_read_session()
+            try:
+                index = build_range_index(session, generation=generation)
+            finally:
+                close_session(session)
+        if index is None:
+            raise ValueError("日线数据不足，无法构建区间索引")
+        _range_index_cache.set('range_index', index, generation)
+        return index
+
+    index, _ = _board_flight.do(('range_index', generation), _load)
+    return index
+
+
+def get_window_ranking(n=None, start_date=None, end_date=None, threshold=None, is_sg=False, include_cyb=True,
+                       include_kcb=False, include_bj=False, top_n=BOARD_TOP_N, order_by='deviation'):
+    """
+    任意窗口的偏离值排行：窗口由 n（交易日数）或 start_date 与 end_date（默认最新交易日）指定
+
+    返回:
+        (rows, params, generation)，params 含换算后的 start_date / end_date / days
+    """
+    generation = get_data_generation()
+    index = get_range_index(generation)
+    a, b = index.resolve_window(n, start_date, end_date)
+    days = b - a + 1
+    params = {
+        'start_date': index.dates[a],
+        'end_date': index.dates[b],
+        'days': days,
+        'threshold': _normalize_threshold(threshold, days),
+        'is_sg': bool(is_sg),
+        'markets': board_markets(include_cyb, include_kcb, include_bj),
+        'top_n': int(top_n),
+        'order_by': order_by,
+    }
+    rows = StockMonitor(session=get_read_session()).get_window_ranking(
+        index, start_date=params['start_date'], end_date=params['end_date'], market_filter=params['markets'],
+        include_new=params['is_sg'], order_by=order_by, limit=params['top_n'], threshold=params['threshold'],
+    )
+    return rows, params, generation
+
+
+# ---------- 多进程分片计算 ----------
+
+# 分片进程内的只读会话工厂（由 _init_shard_worker 初始化）
+_shard_engine = None
+_shard_session_factory = None
+
+
+def _init_shard_worker(snapshot_path):
+    """分片进程初始化：打开只读快照"""
+    global _shard_engine, _shard_session_factory
+    _shard_engine = create_readonly_engine(snapshot_path, immutable=True)
+    _shard_session_factory = sessionmaker(bind=_shard_engine)
+
+
+def _close_shard_worker():
+    """关闭分片使用的快照连接（当前进程内顺序计算后调用，否则快照删除后文件仍被连接池占用）"""
+    global _shard_engine, _shard_session_factory
+    if _shard_engine is not None:
+        _shard_engine.dispose()
+    _shard_engine = None
+    _shard_session_factory = None
+
+
+def _compute_board_shard(n, market):
+    """计算单个分片：某个板块的全量 n 日榜（不含价格数据），按最低起涨幅排序"""
+    started = time.perf_counter()
+    session = _shard_session_factory()
+    try:
+        rows = StockMonitor(session=session).query_stocks(
+            n=n,
+            threshold=BOARD_THRESHOLDS.get(n),
+            market_filter=[market],
+            max_results=None,
+            with_prices=False,
+        )
+    finally:
+        session.close()
+    return rows, time.perf_counter() - started
+
+
+def merge_shard_results(shard_rows):
+    """合并各分片结果：各分片已按最低起涨幅降序排列，归并后保持同样的顺序"""
+    return list(heapq.merge(*shard_rows, key=lambda x: x['price_change_low_pct'], reverse=True))
+
+
+def _attach_price_windows(monitor, rows):
+    """为榜单中的股票附加价格数据"""
+    for row in rows:
+        index_code = monitor._get_index_code_by_market(row['market'], row['ts_code'])
+        row['stock_prices'], row['index_prices'] = monitor._get_price_windows(
+            row['ts_code'], index_code, row['start_date'], row['end_date']
+        )
+    return rows
+
+
+def compute_boards_parallel(boards=tuple(BOARD_THRESHOLDS), markets=ALL_MARKETS, max_workers=None):
+    """
+    按 榜单 × 板块 分片，多进程并行计算双榜
+
+    计算前先用 SQLite 在线备份 API 生成只读快照，各分片进程只读快照，
+    不与写库争用；分片结果（按最低起涨幅排序）归并后按默认参数截取榜单。
+
+    参数:
+        boards: 要计算的榜单天数
+        markets: 分片的板块
+        max_workers: 进程数，默认取环境变量 BOARD_WORKERS 或 CPU 核数
+
+    返回:
+        {n: {'board': 默认参数的榜单（含价格数据）, 'universe': 全市场结果（不含价格数据）}}
+    """
+    shards = [(n, market) for n in boards for market in markets]
+    if max_workers is None:
+        max_workers = int(os.getenv('BOARD_WORKERS', 0)) or os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(shards)))
+
+    snapshot_dir = tempfile.mkdtemp(prefix='pyst-board-')
+    snapshot_path = os.path.join(snapshot_dir, 'snapshot.db')
+    try:
+        started = time.perf_counter()
+        backup_database(snapshot_path)
+        logger.info(f"榜单计算快照已生成，耗时 {time.perf_counter() - started:.2f}s")
+
+        shard_results = {}
+        # 各榜单所有分片的耗时之和（分片在子进程中计算，由父进程记入指标）
+        shard_seconds = {n: 0.0 for n in boards}
+        started = time.perf_counter()
+        if 'fork' in multiprocessing.get_all_start_methods() and max_workers > 1:
+            logger.info(f"多进程计算榜单：{len(shards)} 个分片，{max_workers} 个进程")
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_shard_worker,
+                initargs=(snapshot_path,),
+            ) as executor:
+                futures = {executor.submit(_compute_board_shard, n, market): (n, market) for n, market in shards}
+                for future in as_completed(futures):
+                    rows, elapsed = future.result()
+                    shard_results[futures[future]] = rows
+                    shard_seconds[futures[future][0]] += elapsed
+                    logger.info(f"分片 {futures[future]} 完成：{len(rows)} 只，耗时 {elapsed:.2f}s")
+        else:
+            # 不支持 fork 的平台（如 Windows）在当前进程内顺序计算
+            _init_shard_worker(snapshot_path)
+            try:
+                for shard in shards:
+                    rows, elapsed = _compute_board_shard(*shard)
+                    shard_results[shard] = rows
+                    shard_seconds[shard[0]] += elapsed
+                    logger.info(f"分片 {shard} 完成：{len(rows)} 只，耗时 {elapsed:.2f}s")
+            finally:
+                _close_shard_worker()
+        logger.info(f"全部分片计算完成，耗时 {time.perf_counter() - started:.2f}s")
+
+        results = {}
+        # 删除快照前必须关闭会话并释放连接池，否则长期运行的刷新进程每次都会泄漏一个已删除文件的描述符
+        engine = create_readonly_engine(snapshot_path, immutable=True)
+        session = sessionmaker(bind=engine)()
+        try:
+            monitor = StockMonitor(session=session)
+            for n in boards:
+                universe = merge_shard_results([shard_results[(n, market)] for market in markets])
+                params, _ = normalize_board_params(n)
+                board = _attach_price_windows(monitor, filter_board(universe, params))
+                results[n] = {'board': board, 'universe': universe}
+                BOARD_COMPUTE_SECONDS.observe(shard_seconds[n], n=n)
+                BOARD_ROWS.set(len(board), n=n, kind='board')
+                BOARD_ROWS.set(len(universe), n=n, kind='universe')
+        finally:
+            session.close()
+            engine.dispose()
+        return results
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
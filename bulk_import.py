@@ -0,0 +1,319 @@
+"""
+历史日线本地批量导入
+把数据商导出的 CSV / Parquet 文件分块流式写入 stock_daily_data（或 --index 写入 index_daily_data），
+不经过网络，内存占用只与分块大小和股票数量有关，与文件大小无关。
+
+输入为新浪原始字段（与 ak.stock_zh_a_daily 相同）：date, open, high, low, close, volume(股), amount(元)，
+日期列也可叫 trade_date。字段换算与 daily_sources._normalize_sina_daily_df 一致：
+- 个股 vol = volume / 100（手），amount = amount / 1000（千元）；没有 amount 列时（指数）vol 原样、amount 为 0
+- pre_close / change / pct_chg 由同一股票相邻收盘价计算，跨分块、跨文件延续
+  （每只股票记住已写入的最后一天，要求同一股票的行按日期先后出现，否则报错；每只股票第一行的 pre_close 为空）
+
+文件可以是每只股票一个（代码取自文件名，如 000001.SZ.csv / sz000001.parquet，或用 --ts-code 指定），
+也可以是全市场一个（带 ts_code / symbol / code 列，支持 000001.SZ、sz000001、000001 三种写法）。
+
+写库直接用 DBAPI executemany 执行预编译的 upsert（冲突时按列更新，amount 为空时保留已有值），
+每个分块一个事务；--bulk 时在批量导入模式下写库（见 database.bulk_load_session），只应在没有其他进程写库时使用。
+读取 Parquet 需要 duckdb（可选依赖组 analytics）。
+
+    python bulk_import.py data/vendor/                    # 目录下所有 .csv / .parquet
+    python bulk_import.py market_2015_2024.parquet --bulk
+    python bulk_import.py sh000001.csv --index
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+import pandas as pd
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from database import get_session, close_session, bulk_load_session, StockDailyData, IndexDailyData
+from daily_sources import DAILY_COLUMNS, _normalize_date
+from data_manager import _symbol_to_ts_code
+from index_returns import mark_index_data_changed
+from metrics import UPSERT_ROWS, UPSERT_SECONDS, UPSERT_ROWS_PER_SECOND
+from analytics import AnalyticsUnavailable, import_duckdb
+
+# 每个分块的行数
+CHUNK_ROWS = 200000
+FILE_SUFFIXES = ('.csv', '.parquet')
+# 输入列名 -> 标准列名
+COLUMN_ALIASES = {
+    'trade_date': 'date',
+    'symbol': 'ts_code',
+    'code': 'ts_code',
+}
+REQUIRED_COLUMNS = ('date', 'open', 'high', 'low', 'close', 'volume')
+_EXCHANGE_PREFIXES = ('sh', 'sz', 'bj')
+
+
+class UnsortedInputError(ValueError):
+    """同一股票的行没有按日期先后出现，无法延续计算 pre_close"""
+
+
+def _normalize_ts_code(value):
+    """000001.SZ / sz000001 / 000001 -> 000001.SZ"""
+    s = str(value).strip()
+    if '.' in s:
+        code, suffix = s.split('.', 1)
+        return f"{code}.{suffix.upper()}"
+    if s[:2].lower() in _EXCHANGE_PREFIXES and s[2:].isdigit():
+        return f"{s[2:]}.{s[:2].upper()}"
+    return _symbol_to_ts_code(s)
+
+
+def _ts_code_from_path(path):
+    """文件名（去掉扩展名）中的股票代码"""
+    stem = os.path.basename(path)
+    for suffix in FILE_SUFFIXES:
+        if stem.lower().endswith(suffix):
+            stem = stem[:-len(suffix)]
+    return _normalize_ts_code(stem)
+
+
+def _normalize_date_series(values):
+    """向量化的 _normalize_date：常见的 YYYY-MM-DD / YYYYMMDD / 日期类型直接转换，其余逐个处理"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime('%Y%m%d')
+    dates = values.astype(str).str.replace('-', '', regex=False).str.replace('/', '', regex=False).str[:8]
+    irregular = ~dates.str.fullmatch(r'\d{8}')
+    if irregular.any():
+        dates = dates.where(~irregular, values[irregular].map(_normalize_date))
+    return dates
+
+
+def expand_paths(paths):
+    """文件和目录（目录下所有 .csv / .parquet，按文件名排序）展开为文件列表"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith(FILE_SUFFIXES)
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def iter_chunks(path, chunk_rows=CHUNK_ROWS):
+    """按块读取 CSV / Parquet，逐块产出原始 DataFrame（列名已按 COLUMN_ALIASES 统一）"""
+    if path.lower().endswith('.parquet'):
+        duckdb = import_duckdb()
+        con = duckdb.connect()
+        try:
+            result = con.execute("SELECT * FROM read_parquet(?)", [path])
+            vectors = max(1, -(-chunk_rows // 2048))
+            while True:
+                chunk = result.fetch_df_chunk(vectors)
+                if chunk is None or chunk.empty:
+                    break
+                yield chunk.rename(columns=COLUMN_ALIASES)
+        finally:
+            con.close()
+        return
+
+    header = pd.read_csv(path, nrows=0).columns
+    # 代码和日期按字符串读取，避免 000001 丢掉前导零
+    dtype = {column: str for column in header if COLUMN_ALIASES.get(column, column) in ('ts_code', 'date')}
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=dtype):
+        yield chunk.rename(columns=COLUMN_ALIASES)
+
+
+class BulkImporter:
+    """按块导入日线，记住每只股票已写入的最后一天以延续 pre_close"""
+
+    def __init__(self, session, model=StockDailyData):
+        self.session = session
+        self.model = model
+        self.table = model.__tablename__
+        self.last_date = {}
+        self.last_close = {}
+        self.rows = 0
+        self._sql = self._upsert_sql()
+
+    def _upsert_sql(self):
+        updates = [f"{column} = excluded.{column}" for column in DAILY_COLUMNS[2:] if column != 'amount']
+        updates.append("amount = COALESCE(excluded.amount, amount)")
+        updates.append("updated_at = excluded.updated_at")
+        columns = DAILY_COLUMNS + ['created_at', 'updated_at']
+        return (
+            f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (ts_code, trade_date) DO UPDATE SET {', '.join(updates)}"
+        )
+
+    def normalize_chunk(self, raw, ts_code=None):
+        """
+        原始分块 -> DAILY_COLUMNS，并用已写入的最后收盘价补上每只股票第一行的 pre_close
+
+        参数:
+            raw: 原始 DataFrame
+            ts_code: 文件没有代码列时使用的股票代码
+        """
+        missing = [column for column in REQUIRED_COLUMNS if column not in raw.columns]
+        if missing:
+            raise ValueError(f"缺少列 {missing}（已有 {list(raw.columns)}）")
+        if 'ts_code' in raw.columns:
+            codes = raw['ts_code']
+            mapping = {value: _normalize_ts_code(value) for value in codes.unique()}
+            codes = codes.map(mapping)
+        elif ts_code:
+            codes = ts_code
+        else:
+            raise ValueError("文件没有 ts_code / symbol / code 列，需要用文件名或 --ts-code 指定股票代码")
+
+        df = pd.DataFrame({
+            'ts_code': codes,
+            'trade_date': _normalize_date_series(raw['date']),
+            'open': pd.to_numeric(raw['open'], errors='coerce'),
+            'high': pd.to_numeric(raw['high'], errors='coerce'),
+            'low': pd.to_numeric(raw['low'], errors='coerce'),
+            'close': pd.to_numeric(raw['close'], errors='coerce'),
+        }, index=raw.index)
+        volume = pd.to_numeric(raw['volume'], errors='coerce')
+        if 'amount' in raw.columns:
+            df['vol'] = volume / 100.0
+            df['amount'] = pd.to_numeric(raw['amount'], errors='coerce') / 1000.0
+        else:
+            df['vol'] = volume
+            df['amount'] = 0.0
+
+        df = df.sort_values(['ts_code', 'trade_date'], kind='stable')
+        df = df.drop_duplicates(['ts_code', 'trade_date'], keep='last').reset_index(drop=True)
+
+        first = df['ts_code'].ne(df['ts_code'].shift(1))
+        first_codes = df.loc[first, 'ts_code']
+        previous_dates = first_codes.map(self.last_date)
+        unsorted = previous_dates.notna() & (df.loc[first, 'trade_date'] <= previous_dates)
+        if unsorted.any():
+            code = first_codes[unsorted].iloc[0]
+            raise UnsortedInputError(
+                f"{code} 的日线没有按日期先后出现（已导入到 {self.last_date[code]}，"
+                f"又出现 {df.loc[first_codes[unsorted].index[0], 'trade_date']}），请先按代码、日期排序")
+
+        pre_close = df['close'].shift(1)
+        pre_close[first] = first_codes.map(self.last_close)
+        df['pre_close'] = pre_close.astype(float)
+        df['change'] = df['close'] - df['pre_close']
+        df['pct_chg'] = (df['change'] / df['pre_close']) * 100.0
+        return df[DAILY_COLUMNS]
+
+    def write(self, df):
+        """一个分块一个事务写入，提交后记住每只股票的最后一天"""
+        if df.empty:
+            return 0
+        now = datetime.now().isoformat(sep=' ')
+        rows = [row + (now, now) for row in df.itertuples(index=False, name=None)]
+        started = time.perf_counter()
+        self.session.connection().exec_driver_sql(self._sql, rows)
+        self.session.commit()
+        elapsed = time.perf_counter() - started
+
+        last = df.drop_duplicates('ts_code', keep='last')
+        self.last_date.update(zip(last['ts_code'], last['trade_date']))
+        self.last_close.update(zip(last['ts_code'], last['close']))
+
+        UPSERT_ROWS.inc(len(rows), table=self.table)
+        UPSERT_SECONDS.observe(elapsed, table=self.table)
+        if elapsed > 0:
+            UPSERT_ROWS_PER_SECOND.set(len(rows) / elapsed, table=self.table)
+        self.rows += len(rows)
+        return len(rows)
+
+    def import_file(self, path, ts_code=None, chunk_rows=CHUNK_ROWS):
+        """
+        导入一个文件
+
+        返回:
+            写入行数
+        """
+        started = time.perf_counter()
+        ts_code = ts_code or None
+        rows = 0
+        for raw in iter_chunks(path, chunk_rows):
+            if ts_code is None and 'ts_code' not in raw.columns:
+                ts_code = _ts_code_from_path(path)
+            rows += self.write(self.normalize_chunk(raw, ts_code))
+        elapsed = time.perf_counter() - started
+        logger.info(f"{path}: 导入 {rows} 行，用时 {elapsed:.1f}s（{rows / max(elapsed, 1e-6):.0f} 行/秒）")
+        return rows
+
+
+def import_files(paths, index=False, ts_code=None, chunk_rows=CHUNK_ROWS, bulk=False, session=None):
+    """
+    批量导入多个文件（目录展开为其中的 .csv / .parquet）
+
+    单个文件失败时回滚该文件当前分块并继续导入其余文件（已提交的分块保留）。
+
+    参数:
+        index: 写入 index_daily_data（默认 stock_daily_data）
+        ts_code: 文件没有代码列时使用的股票代码（默认取自文件名）
+        bulk: 在批量导入模式下写库
+        session: 数据库会话，默认新建（bulk 时忽略）
+
+    返回:
+        {'rows': 写入行数, 'files': 成功文件数, 'failed': {文件: 错误}}
+    """
+    model = IndexDailyData if index else StockDailyData
+    files = expand_paths(paths)
+    result = {'rows': 0, 'files': 0, 'failed': {}}
+
+    def run(session):
+        importer = BulkImporter(session, model)
+        for path in files:
+            try:
+                importer.import_file(path, ts_code=ts_code, chunk_rows=chunk_rows)
+                result['files'] += 1
+            except AnalyticsUnavailable:
+                raise
+            except Exception as e:
+                logger.error(f"导入 {path} 失败: {e}")
+                session.rollback()
+                result['failed'][path] = str(e)
+        result['rows'] = importer.rows
+
+    if bulk:
+        with bulk_load_session([model.__table__]) as bulk_session:
+            run(bulk_session)
+    else:
+        own_session = session is None
+        session = session or get_session()
+        try:
+            run(session)
+        finally:
+            if own_session:
+                close_session(session)
+
+    if index and result['rows']:
+        mark_index_data_changed()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="从本地 CSV / Parquet 文件批量导入历史日线")
+    parser.add_argument('paths', nargs='+', help="文件或目录（目录下所有 .csv / .parquet）")
+    parser.add_argument('--index', action='store_true', help="导入指数日线（index_daily_data）")
+    parser.add_argument('--ts-code', help="文件没有代码列时使用的代码，默认取自文件名")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help=f"每块行数，默认 {CHUNK_ROWS}")
+    parser.add_argument('--bulk', action='store_true',
+                        help="批量导入模式（导入期间删除二级索引、放宽同步），只应在没有其他进程写库时使用")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        result = import_files(args.paths, index=args.index, ts_code=args.ts_code,
+                              chunk_rows=args.chunk_rows, bulk=args.bulk)
+    except AnalyticsUnavailable as e:
+        print(e)
+        return 1
+    elapsed = time.perf_counter() - started
+    print(f"✅ 导入 {result['files']} 个文件、{result['rows']} 行，用时 {elapsed:.1f}s"
+          f"（{result['rows'] / max(elapsed, 1e-6) * 60:.0f} 行/分钟）")
+    for path, error in result['failed'].items():
+        print(f"❌ {path}: {error}")
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
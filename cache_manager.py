@@ -1,20 +1,38 @@
 """
 缓存管理模块 - 模拟 Redis 缓存功能
 使用数据库表存储缓存数据，加快查询速度
+
+刷新进程发布的数据按数据版本号（generation）分键存放：<key>@<generation>，
+旧版本由 sweep() 清理，读取方始终先读版本指针再读对应版本的数据，不依赖日期或时间段猜测。
 """
 import json
 from datetime import datetime, timedelta
 import logger_config  # 必须在导入 logger 之前
 from loguru import logger
 from database import get_session, close_session, QueryCache
+from metrics import CACHE_REQUESTS, CACHE_SETS, cache_key_label
+from sqlalchemy import func
 from sqlalchemy.dialects.sqlite import insert
 
+# 缓存表的容量上限（条数和 cache_value 总字节数），超出时按更新时间从旧到新淘汰
+CACHE_MAX_ENTRIES = 2000
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# 版本化缓存键的分隔符
+GENERATION_SEPARATOR = '@'
+
+
+def generation_key(cache_key, generation):
+    """按数据版本号区分的缓存键"""
+    return f"{cache_key}{GENERATION_SEPARATOR}{generation}"
+
 
 class CacheManager:
     """缓存管理器 - 模拟 Redis"""
     
-    def __init__(self):
-        self.session = get_session()
+    def __init__(self, session=None):
+        self.session = session or get_session()
+        # 只读快照上的会话不能写入，set 等写操作直接跳过
+        self.readonly = self.session.info.get('readonly', False)
     
     def __del__(self):
         close_session(self.session)
@@ -25,27 +43,28 @@ class CacheManager:
         
         Args:
             cache_key: 缓存键
-            cache_date: 缓存日期（可选，默认为今天）
+            cache_date: 缓存日期（可选，只返回该日期写入的缓存；默认不限日期，只看是否过期）
         
         Returns:
             缓存数据（字典）或 None
         """
         try:
-            if cache_date is None:
-                cache_date = datetime.now().strftime('%Y%m%d')
-            
             # 查询缓存
-            cache = self.session.query(QueryCache).filter(
+            query = self.session.query(QueryCache).filter(
                 QueryCache.cache_key == cache_key,
-                QueryCache.cache_date == cache_date,
                 QueryCache.expire_at > datetime.now()
-            ).first()
+            )
+            if cache_date is not None:
+                query = query.filter(QueryCache.cache_date == cache_date)
+            cache = query.first()
             
             if cache:
                 logger.debug(f"缓存命中: {cache_key}")
+                CACHE_REQUESTS.inc(key=cache_key_label(cache_key), result='hit')
                 return json.loads(cache.cache_value)
             
             logger.debug(f"缓存未命中: {cache_key}")
+            CACHE_REQUESTS.inc(key=cache_key_label(cache_key), result='miss')
             return None
         except Exception as e:
             logger.error(f"获取缓存失败: {e}")
@@ -59,8 +78,11 @@ class CacheManager:
             cache_key: 缓存键
             cache_value: 缓存值（字典或列表）
             ttl_hours: 缓存过期时间（小时）
-            cache_date: 缓存日期（可选，默认为今天）
+            cache_date: 缓存日期（可选，默认为今天，仅作记录）
         """
+        if self.readonly:
+            logger.debug(f"只读快照，跳过写缓存: {cache_key}")
+            return
         try:
             if cache_date is None:
                 cache_date = datetime.now().strftime('%Y%m%d')
@@ -92,6 +114,7 @@ class CacheManager:
             self.session.execute(stmt)
             self.session.commit()
             logger.debug(f"缓存已设置: {cache_key}")
+            CACHE_SETS.inc(key=cache_key_label(cache_key))
         except Exception as e:
             self.session.rollback()
             logger.error(f"设置缓存失败: {e}")
@@ -126,6 +149,66 @@ class CacheManager:
             logger.error(f"清理过期缓存失败: {e}")
             self.session.rollback()
     
+    def evict_generations(self, keep_generations):
+        """删除版本号不在 keep_generations 中的版本化缓存，返回删除条数"""
+        try:
+            keep = {str(g) for g in keep_generations if g}
+            rows = self.session.query(QueryCache.id, QueryCache.cache_key).filter(
+                QueryCache.cache_key.contains(GENERATION_SEPARATOR)
+            ).all()
+            stale_ids = [row.id for row in rows
+                         if row.cache_key.rsplit(GENERATION_SEPARATOR, 1)[1] not in keep]
+            if stale_ids:
+                self.session.query(QueryCache).filter(QueryCache.id.in_(stale_ids)).delete(synchronize_session=False)
+            self.session.commit()
+            return len(stale_ids)
+        except Exception as e:
+            logger.error(f"清理旧版本缓存失败: {e}")
+            self.session.rollback()
+            return 0
+
+    def evict_to_size(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, protected_keys=()):
+        """条数或总大小超出上限时，按更新时间从旧到新淘汰（protected_keys 不淘汰），返回删除条数"""
+        try:
+            rows = self.session.query(
+                QueryCache.id, QueryCache.cache_key, func.length(QueryCache.cache_value)
+            ).order_by(QueryCache.updated_at.desc()).all()
+            protected = set(protected_keys)
+            entries = 0
+            total_bytes = 0
+            evict_ids = []
+            for row_id, cache_key, size in rows:
+                size = size or 0
+                if cache_key not in protected and (entries + 1 > max_entries or total_bytes + size > max_bytes):
+                    evict_ids.append(row_id)
+                    continue
+                entries += 1
+                total_bytes += size
+            if evict_ids:
+                self.session.query(QueryCache).filter(QueryCache.id.in_(evict_ids)).delete(synchronize_session=False)
+            self.session.commit()
+            return len(evict_ids)
+        except Exception as e:
+            logger.error(f"按容量淘汰缓存失败: {e}")
+            self.session.rollback()
+            return 0
+
+    def sweep(self, keep_generations=None, protected_keys=()):
+        """
+        清理缓存：过期条目、旧版本（keep_generations 不为 None 时）和超出容量上限的条目
+
+        由刷新进程定时调用，Web 进程只读不清理。
+
+        返回:
+            (旧版本删除条数, 超出容量删除条数)
+        """
+        self.clear_expired()
+        stale = self.evict_generations(keep_generations) if keep_generations is not None else 0
+        evicted = self.evict_to_size(protected_keys=protected_keys)
+        if stale or evicted:
+            logger.info(f"缓存清理：旧版本 {stale} 条，超出容量 {evicted} 条")
+        return stale, evicted
+
     def clear_all(self, cache_date=None):
         """清理所有缓存"""
         try:
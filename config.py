@@ -2,6 +2,7 @@
 应用配置文件
 包含版权信息、更新日志等配置
 """
+import os
 
 # 应用基本信息
 APP_NAME = "股票异动监控"
@@ -9,6 +10,9 @@ APP_VERSION = "1.2.0"
 COPYRIGHT = "小X爱股"
 WATERMARK = "小X爱股"
 
+# 运行时状态目录（指标快照等），Web 与刷新进程需要共享
+RUNTIME_DIR = os.getenv("RUNTIME_DIR", os.path.join("data", "runtime"))
+
 # 更新日志
 CHANGELOG = [
     {
@@ -0,0 +1,472 @@
+"""
+股票日线多数据源与对冲请求
+同一只股票的不复权日线可以从多个数据源获取（均经过 data_provider，支持录制 / 回放）：
+
+- sina：ak.stock_zh_a_daily（finance.sina.com.cn，默认主源）
+- tencent：ak.stock_zh_a_hist_tx（web.ifzq.gtimg.cn，没有成交额）
+- eastmoney：ak.stock_zh_a_hist（push2his.eastmoney.com，部分网络环境会被 path 级阻断，按需启用）
+
+各数据源的原始返回统一转换为 DAILY_COLUMNS；pre_close / change / pct_chg 一律由相邻收盘价计算，
+不使用数据源自带的涨跌额，避免除权日各源口径不一致。
+
+对冲请求（HedgedDailyFetcher）：先请求主源，若超过该源最近成功请求耗时的 P90 仍未返回，
+再并发请求下一个数据源，先返回有效结果的胜出；某个数据源失败时立即切换到下一个。
+落败的请求无法取消，会在后台跑完，其耗时同样计入 P90 统计。
+对冲请求受预算限制（每次抓取积累 HEDGE_BUDGET_RATIO 个额度），主源整体变慢时
+不会把请求量翻倍、进一步拖慢所有数据源；失败切换不受预算限制。
+各数据源只通过 provider.call(函数名, **参数) 取数，抓取器可以注入自己的 provider
+（回放存储或本地桩），benchmarks/check_hedging.py 用桩数据源校验对冲、胜出和失败切换。
+
+环境变量：
+    DAILY_SOURCES          数据源及优先级，逗号分隔（默认 sina,tencent）
+    DAILY_HEDGE            0 表示关闭对冲，只在失败时切换（默认 1）
+    DAILY_HEDGE_DEFAULT_MS 样本不足时的对冲等待时间（默认 2000）
+    DAILY_HEDGE_MIN_MS     对冲等待时间下限（默认 50）
+    DAILY_HEDGE_BUDGET_RATIO 每次抓取积累的对冲额度（默认 0.1，约 10% 的请求可以对冲）
+    DAILY_HEDGE_BUDGET_BURST 对冲额度上限（默认 10）
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import pandas as pd
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from data_provider import get_provider
+from metrics import FETCH_BACKUP_REQUESTS, FETCH_WINS
+
+SOURCE_SINA = 'sina'
+SOURCE_TENCENT = 'tencent'
+SOURCE_EASTMONEY = 'eastmoney'
+DEFAULT_SOURCES = (SOURCE_SINA, SOURCE_TENCENT)
+
+# 统一后的日线字段（与 stock_daily_data 一致）
+DAILY_COLUMNS = [
+    'ts_code', 'trade_date', 'open', 'high', 'low', 'close',
+    'pre_close', 'change', 'pct_chg', 'vol', 'amount',
+]
+
+# 以最近多少次成功请求的耗时计算对冲等待时间
+LATENCY_WINDOW = 200
+# 样本少于该数量时使用默认等待时间
+LATENCY_MIN_SAMPLES = 20
+HEDGE_PERCENTILE = 0.9
+HEDGE_DEFAULT_MS = float(os.getenv('DAILY_HEDGE_DEFAULT_MS', '2000'))
+HEDGE_MIN_MS = float(os.getenv('DAILY_HEDGE_MIN_MS', '50'))
+# 每次抓取积累的对冲额度（默认约 10% 的请求可以对冲）和额度上限
+HEDGE_BUDGET_RATIO = float(os.getenv('DAILY_HEDGE_BUDGET_RATIO', '0.1'))
+HEDGE_BUDGET_BURST = float(os.getenv('DAILY_HEDGE_BUDGET_BURST', '10'))
+# 执行各数据源请求的线程数（调用方线程只负责等待，需大于抓取并发数）
+HEDGE_MAX_WORKERS = 64
+
+
+class InvalidDailyDataError(ValueError):
+    """数据源返回的日线无法转换为统一字段或数据不完整"""
+
+
+class DailySourcesError(RuntimeError):
+    """所有数据源均请求失败"""
+
+
+# ---------- 字段转换 ----------
+
+def _ts_code_to_sina_symbol(ts_code: str) -> str:
+    """ts_code (000001.SZ) -> 新浪/腾讯格式 (sz000001)"""
+    parts = str(ts_code).split('.')
+    code = parts[0]
+    suffix = parts[1].lower() if len(parts) > 1 else 'sz'
+    return f"{suffix}{code}"
+
+
+def _normalize_date(value) -> str:
+    """统一日期为 YYYYMMDD 字符串"""
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return value.strftime('%Y%m%d')
+    s = str(value)
+    if not s:
+        return ''
+    # 处理 2024-01-01 这种
+    if '-' in s:
+        try:
+            return datetime.strptime(s[:10], '%Y-%m-%d').strftime('%Y%m%d')
+        except ValueError:
+            pass
+    return s.replace('-', '').replace('/', '')[:8]
+
+
+def _finish_daily_df(df: pd.DataFrame, ts_code: str) -> pd.DataFrame:
+    """
+    已有 trade_date / open / high / low / close / vol / amount 的 DataFrame 补全其余字段：
+    按日期排序，pre_close / change / pct_chg 由相邻收盘价计算
+    """
+    df = df.sort_values('trade_date').reset_index(drop=True)
+    df['ts_code'] = ts_code
+    for column in ('open', 'high', 'low', 'close'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    df['pre_close'] = df['close'].shift(1)
+    df['change'] = df['close'] - df['pre_close']
+    df['pct_chg'] = (df['change'] / df['pre_close']) * 100.0
+    return df[DAILY_COLUMNS]
+
+
+def _normalize_sina_daily_df(raw: pd.DataFrame, ts_code: str) -> pd.DataFrame:
+    """
+    新浪 ak.stock_zh_a_daily / ak.stock_zh_index_daily 返回字段标准化。
+
+    新浪原始字段：date, open, high, low, close, volume(股), amount(元),
+                  outstanding_share, turnover  （指数没有 amount）
+    转换后字段对齐数据库 / 原 tushare：
+    - vol 单位手 = volume / 100（个股）；指数直接用 volume（原始单位）
+    - amount 单位千元 = amount / 1000（个股）；指数 amount 缺失 → 0
+    - pre_close / change / pct_chg 由相邻收盘价计算
+    """
+    df = raw.copy()
+    df['trade_date'] = df['date'].apply(_normalize_date)
+
+    vol_raw = pd.to_numeric(df.get('volume'), errors='coerce')
+    if 'amount' in df.columns:
+        amount_raw = pd.to_numeric(df['amount'], errors='coerce')
+        df['vol'] = vol_raw / 100.0
+        df['amount'] = amount_raw / 1000.0
+    else:
+        df['vol'] = vol_raw
+        df['amount'] = 0.0
+    return _finish_daily_df(df, ts_code)
+
+
+def _normalize_tencent_daily_df(raw: pd.DataFrame, ts_code: str) -> pd.DataFrame:
+    """
+    腾讯 ak.stock_zh_a_hist_tx 返回字段标准化。
+
+    腾讯原始字段：date, open, close, high, low, amount（注意是成交量，单位手）
+    - vol = amount（手）
+    - 没有成交额，amount 为 NaN（写库为 NULL，upsert 时保留库中已有值；
+      不用 None，否则批量 upsert 会按是否为 None 拆成多条语句）
+    """
+    df = raw.copy()
+    df['trade_date'] = df['date'].apply(_normalize_date)
+    df['vol'] = pd.to_numeric(df['amount'], errors='coerce')
+    df['amount'] = float('nan')
+    return _finish_daily_df(df, ts_code)
+
+
+def _normalize_eastmoney_daily_df(raw: pd.DataFrame, ts_code: str) -> pd.DataFrame:
+    """
+    东财 ak.stock_zh_a_hist 返回字段标准化。
+
+    东财原始字段：日期, 股票代码, 开盘, 收盘, 最高, 最低, 成交量(手), 成交额(元), 振幅, 涨跌幅, 涨跌额, 换手率
+    - amount 单位千元 = 成交额 / 1000
+    - 涨跌额 / 涨跌幅 不使用（除权日以除权价为基准，与其他数据源不一致）
+    """
+    df = raw.rename(columns={
+        '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+    })
+    df['trade_date'] = df['日期'].apply(_normalize_date)
+    df['vol'] = pd.to_numeric(df['成交量'], errors='coerce')
+    df['amount'] = pd.to_numeric(df['成交额'], errors='coerce') / 1000.0
+    return _finish_daily_df(df, ts_code)
+
+
+# ---------- 数据源 ----------
+
+class DailySource:
+    """单个日线数据源：构造 AKShare 调用参数，并把原始返回转换为 DAILY_COLUMNS"""
+
+    def __init__(self, name, func_name, make_kwargs, normalize):
+        """
+        参数:
+            name: 数据源名称（指标标签、日志）
+            func_name: data_provider 中调用的 AKShare 函数名
+            make_kwargs: (ts_code, start_date, end_date) -> 调用参数
+            normalize: (原始 DataFrame, ts_code) -> 统一字段的 DataFrame
+        """
+        self.name = name
+        self.func_name = func_name
+        self.make_kwargs = make_kwargs
+        self.normalize = normalize
+
+    def __repr__(self):
+        return f"DailySource({self.name})"
+
+    def request(self, ts_code, start_date, end_date):
+        """某只股票某个区间对应的调用参数（录制回放数据时也用它生成请求）"""
+        return self.make_kwargs(ts_code, start_date, end_date)
+
+    def fetch(self, provider, ts_code, start_date, end_date) -> pd.DataFrame:
+        """请求、标准化并截取到请求区间；返回的数据不符合统一字段时抛出 InvalidDailyDataError"""
+        raw = provider.call(self.func_name, **self.request(ts_code, start_date, end_date))
+        if raw is None or raw.empty:
+            return pd.DataFrame(columns=DAILY_COLUMNS)
+        try:
+            df = self.normalize(raw, ts_code)
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidDailyDataError(f"{self.name} 返回的 {ts_code} 日线字段无法识别: {e}") from e
+        # 部分数据源按年返回，pre_close 已由区间前一日算出后再截取（已按日期排序，只看首尾）
+        dates = df['trade_date']
+        if len(df) and (dates.iat[0] < start_date or dates.iat[-1] > end_date):
+            df = df[(dates >= start_date) & (dates <= end_date)].reset_index(drop=True)
+        _check_daily_df(df, self.name, ts_code)
+        return df
+
+
+def _check_daily_df(df, source_name, ts_code):
+    """有效结果：日期不重复，收盘价非空"""
+    if df.empty:
+        return
+    if not df['trade_date'].is_unique:
+        raise InvalidDailyDataError(f"{source_name} 返回的 {ts_code} 日线日期重复")
+    if df['close'].hasnans:
+        raise InvalidDailyDataError(f"{source_name} 返回的 {ts_code} 日线收盘价缺失")
+
+
+SOURCES = {
+    SOURCE_SINA: DailySource(
+        SOURCE_SINA, 'stock_zh_a_daily',
+        lambda ts_code, start_date, end_date: {
+            'symbol': _ts_code_to_sina_symbol(ts_code),
+            'start_date': start_date,
+            'end_date': end_date,
+            'adjust': '',
+        },
+        _normalize_sina_daily_df,
+    ),
+    SOURCE_TENCENT: DailySource(
+        SOURCE_TENCENT, 'stock_zh_a_hist_tx',
+        lambda ts_code, start_date, end_date: {
+            'symbol': _ts_code_to_sina_symbol(ts_code),
+            'start_date': start_date,
+            'end_date': end_date,
+            'adjust': '',
+        },
+        _normalize_tencent_daily_df,
+    ),
+    SOURCE_EASTMONEY: DailySource(
+        SOURCE_EASTMONEY, 'stock_zh_a_hist',
+        lambda ts_code, start_date, end_date: {
+            'symbol': str(ts_code).split('.')[0],
+            'period': 'daily',
+            'start_date': start_date,
+            'end_date': end_date,
+            'adjust': '',
+        },
+        _normalize_eastmoney_daily_df,
+    ),
+}
+
+
+def sources_from_names(names):
+    """数据源名称（列表或逗号分隔字符串）-> DailySource 列表，保持顺序"""
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown:
+        raise ValueError(f"不支持的日线数据源: {unknown}，可选 {tuple(SOURCES)}")
+    if not names:
+        raise ValueError("至少需要一个日线数据源")
+    return [SOURCES[name] for name in names]
+
+
+# ---------- 对冲请求 ----------
+
+class LatencyTracker:
+    """按数据源统计最近成功请求的耗时，给出对冲等待时间"""
+
+    def __init__(self, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES,
+                 default_ms=HEDGE_DEFAULT_MS, min_ms=HEDGE_MIN_MS, percentile=HEDGE_PERCENTILE):
+        self.window = window
+        self.min_samples = min_samples
+        self.default_ms = default_ms
+        self.min_ms = min_ms
+        self.percentile = percentile
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, source_name, seconds):
+        with self._lock:
+            samples = self._samples.get(source_name)
+            if samples is None:
+                samples = self._samples[source_name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def hedge_delay(self, source_name):
+        """等待该数据源多久后发出对冲请求（秒）：最近耗时的 P90，样本不足时用默认值"""
+        with self._lock:
+            samples = sorted(self._samples.get(source_name, ()))
+        if len(samples) < self.min_samples:
+            delay_ms = self.default_ms
+        else:
+            delay_ms = samples[int(self.percentile * (len(samples) - 1))] * 1000
+        return max(delay_ms, self.min_ms) / 1000
+
+    def stats(self):
+        """{数据源: {'samples', 'hedge_delay_ms'}}"""
+        with self._lock:
+            names = list(self._samples)
+        return {
+            name: {
+                'samples': len(self._samples[name]),
+                'hedge_delay_ms': round(self.hedge_delay(name) * 1000, 1),
+            }
+            for name in names
+        }
+
+
+class HedgedDailyFetcher:
+    """
+    按优先级请求多个日线数据源（可在多个线程中共享）
+
+    对冲时 fetch 在调用方线程中等待，实际请求在内部线程池中执行；
+    线程池按进程创建，fork 出的子进程会重新创建。只有一个数据源或关闭对冲时直接在调用方线程中请求。
+    """
+
+    def __init__(self, sources, hedge=True, tracker=None, max_workers=HEDGE_MAX_WORKERS, provider=None,
+                 budget_ratio=HEDGE_BUDGET_RATIO, budget_burst=HEDGE_BUDGET_BURST):
+        """
+        参数:
+            sources: DailySource 列表（按优先级）
+            hedge: 是否对冲，False 时只在失败时切换
+            tracker: 耗时统计，默认新建 LatencyTracker
+            provider: 数据源调用入口（需提供 call(func_name, **kwargs)），默认 data_provider.get_provider()
+            budget_ratio / budget_burst: 每次抓取积累的对冲额度和额度上限
+        """
+        self.sources = list(sources)
+        self.hedge = hedge
+        self.tracker = tracker or LatencyTracker()
+        self.max_workers = max_workers
+        self.provider = provider
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self._hedge_tokens = budget_burst
+        self._budget_lock = threading.Lock()
+
+    def _earn_hedge_token(self):
+        with self._budget_lock:
+            self._hedge_tokens = min(self.budget_burst, self._hedge_tokens + self.budget_ratio)
+
+    def _take_hedge_token(self):
+        with self._budget_lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            return True
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor_pid != pid:
+            with self._executor_lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='daily-source')
+                    self._executor_pid = pid
+        return self._executor
+
+    def _attempt(self, provider, source, ts_code, start_date, end_date):
+        started = time.perf_counter()
+        df = source.fetch(provider, ts_code, start_date, end_date)
+        self.tracker.observe(source.name, time.perf_counter() - started)
+        return df
+
+    def fetch(self, ts_code, start_date, end_date) -> pd.DataFrame:
+        """
+        获取单只股票日线，返回 DAILY_COLUMNS 字段的 DataFrame（不写库）
+
+        所有数据源都失败时抛出 DailySourcesError
+        """
+        provider = self.provider or get_provider()
+        if not self.hedge or len(self.sources) == 1:
+            return self._fetch_sequential(provider, ts_code, start_date, end_date)
+
+        executor = self._get_executor()
+        self._earn_hedge_token()
+        hedge = self.hedge
+        remaining = list(self.sources)
+        pending = {}
+        errors = []
+
+        def launch(reason=None):
+            source = remaining.pop(0)
+            if reason:
+                FETCH_BACKUP_REQUESTS.inc(source=source.name, reason=reason)
+            future = executor.submit(self._attempt, provider, source, ts_code, start_date, end_date)
+            pending[future] = source
+            return source
+
+        latest = launch()
+        while pending:
+            timeout = self.tracker.hedge_delay(latest.name) if hedge and remaining else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if self._take_hedge_token():
+                    # 超过 P90 仍未返回，再请求下一个数据源
+                    latest = launch('hedge')
+                else:
+                    # 对冲预算用尽，只等待已发出的请求
+                    hedge = False
+                continue
+            for future in done:
+                source = pending.pop(future)
+                try:
+                    df = future.result()
+                except Exception as e:
+                    errors.append(f"{source.name}: {e}")
+                    logger.debug(f"{ts_code} 从 {source.name} 获取日线失败: {e}")
+                    continue
+                FETCH_WINS.inc(source=source.name)
+                return df
+            if remaining and not pending:
+                latest = launch('failover')
+        raise DailySourcesError(f"{ts_code} 所有日线数据源均失败: {'; '.join(errors)}")
+
+    def _fetch_sequential(self, provider, ts_code, start_date, end_date):
+        """不对冲时在调用方线程中依次请求，失败才切换（省去线程池交接）"""
+        errors = []
+        for i, source in enumerate(self.sources):
+            if i:
+                FETCH_BACKUP_REQUESTS.inc(source=source.name, reason='failover')
+            try:
+                df = self._attempt(provider, source, ts_code, start_date, end_date)
+            except Exception as e:
+                errors.append(f"{source.name}: {e}")
+                logger.debug(f"{ts_code} 从 {source.name} 获取日线失败: {e}")
+                continue
+            FETCH_WINS.inc(source=source.name)
+            return df
+        raise DailySourcesError(f"{ts_code} 所有日线数据源均失败: {'; '.join(errors)}")
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def fetcher_from_env():
+    """根据环境变量创建日线抓取器"""
+    return HedgedDailyFetcher(
+        sources_from_names(os.getenv('DAILY_SOURCES', ','.join(DEFAULT_SOURCES))),
+        hedge=os.getenv('DAILY_HEDGE', '1') != '0',
+    )
+
+
+def get_daily_fetcher():
+    """获取当前进程的日线抓取器（首次调用时按环境变量创建）"""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = fetcher_from_env()
+                names = ','.join(source.name for source in _fetcher.sources)
+                logger.info(f"日线数据源: {names}（对冲{'开启' if _fetcher.hedge else '关闭'}）")
+    return _fetcher
+
+
+def set_daily_fetcher(fetcher):
+    """替换当前进程的日线抓取器（None 表示下次按环境变量重新创建）"""
+    global _fetcher
+    _fetcher = fetcher
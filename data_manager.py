@@ -1,41 +1,82 @@
 """
 数据管理模块
 负责从 AKShare 获取股票数据并存储到 SQLite 数据库
+
+数据源调用都经过 data_provider（live / record / replay 三种模式），
+akshare 依赖树很大（导入约 1~2 秒），只在 live / record 模式真正请求时才导入。
 """
-import akshare as ak
+import time
+import uuid
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from tqdm import tqdm
+from sqlalchemy import func, update
 from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import logger_config  # 必须在导入 logger 之前
 from loguru import logger
-from database import get_session, close_session, StockBasic, StockDailyData, IndexDailyData, TradeCal
-
-
-def _upsert_stock_daily(session, rows):
-    """SQLite upsert：批量 insert，冲突时按列更新。比逐行 merge 快 10-20 倍。"""
+from data_provider import get_provider
+from daily_sources import get_daily_fetcher, _normalize_date, _normalize_sina_daily_df, _ts_code_to_sina_symbol
+from metrics import UPSERT_ROWS, UPSERT_SECONDS, UPSERT_ROWS_PER_SECOND
+from index_returns import mark_index_data_changed
+from refresh_status import PROGRESS
+from database import (
+    get_session, close_session, StockBasic, StockDailyData, IndexDailyData, TradeCal,
+    FetchRun, FetchTask,
+)
+
+# 抓取任务（断点续传）
+FETCH_KIND_STOCK_DAILY = 'stock_daily'
+RUN_STATUS_RUNNING = 'running'
+RUN_STATUS_PARTIAL = 'partial'
+RUN_STATUS_DONE = 'done'
+TASK_STATUS_PENDING = 'pending'
+TASK_STATUS_DONE = 'done'
+TASK_STATUS_FAILED = 'failed'
+# 失败代码的最大尝试次数（含首次）
+FETCH_MAX_ATTEMPTS = 3
+
+# 新浪 stock_zh_a_daily 走 finance.sina.com.cn，无限流问题，默认 30 线程并发
+SINA_MAX_WORKERS = 30
+# 每累计多少行提交一次事务
+UPSERT_BATCH_ROWS = 2000
+
+
+def _upsert_daily(session, model, rows):
+    """SQLite upsert：executemany 批量 insert，冲突时按列更新。比逐行 merge 快 10-20 倍。"""
     if not rows:
         return
-    stmt = sqlite_insert(StockDailyData).values(rows)
-    now = datetime.now()
-    update_cols = {
-        'open': stmt.excluded.open,
-        'high': stmt.excluded.high,
-        'low': stmt.excluded.low,
-        'close': stmt.excluded.close,
-        'pre_close': stmt.excluded.pre_close,
-        'change': stmt.excluded.change,
-        'pct_chg': stmt.excluded.pct_chg,
-        'vol': stmt.excluded.vol,
-        'amount': stmt.excluded.amount,
-        'updated_at': now,
-    }
+    stmt = sqlite_insert(model)
     stmt = stmt.on_conflict_do_update(
         index_elements=['ts_code', 'trade_date'],
-        set_=update_cols,
+        set_={
+            'open': stmt.excluded.open,
+            'high': stmt.excluded.high,
+            'low': stmt.excluded.low,
+            'close': stmt.excluded.close,
+            'pre_close': stmt.excluded.pre_close,
+            'change': stmt.excluded.change,
+            'pct_chg': stmt.excluded.pct_chg,
+            'vol': stmt.excluded.vol,
+            # 腾讯数据源没有成交额，保留库中已有值
+            'amount': func.coalesce(stmt.excluded.amount, model.amount),
+            'updated_at': datetime.now(),
+        },
     )
-    session.execute(stmt)
+    started = time.perf_counter()
+    session.execute(stmt, rows)
+    elapsed = time.perf_counter() - started
+
+    table = model.__tablename__
+    UPSERT_ROWS.inc(len(rows), table=table)
+    UPSERT_SECONDS.observe(elapsed, table=table)
+    if elapsed > 0:
+        UPSERT_ROWS_PER_SECOND.set(len(rows) / elapsed, table=table)
+
+
+def _upsert_stock_daily(session, rows):
+    """股票日线 upsert"""
+    _upsert_daily(session, StockDailyData, rows)
 
 
 # ---------- 工具函数 ----------
@@ -55,39 +96,15 @@ def _symbol_to_ts_code(symbol: str) -> str:
     return f"{code}.SZ"
 
 
-def _ts_code_to_sina_symbol(ts_code: str) -> str:
-    """ts_code (000001.SZ) -> 新浪/腾讯格式 (sz000001)"""
-    parts = str(ts_code).split('.')
-    code = parts[0]
-    suffix = parts[1].lower() if len(parts) > 1 else 'sz'
-    return f"{suffix}{code}"
-
-
-def _normalize_date(value) -> str:
-    """统一日期为 YYYYMMDD 字符串"""
-    if value is None:
-        return ''
-    if isinstance(value, (datetime, pd.Timestamp)):
-        return value.strftime('%Y%m%d')
-    s = str(value)
-    if not s:
-        return ''
-    # 处理 2024-01-01 这种
-    if '-' in s:
-        try:
-            return datetime.strptime(s[:10], '%Y-%m-%d').strftime('%Y%m%d')
-        except ValueError:
-            pass
-    return s.replace('-', '').replace('/', '')[:8]
-
-
 # ---------- DataManager ----------
 
 class DataManager:
     """数据管理类"""
 
-    def __init__(self):
-        self.session = get_session()
+    def __init__(self, session=None):
+        self.session = session or get_session()
+        # 最近一次 fetch_stock_daily_batch 使用的抓取任务 ID
+        self.last_fetch_run_id = None
 
     def __del__(self):
         close_session(self.session)
@@ -152,6 +169,7 @@ class DataManager:
 
     def _fetch_stock_basic_dataframe(self) -> pd.DataFrame:
         """整合沪深京三大交易所的股票列表，返回统一字段的 DataFrame"""
+        ak = get_provider()
         frames = []
 
         # 上交所 - 主板A股
@@ -258,6 +276,7 @@ class DataManager:
 
     def fetch_trade_cal(self, exchange='SSE', start_date=None, end_date=None):
         """获取交易日历数据（基于 akshare 的 A 股交易日历）"""
+        ak = get_provider()
         try:
             if not start_date:
                 start_date = (datetime.now() - timedelta(days=365)).strftime('%Y%m%d')
@@ -353,27 +372,31 @@ class DataManager:
     def _fetch_one_stock_daily(self, ts_code, start_date, end_date) -> pd.DataFrame:
         """获取单只股票日线，返回标准化字段的 DataFrame（不写库）
 
-        改用新浪 ak.stock_zh_a_daily：东财 push2his.eastmoney.com 在部分网络环境
-        （服务器 Clash/mihomo 透明代理）会被 path 级阻断；新浪走 finance.sina.com.cn
-        在同环境可用。
+        按 DAILY_SOURCES 的优先级请求多个数据源（默认新浪 ak.stock_zh_a_daily，腾讯备用）：
+        主源超过最近 P90 耗时未返回时并发请求备用源，先返回有效结果的胜出，见 daily_sources。
+        东财 push2his.eastmoney.com 在部分网络环境（服务器 Clash/mihomo 透明代理）会被
+        path 级阻断，默认不启用。
         """
-        symbol = _ts_code_to_sina_symbol(ts_code)
-        raw = ak.stock_zh_a_daily(
-            symbol=symbol,
-            start_date=start_date,
-            end_date=end_date,
-            adjust='',
-        )
-        if raw is None or raw.empty:
-            return pd.DataFrame()
-        return _normalize_sina_daily_df(raw, ts_code)
+        return get_daily_fetcher().fetch(ts_code, start_date, end_date)
 
-    def fetch_stock_daily_batch(self, ts_codes, start_date=None, end_date=None, exchange='SSE'):
+    def fetch_stock_daily_batch(self, ts_codes, start_date=None, end_date=None, exchange='SSE', resume=True,
+                                max_workers=SINA_MAX_WORKERS, batch_rows=UPSERT_BATCH_ROWS, return_data=True):
         """
         批量获取多只股票的日线数据（逐只调用 akshare）
 
         akshare 不支持批量请求，这里在内部循环逐只获取，
         但保留了与原接口相同的入参/出参以兼容上层调用。
+
+        每次批量抓取对应一条抓取任务（FetchRun），每只股票的状态持久化在
+        FetchTask 中，随数据一起提交。中途中断（进程重启、网络异常）后，
+        以相同日期区间再次调用会从断点继续，只抓取未完成的股票。
+        本次使用的任务 ID 记录在 self.last_fetch_run_id。
+
+        参数:
+            resume: 是否从相同日期区间的未完成任务断点续传，默认 True
+            max_workers: 并发抓取线程数
+            batch_rows: 每累计多少行提交一次事务
+            return_data: 为 False 时不在内存中保留数据，只返回写入行数（全量导入用）
         """
         try:
             if not start_date:
@@ -386,130 +409,335 @@ class DataManager:
 
             logger.info(f"批量获取 {len(ts_codes)} 只股票的日线数据: {start_date} - {end_date}")
 
-            # 检查日期边界是否已有数据，决定是否缩窄区间
-            start_date_has_data = self.session.query(StockDailyData).filter(
-                StockDailyData.trade_date == start_date
-            ).first() is not None
+            run = self._find_unfinished_fetch_run(FETCH_KIND_STOCK_DAILY, start_date, end_date) if resume else None
+            if run:
+                added = self._add_fetch_tasks(run.run_id, ts_codes)
+                logger.info(
+                    f"发现未完成的抓取任务 {run.run_id}，断点续传: "
+                    f"{run.fetch_start_date} - {run.fetch_end_date}（新增 {added} 只）"
+                )
+            else:
+                fetch_range = self._narrow_stock_daily_range(start_date, end_date, exchange)
+                if fetch_range is None:
+                    return None if return_data else 0
+                run = self._create_fetch_run(FETCH_KIND_STOCK_DAILY, start_date, end_date, *fetch_range, ts_codes)
+            self.last_fetch_run_id = run.run_id
+
+            codes = self._get_fetch_task_codes(run.run_id, (TASK_STATUS_PENDING, TASK_STATUS_FAILED))
+            done_count = run.total - len(codes)
+            if done_count:
+                logger.info(f"抓取任务 {run.run_id} 已完成 {done_count} 只，剩余 {len(codes)} 只")
+
+            all_data, total_rows = self._execute_fetch_tasks(
+                run, codes, "获取股票日线数据",
+                max_workers=max_workers, batch_rows=batch_rows, keep_data=return_data
+            )
+            self._finish_fetch_run(run.run_id)
 
-            end_date_has_data = self.session.query(StockDailyData).filter(
-                StockDailyData.trade_date == end_date
-            ).first() is not None
+            if not return_data:
+                logger.info(f"批量获取完成，共写入 {total_rows} 条日线数据")
+                return total_rows
 
-            if start_date_has_data and end_date_has_data:
-                logger.info(f"开始日期 {start_date} 和结束日期 {end_date} 都有股票数据，跳过获取")
-                return None
+            if all_data:
+                total_rows = sum(len(df) for df in all_data)
+                logger.info(f"批量获取完成，共获取 {total_rows} 条日线数据")
+                return pd.concat(all_data, ignore_index=True)
 
-            if not end_date_has_data:
-                latest_daily = self.session.query(StockDailyData).order_by(
-                    StockDailyData.trade_date.desc()
-                ).first()
+            logger.warning("未获取到任何日线数据")
+            return None
+        except Exception as e:
+            logger.error(f"批量获取日线数据失败: {e}")
+            self.session.rollback()
+            raise
 
-                if latest_daily:
-                    latest_trade_date = latest_daily.trade_date
-                    logger.info(f"缺少结束日期数据，数据库中最新交易日期: {latest_trade_date}")
+    def retry_failed_stock_daily(self, run_id=None, max_attempts=FETCH_MAX_ATTEMPTS):
+        """
+        重试抓取任务中失败的股票（尝试次数未达到 max_attempts 的）
 
-                    next_trade_date = self.session.query(TradeCal).filter(
-                        TradeCal.exchange == exchange,
-                        TradeCal.cal_date > latest_trade_date,
-                        TradeCal.is_open == '1'
-                    ).order_by(TradeCal.cal_date.asc()).first()
+        参数:
+            run_id: 抓取任务 ID，默认为本实例最近一次 fetch_stock_daily_batch 的任务
+            max_attempts: 最大尝试次数（含首次）
 
-                    if next_trade_date:
-                        start_date = next_trade_date.cal_date
-                        logger.info(f"更新开始日期为最新交易日期的下一个交易日: {start_date}")
-                    else:
-                        logger.warning(f"未找到 {latest_trade_date} 之后的交易日，使用原始开始日期: {start_date}")
-                else:
-                    logger.info("数据库中无股票数据，使用原始开始日期")
+        返回:
+            仍然失败的股票数量
+        """
+        run_id = run_id or self.last_fetch_run_id
+        if not run_id:
+            return 0
+        try:
+            run = self.session.get(FetchRun, run_id)
+            if run is None:
+                logger.warning(f"未找到抓取任务 {run_id}")
+                return 0
+
+            codes = [
+                task.ts_code for task in self.session.query(FetchTask).filter(
+                    FetchTask.run_id == run_id,
+                    FetchTask.status == TASK_STATUS_FAILED,
+                    FetchTask.attempts < max_attempts
+                ).all()
+            ]
+            if codes:
+                logger.info(f"重试抓取任务 {run_id} 中失败的 {len(codes)} 只股票")
+                self._execute_fetch_tasks(run, codes, "重试失败股票", keep_data=False)
+            self._finish_fetch_run(run_id)
+
+            return self.session.query(FetchTask).filter(
+                FetchTask.run_id == run_id,
+                FetchTask.status == TASK_STATUS_FAILED
+            ).count()
+        except Exception as e:
+            logger.error(f"重试失败股票出错: {e}")
+            self.session.rollback()
+            raise
 
-            elif not start_date_has_data:
-                earliest_daily = self.session.query(StockDailyData).order_by(
-                    StockDailyData.trade_date.asc()
-                ).first()
+    def _narrow_stock_daily_range(self, start_date, end_date, exchange):
+        """
+        根据库中已有数据缩窄抓取区间
 
-                if earliest_daily:
-                    earliest_trade_date = earliest_daily.trade_date
-                    logger.info(f"缺少开始日期数据，数据库中最早交易日期: {earliest_trade_date}")
+        返回:
+            (start_date, end_date)，首尾日期都已有数据时返回 None（无需抓取）
+        """
+        # 检查日期边界是否已有数据，决定是否缩窄区间
+        start_date_has_data = self.session.query(StockDailyData).filter(
+            StockDailyData.trade_date == start_date
+        ).first() is not None
 
-                    prev_trade_date = self.session.query(TradeCal).filter(
-                        TradeCal.exchange == exchange,
-                        TradeCal.cal_date < earliest_trade_date,
-                        TradeCal.is_open == '1'
-                    ).order_by(TradeCal.cal_date.desc()).first()
+        end_date_has_data = self.session.query(StockDailyData).filter(
+            StockDailyData.trade_date == end_date
+        ).first() is not None
 
-                    if prev_trade_date:
-                        end_date = prev_trade_date.cal_date
-                        logger.info(f"更新结束日期为最早交易日期的上一个交易日: {end_date}")
-                    else:
-                        logger.warning(f"未找到 {earliest_trade_date} 之前的交易日，使用原始结束日期: {end_date}")
-                else:
-                    logger.info("数据库中无股票数据，使用原始结束日期")
+        if start_date_has_data and end_date_has_data:
+            logger.info(f"开始日期 {start_date} 和结束日期 {end_date} 都有股票数据，跳过获取")
+            return None
 
-            trading_days_count = self.count_trading_days(start_date, end_date, exchange)
-            logger.info(f"日期范围内交易日数量: {trading_days_count}")
+        if not end_date_has_data:
+            latest_daily = self.session.query(StockDailyData).order_by(
+                StockDailyData.trade_date.desc()
+            ).first()
 
-            # 新浪 stock_zh_a_daily 走 finance.sina.com.cn，无限流问题，开 30 线程并发
-            max_workers = 30
-            all_data = []
-            err_count = 0
-            logger.info(f"新浪并发拉取 {len(ts_codes)} 只股票（{max_workers} 线程）")
+            if latest_daily:
+                latest_trade_date = latest_daily.trade_date
+                logger.info(f"缺少结束日期数据，数据库中最新交易日期: {latest_trade_date}")
 
-            # 用 SQLite upsert 批量写库（避免逐行 merge 的 SELECT 开销）
-            UPSERT_BATCH_ROWS = 2000
-            pending_rows = []
+                next_trade_date = self.session.query(TradeCal).filter(
+                    TradeCal.exchange == exchange,
+                    TradeCal.cal_date > latest_trade_date,
+                    TradeCal.is_open == '1'
+                ).order_by(TradeCal.cal_date.asc()).first()
 
-            def _flush_rows(force=False):
-                nonlocal pending_rows
-                if not pending_rows:
-                    return
-                if not force and len(pending_rows) < UPSERT_BATCH_ROWS:
-                    return
-                _upsert_stock_daily(self.session, pending_rows)
-                self.session.commit()
-                pending_rows = []
+                if next_trade_date:
+                    start_date = next_trade_date.cal_date
+                    logger.info(f"更新开始日期为最新交易日期的下一个交易日: {start_date}")
+                else:
+                    logger.warning(f"未找到 {latest_trade_date} 之后的交易日，使用原始开始日期: {start_date}")
+            else:
+                logger.info("数据库中无股票数据，使用原始开始日期")
+
+        elif not start_date_has_data:
+            earliest_daily = self.session.query(StockDailyData).order_by(
+                StockDailyData.trade_date.asc()
+            ).first()
+
+            if earliest_daily:
+                earliest_trade_date = earliest_daily.trade_date
+                logger.info(f"缺少开始日期数据，数据库中最早交易日期: {earliest_trade_date}")
+
+                prev_trade_date = self.session.query(TradeCal).filter(
+                    TradeCal.exchange == exchange,
+                    TradeCal.cal_date < earliest_trade_date,
+                    TradeCal.is_open == '1'
+                ).order_by(TradeCal.cal_date.desc()).first()
+
+                if prev_trade_date:
+                    end_date = prev_trade_date.cal_date
+                    logger.info(f"更新结束日期为最早交易日期的上一个交易日: {end_date}")
+                else:
+                    logger.warning(f"未找到 {earliest_trade_date} 之前的交易日，使用原始结束日期: {end_date}")
+            else:
+                logger.info("数据库中无股票数据，使用原始结束日期")
 
-            def _stage_df(df):
-                """把单只 DataFrame 转 dict 加入待写队列；达到阈值就 flush。"""
-                pending_rows.extend(df.to_dict(orient='records'))
-                _flush_rows()
-
-            def _safe_fetch(code):
-                try:
-                    return code, self._fetch_one_stock_daily(code, start_date, end_date), None
-                except Exception as e:
-                    return code, None, str(e)
-
-            with tqdm(total=len(ts_codes), desc="获取股票日线数据", unit="只") as pbar:
-                with ThreadPoolExecutor(max_workers=max_workers) as ex:
-                    futures = [ex.submit(_safe_fetch, c) for c in ts_codes]
-                    for fut in as_completed(futures):
-                        code, df, err = fut.result()
-                        if err is not None:
-                            err_count += 1
-                            logger.error(f"获取 {code} 失败: {err}")
-                            pbar.update(1)
-                            continue
-                        if df is None or df.empty:
-                            pbar.update(1)
-                            continue
-                        _stage_df(df)
-                        all_data.append(df)
-                        pbar.update(1)
+        trading_days_count = self.count_trading_days(start_date, end_date, exchange)
+        logger.info(f"日期范围内交易日数量: {trading_days_count}")
+        return start_date, end_date
 
-                _flush_rows(force=True)
+    def _execute_fetch_tasks(self, run, codes, desc, max_workers=SINA_MAX_WORKERS,
+                             batch_rows=UPSERT_BATCH_ROWS, keep_data=True):
+        """
+        并发抓取 codes 的日线并写库，同时在同一事务中更新每只股票的抓取状态
 
-            if err_count:
-                logger.warning(f"批量抓取共有 {err_count} 只失败")
+        返回:
+            (成功获取到数据的 DataFrame 列表, 写入行数)，keep_data=False 时列表为空
+        """
+        start_date, end_date = run.fetch_start_date, run.fetch_end_date
+
+        all_data = []
+        total_rows = 0
+        err_count = 0
+        logger.info(f"新浪并发拉取 {len(codes)} 只股票（{max_workers} 线程）")
+        PROGRESS.set_total(len(codes))
+
+        # 用 SQLite upsert 批量写库（避免逐行 merge 的 SELECT 开销）
+        pending_rows = []
+        pending_codes = []
+
+        def _flush_rows(force=False):
+            nonlocal pending_rows, pending_codes
+            if not pending_codes:
+                return
+            if not force and len(pending_rows) < batch_rows:
+                return
+            _upsert_stock_daily(self.session, pending_rows)
+            # 数据和抓取状态在同一事务中提交，中断后不会出现“已写入但未标记”的股票
+            self._mark_fetch_tasks(run.run_id, pending_codes, TASK_STATUS_DONE)
+            self.session.commit()
+            pending_rows = []
+            pending_codes = []
 
-            if all_data:
-                total_rows = sum(len(df) for df in all_data)
-                logger.info(f"批量获取完成，共获取 {total_rows} 条日线数据")
-                return pd.concat(all_data, ignore_index=True)
+        def _stage_df(code, df):
+            """把单只 DataFrame 转 dict 加入待写队列；达到阈值就 flush。"""
+            if df is not None and not df.empty:
+                pending_rows.extend(df.to_dict(orient='records'))
+            pending_codes.append(code)
+            _flush_rows()
+
+        def _safe_fetch(code):
+            try:
+                return code, self._fetch_one_stock_daily(code, start_date, end_date), None
+            except Exception as e:
+                return code, None, str(e)
+
+        with tqdm(total=len(codes), desc=desc, unit="只") as pbar:
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                futures = [ex.submit(_safe_fetch, c) for c in codes]
+                for fut in as_completed(futures):
+                    code, df, err = fut.result()
+                    if err is not None:
+                        err_count += 1
+                        logger.error(f"获取 {code} 失败: {err}")
+                        self._mark_fetch_tasks(run.run_id, [code], TASK_STATUS_FAILED, error=err)
+                        self.session.commit()
+                        pbar.update(1)
+                        PROGRESS.advance(failed=1)
+                        continue
+                    _stage_df(code, df)
+                    if df is not None and not df.empty:
+                        total_rows += len(df)
+                        if keep_data:
+                            all_data.append(df)
+                    pbar.update(1)
+                    PROGRESS.advance(done=1)
+
+            _flush_rows(force=True)
+
+        if err_count:
+            logger.warning(f"批量抓取共有 {err_count} 只失败")
+        return all_data, total_rows
+
+    # ---------- 抓取任务（断点续传） ----------
+
+    def _find_unfinished_fetch_run(self, kind, start_date, end_date):
+        """查找相同类型和请求区间的最近一次未完成抓取任务"""
+        return self.session.query(FetchRun).filter(
+            FetchRun.kind == kind,
+            FetchRun.start_date == start_date,
+            FetchRun.end_date == end_date,
+            FetchRun.status.in_([RUN_STATUS_RUNNING, RUN_STATUS_PARTIAL])
+        ).order_by(FetchRun.created_at.desc()).first()
+
+    def _create_fetch_run(self, kind, start_date, end_date, fetch_start_date, fetch_end_date, ts_codes):
+        """创建抓取任务，所有代码初始为 pending"""
+        run = FetchRun(
+            run_id=f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}",
+            kind=kind,
+            start_date=start_date,
+            end_date=end_date,
+            fetch_start_date=fetch_start_date,
+            fetch_end_date=fetch_end_date,
+            status=RUN_STATUS_RUNNING,
+            total=0,
+        )
+        self.session.add(run)
+        self.session.flush()
+        self._add_fetch_tasks(run.run_id, ts_codes)
+        logger.info(f"创建抓取任务 {run.run_id}: {fetch_start_date} - {fetch_end_date}，共 {run.total} 只")
+        return run
+
+    def _add_fetch_tasks(self, run_id, ts_codes, chunk_size=500):
+        """把代码加入抓取任务（已存在的忽略），返回新增数量"""
+        now = datetime.now()
+        codes = list(dict.fromkeys(ts_codes))
+        added = 0
+        for i in range(0, len(codes), chunk_size):
+            rows = [
+                {'run_id': run_id, 'ts_code': code, 'status': TASK_STATUS_PENDING, 'attempts': 0, 'updated_at': now}
+                for code in codes[i:i + chunk_size]
+            ]
+            stmt = sqlite_insert(FetchTask).values(rows).on_conflict_do_nothing(
+                index_elements=['run_id', 'ts_code']
+            )
+            added += self.session.execute(stmt).rowcount
+        run = self.session.get(FetchRun, run_id)
+        run.total = (run.total or 0) + added
+        self.session.commit()
+        return added
+
+    def _get_fetch_task_codes(self, run_id, statuses):
+        """获取抓取任务中指定状态的代码"""
+        rows = self.session.query(FetchTask.ts_code).filter(
+            FetchTask.run_id == run_id,
+            FetchTask.status.in_(statuses)
+        ).all()
+        return [row[0] for row in rows]
+
+    def _mark_fetch_tasks(self, run_id, ts_codes, status, error=None):
+        """更新代码的抓取状态并累加尝试次数（不提交）"""
+        self.session.execute(
+            update(FetchTask).where(
+                FetchTask.run_id == run_id,
+                FetchTask.ts_code.in_(ts_codes)
+            ).values(
+                status=status,
+                attempts=FetchTask.attempts + 1,
+                last_error=error[:500] if error else None,
+                updated_at=datetime.now(),
+            )
+        )
 
-            logger.warning("未获取到任何日线数据")
-            return None
+    def _finish_fetch_run(self, run_id):
+        """根据明细状态更新抓取任务状态"""
+        remaining = self.session.query(FetchTask.status).filter(
+            FetchTask.run_id == run_id,
+            FetchTask.status != TASK_STATUS_DONE
+        ).all()
+        statuses = {row[0] for row in remaining}
+        if TASK_STATUS_PENDING in statuses:
+            status = RUN_STATUS_RUNNING
+        elif TASK_STATUS_FAILED in statuses:
+            status = RUN_STATUS_PARTIAL
+        else:
+            status = RUN_STATUS_DONE
+        run = self.session.get(FetchRun, run_id)
+        run.status = status
+        self.session.commit()
+        logger.info(f"抓取任务 {run_id} 状态: {status}（未完成 {len(remaining)} 只）")
+        return status
+
+    def prune_fetch_runs(self, keep_days=30):
+        """清理 keep_days 天前的抓取任务及明细"""
+        try:
+            cutoff = datetime.now() - timedelta(days=keep_days)
+            run_ids = [row[0] for row in self.session.query(FetchRun.run_id).filter(
+                FetchRun.created_at < cutoff
+            ).all()]
+            if run_ids:
+                self.session.query(FetchTask).filter(FetchTask.run_id.in_(run_ids)).delete(synchronize_session=False)
+                self.session.query(FetchRun).filter(FetchRun.run_id.in_(run_ids)).delete(synchronize_session=False)
+                self.session.commit()
+                logger.info(f"清理 {len(run_ids)} 个过期抓取任务")
+            return len(run_ids)
         except Exception as e:
-            logger.error(f"批量获取日线数据失败: {e}")
+            logger.error(f"清理抓取任务失败: {e}")
             self.session.rollback()
             raise
 
@@ -560,6 +788,7 @@ class DataManager:
         改用新浪 ak.stock_zh_index_daily（理由同 _fetch_one_stock_daily）。
         该接口不接受日期范围，会返回全量历史，这里在客户端按区间过滤。
         """
+        ak = get_provider()
         symbol = _ts_code_to_sina_symbol(ts_code)
         raw = ak.stock_zh_index_daily(symbol=symbol)
         if raw is None or raw.empty:
@@ -678,6 +907,7 @@ class DataManager:
             self.session.commit()
 
             if all_data:
+                mark_index_data_changed()
                 total_rows = sum(len(df) for df in all_data)
                 logger.info(f"批量获取完成，共获取 {total_rows} 条指数日线数据")
                 return pd.concat(all_data, ignore_index=True)
@@ -689,6 +919,41 @@ class DataManager:
             self.session.rollback()
             raise
 
+    def fetch_index_daily_bulk(self, ts_codes, start_date, end_date, max_workers=8):
+        """
+        并发获取多个指数的日线数据并用 upsert 写库（全量导入用，不缩窄日期区间）
+
+        返回:
+            写入行数
+        """
+        def _safe_fetch(code):
+            try:
+                return code, self._fetch_one_index_daily(code, start_date, end_date), None
+            except Exception as e:
+                return code, None, str(e)
+
+        try:
+            total_rows = 0
+            with ThreadPoolExecutor(max_workers=max_workers) as ex:
+                for code, df, err in ex.map(_safe_fetch, ts_codes):
+                    if err is not None:
+                        logger.error(f"获取指数 {code} 失败: {err}")
+                        continue
+                    if df is None or df.empty:
+                        logger.warning(f"指数 {code} 未获取到数据")
+                        continue
+                    _upsert_daily(self.session, IndexDailyData, df.to_dict(orient='records'))
+                    total_rows += len(df)
+                    logger.info(f"成功获取指数 {code} 的 {len(df)} 条数据")
+            self.session.commit()
+            if total_rows:
+                mark_index_data_changed()
+            return total_rows
+        except Exception as e:
+            logger.error(f"批量获取指数日线数据失败: {e}")
+            self.session.rollback()
+            raise
+
     def refresh_index_daily(self, ts_codes, days=40, exchange='SSE'):
         """刷新指数日线数据（最近 N 天）"""
         try:
@@ -755,43 +1020,3 @@ class DataManager:
         except Exception as e:
             logger.error(f"更新交易日历失败: {e}")
             raise
-
-
-def _normalize_sina_daily_df(raw: pd.DataFrame, ts_code: str) -> pd.DataFrame:
-    """
-    新浪 ak.stock_zh_a_daily / ak.stock_zh_index_daily 返回字段标准化。
-
-    新浪原始字段：date, open, high, low, close, volume(股), amount(元),
-                  outstanding_share, turnover  （指数没有 amount）
-    转换后字段对齐数据库 / 原 tushare：
-    - vol 单位手 = volume / 100（个股）；指数直接用 volume（原始单位）
-    - amount 单位千元 = amount / 1000（个股）；指数 amount 缺失 → 0
-    - pre_close / change / pct_chg 由相邻收盘价计算
-    """
-    df = raw.copy()
-    df['trade_date'] = df['date'].apply(_normalize_date)
-    df = df.sort_values('trade_date').reset_index(drop=True)
-    df['ts_code'] = ts_code
-
-    df['open'] = pd.to_numeric(df['open'], errors='coerce')
-    df['close'] = pd.to_numeric(df['close'], errors='coerce')
-    df['high'] = pd.to_numeric(df['high'], errors='coerce')
-    df['low'] = pd.to_numeric(df['low'], errors='coerce')
-
-    vol_raw = pd.to_numeric(df.get('volume'), errors='coerce')
-    if 'amount' in df.columns:
-        amount_raw = pd.to_numeric(df['amount'], errors='coerce')
-        df['vol'] = vol_raw / 100.0
-        df['amount'] = amount_raw / 1000.0
-    else:
-        df['vol'] = vol_raw
-        df['amount'] = 0.0
-
-    df['pre_close'] = df['close'].shift(1)
-    df['change'] = df['close'] - df['pre_close']
-    df['pct_chg'] = (df['change'] / df['pre_close']) * 100.0
-
-    return df[[
-        'ts_code', 'trade_date', 'open', 'high', 'low', 'close',
-        'pre_close', 'change', 'pct_chg', 'vol', 'amount',
-    ]]
@@ -0,0 +1,236 @@
+"""
+数据源适配模块
+DataManager 通过这里访问 AKShare，支持三种模式（环境变量 DATA_PROVIDER_MODE）：
+
+- live：直接调用 AKShare（默认）
+- record：调用 AKShare，同时把原始返回保存到本地内容寻址存储
+- replay：只从本地存储读取，不访问网络；可注入延迟、慢请求长尾和错误，
+  用于离线复现抓取、压测并发、重试和多数据源对冲逻辑（长尾和错误可只对部分函数注入，模拟单个数据源变慢）
+
+存储结构（DATA_PROVIDER_STORE，默认 data/provider_store）：
+    requests/<请求哈希>.json   请求（函数名 + 参数）到对象哈希的映射
+    objects/<前2位>/<对象哈希>  zlib 压缩的 DataFrame，按内容哈希去重
+"""
+import hashlib
+import json
+import os
+import pickle
+import random
+import threading
+import time
+import zlib
+from datetime import datetime
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from metrics import FETCH_SECONDS, FETCH_ERRORS
+
+MODE_LIVE = 'live'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+PROVIDER_MODES = (MODE_LIVE, MODE_RECORD, MODE_REPLAY)
+
+DEFAULT_STORE_DIR = os.path.join('data', 'provider_store')
+
+
+class ReplayMissError(LookupError):
+    """回放模式下本地存储中没有对应请求"""
+
+
+class InjectedProviderError(ConnectionError):
+    """回放模式注入的模拟网络错误"""
+
+
+def _request_key(func_name, kwargs):
+    """请求哈希：函数名 + 按键排序的参数"""
+    canonical = json.dumps({'func': func_name, 'kwargs': kwargs}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _atomic_write(path, data):
+    """先写临时文件再 rename，并发写同一路径时不会读到半个文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResponseStore:
+    """内容寻址的原始响应存储"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _request_path(self, key):
+        return os.path.join(self.root, 'requests', f"{key}.json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def put(self, func_name, kwargs, df):
+        """保存一次调用的返回，返回对象哈希"""
+        blob = zlib.compress(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+        digest = hashlib.sha256(blob).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            _atomic_write(object_path, blob)
+
+        meta = {
+            'func': func_name,
+            'kwargs': kwargs,
+            'object': digest,
+            'rows': 0 if df is None else len(df),
+            'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        _atomic_write(self._request_path(_request_key(func_name, kwargs)),
+                      json.dumps(meta, ensure_ascii=False, default=str).encode('utf-8'))
+        return digest
+
+    def get(self, func_name, kwargs):
+        """读取一次调用的返回，没有记录时抛出 ReplayMissError"""
+        request_path = self._request_path(_request_key(func_name, kwargs))
+        try:
+            with open(request_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(self._object_path(meta['object']), 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            raise ReplayMissError(f"本地存储中没有 {func_name}({kwargs}) 的记录") from None
+        return pickle.loads(zlib.decompress(blob))
+
+    def stats(self):
+        """统计请求数、对象数和对象总大小"""
+        requests_dir = os.path.join(self.root, 'requests')
+        objects_dir = os.path.join(self.root, 'objects')
+        requests = len(os.listdir(requests_dir)) if os.path.isdir(requests_dir) else 0
+        objects = 0
+        size = 0
+        for dirpath, _, filenames in os.walk(objects_dir):
+            for filename in filenames:
+                objects += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+        return {'requests': requests, 'objects': objects, 'bytes': size}
+
+
+class DataProvider:
+    """
+    AKShare 适配器
+
+    以属性方式调用与 AKShare 同名的函数（只接受关键字参数），例如
+    provider.stock_zh_a_daily(symbol='sz000001', start_date=..., end_date=..., adjust='')
+    """
+
+    def __init__(self, mode=MODE_LIVE, store_dir=DEFAULT_STORE_DIR,
+                 latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None,
+                 slow_rate=0.0, slow_ms=0.0, fault_funcs=None):
+        """
+        回放模式的故障注入参数:
+            latency_ms / jitter_ms: 每次调用的延迟（正态分布）
+            error_rate: 调用失败的概率
+            slow_rate / slow_ms: 额外延迟 slow_ms 的概率（模拟长尾）
+            fault_funcs: 只对这些函数名注入长尾和失败（延迟对所有函数生效），None 表示全部
+        """
+        if mode not in PROVIDER_MODES:
+            raise ValueError(f"不支持的数据源模式: {mode}，可选 {PROVIDER_MODES}")
+        self.mode = mode
+        self.store = ResponseStore(store_dir)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.fault_funcs = frozenset(fault_funcs) if fault_funcs else None
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def __getattr__(self, func_name):
+        if func_name.startswith('_'):
+            raise AttributeError(func_name)
+
+        def call(**kwargs):
+            return self.call(func_name, **kwargs)
+        call.__name__ = func_name
+        return call
+
+    def call(self, func_name, **kwargs):
+        """按当前模式执行一次数据源调用（耗时和失败次数按函数名记入指标）"""
+        started = time.perf_counter()
+        try:
+            return self._call(func_name, kwargs)
+        except Exception:
+            FETCH_ERRORS.inc(source=func_name)
+            raise
+        finally:
+            FETCH_SECONDS.observe(time.perf_counter() - started, source=func_name)
+
+    def _call(self, func_name, kwargs):
+        if self.mode == MODE_REPLAY:
+            self._inject_faults(func_name)
+            return self.store.get(func_name, kwargs)
+
+        import akshare as ak
+
+        df = getattr(ak, func_name)(**kwargs)
+        if self.mode == MODE_RECORD:
+            self.store.put(func_name, kwargs, df)
+        return df
+
+    def _inject_faults(self, func_name):
+        """回放时模拟网络延迟、长尾和偶发错误"""
+        faulty = self.fault_funcs is None or func_name in self.fault_funcs
+        with self._rng_lock:
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) if self.latency_ms else 0.0
+            if faulty and self.slow_rate > 0 and self._rng.random() < self.slow_rate:
+                delay += self.slow_ms
+            failed = faulty and self.error_rate > 0 and self._rng.random() < self.error_rate
+        if delay:
+            time.sleep(delay / 1000)
+        if failed:
+            raise InjectedProviderError(f"模拟 {func_name} 请求失败")
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def provider_from_env():
+    """根据环境变量创建数据源"""
+    seed = os.getenv('DATA_PROVIDER_SEED')
+    fault_funcs = os.getenv('DATA_PROVIDER_FAULT_FUNCS')
+    return DataProvider(
+        mode=os.getenv('DATA_PROVIDER_MODE', MODE_LIVE),
+        store_dir=os.getenv('DATA_PROVIDER_STORE', DEFAULT_STORE_DIR),
+        latency_ms=float(os.getenv('DATA_PROVIDER_LATENCY_MS', '0')),
+        jitter_ms=float(os.getenv('DATA_PROVIDER_JITTER_MS', '0')),
+        error_rate=float(os.getenv('DATA_PROVIDER_ERROR_RATE', '0')),
+        seed=int(seed) if seed else None,
+        slow_rate=float(os.getenv('DATA_PROVIDER_SLOW_RATE', '0')),
+        slow_ms=float(os.getenv('DATA_PROVIDER_SLOW_MS', '0')),
+        fault_funcs=[name.strip() for name in fault_funcs.split(',') if name.strip()] if fault_funcs else None,
+    )
+
+
+def get_provider():
+    """获取当前进程的数据源（首次调用时按环境变量创建）"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = provider_from_env()
+                if _provider.mode != MODE_LIVE:
+                    logger.info(f"数据源模式: {_provider.mode}，存储目录: {_provider.store.root}")
+    return _provider
+
+
+def set_provider(provider):
+    """替换当前进程的数据源（None 表示下次按环境变量重新创建）"""
+    global _provider
+    _provider = provider
+
+
+if __name__ == '__main__':
+    import sys
+
+    store_dir = sys.argv[1] if len(sys.argv) > 1 else os.getenv('DATA_PROVIDER_STORE', DEFAULT_STORE_DIR)
+    stats = ResponseStore(store_dir).stats()
+    print(f"{store_dir}: {stats['requests']} 个请求，{stats['objects']} 个对象，{stats['bytes'] / 1024 / 1024:.1f}MB")
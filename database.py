@@ -2,19 +2,36 @@
 数据库模型和初始化模块
 使用 SQLAlchemy ORM 定义数据库模型
 """
-from sqlalchemy import create_engine, Column, String, Float, Date, DateTime, Integer, UniqueConstraint
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine, func, Column, String, Float, Date, DateTime, Integer, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime
 import logger_config  # 必须在导入 logger 之前
 from loguru import logger
 
-# 数据库配置
-DATABASE_URL = "sqlite:///stock_data.db"
+# 数据库配置（可用环境变量 DATABASE_URL 覆盖，需在导入本模块前设置）
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///stock_data.db")
 engine = create_engine(DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# 只读快照目录（刷新进程发布，Web 进程读取），两者需要共享
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join("data", "snapshots"))
+# 快照指针文件，内容为当前快照的文件名和数据版本
+SNAPSHOT_POINTER = "CURRENT"
+# 保留的快照文件数（当前 + 上一份，正在读旧快照的连接不受删除影响）
+SNAPSHOT_KEEP = 2
+# 读取方检查快照指针的最小间隔（秒）
+SNAPSHOT_CHECK_INTERVAL = 2.0
+# 快照连接的 mmap 大小（字节）
+SNAPSHOT_MMAP_SIZE = int(os.getenv("SNAPSHOT_MMAP_SIZE", str(1024 * 1024 * 1024)))
+
 
 class StockBasic(Base):
     """股票基本信息表"""
@@ -62,6 +79,7 @@ class StockDailyData(Base):
 
     __table_args__ = (
         UniqueConstraint('ts_code', 'trade_date', name='uq_ts_code_trade_date'),
+        Index('ix_stock_daily_trade_date', 'trade_date'),
     )
 
 
@@ -86,6 +104,7 @@ class IndexDailyData(Base):
 
     __table_args__ = (
         UniqueConstraint('ts_code', 'trade_date', name='uq_index_ts_code_trade_date'),
+        Index('ix_index_daily_trade_date', 'trade_date'),
     )
 
 
@@ -106,6 +125,39 @@ class TradeCal(Base):
     )
 
 
+class FetchRun(Base):
+    """抓取任务表 - 每次批量抓取一条记录，用于断点续传"""
+    __tablename__ = "fetch_run"
+
+    run_id = Column(String(32), primary_key=True, comment="抓取任务ID")
+    kind = Column(String(20), comment="抓取类型 stock_daily")
+    start_date = Column(String(10), comment="请求的开始日期")
+    end_date = Column(String(10), comment="请求的结束日期")
+    fetch_start_date = Column(String(10), comment="实际抓取的开始日期")
+    fetch_end_date = Column(String(10), comment="实际抓取的结束日期")
+    status = Column(String(10), comment="状态 running进行中 partial有失败 done完成")
+    total = Column(Integer, default=0, comment="代码总数")
+    created_at = Column(DateTime, default=datetime.now, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="更新时间")
+
+
+class FetchTask(Base):
+    """抓取明细表 - 抓取任务中每个代码的状态"""
+    __tablename__ = "fetch_task"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String(32), index=True, comment="抓取任务ID")
+    ts_code = Column(String(10), comment="代码")
+    status = Column(String(10), comment="状态 pending待抓取 done完成 failed失败")
+    attempts = Column(Integer, default=0, comment="尝试次数")
+    last_error = Column(String(500), nullable=True, comment="最近一次错误")
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, comment="更新时间")
+
+    __table_args__ = (
+        UniqueConstraint('run_id', 'ts_code', name='uq_fetch_task_run_ts_code'),
+    )
+
+
 class QueryCache(Base):
     """查询缓存表 - 模拟 Redis 缓存"""
     __tablename__ = "query_cache"
@@ -127,6 +179,10 @@ def init_db():
     """初始化数据库，创建所有表"""
     try:
         Base.metadata.create_all(bind=engine)
+        # create_all 不会给已存在的表补建索引，这里逐个补上
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
         logger.info("数据库初始化成功")
     except Exception as e:
         logger.error(f"数据库初始化失败: {e}")
@@ -143,3 +199,242 @@ def close_session(session):
     if session:
         session.close()
 
+
+
+def get_data_watermarks(session):
+    """
+    数据水位：股票 / 指数日线的最新交易日和各交易所日历覆盖到的最后一天（都走索引，开销很小）
+
+    返回:
+        {'stock_daily_data': 'YYYYMMDD' 或 None, 'index_daily_data': ..., 'trade_cal': {交易所: 'YYYYMMDD'}}
+    """
+    return {
+        'stock_daily_data': session.query(func.max(StockDailyData.trade_date)).scalar(),
+        'index_daily_data': session.query(func.max(IndexDailyData.trade_date)).scalar(),
+        'trade_cal': dict(session.query(TradeCal.exchange, func.max(TradeCal.cal_date)).group_by(TradeCal.exchange).all()),
+    }
+
+
+def get_db_path():
+    """获取 SQLite 数据库文件的绝对路径"""
+    return os.path.abspath(engine.url.database)
+
+
+def backup_database(dest_path, src_path=None):
+    """
+    使用 SQLite 在线备份 API 复制数据库，得到一致性快照
+
+    参数:
+        dest_path: 快照文件路径（已存在会被覆盖）
+        src_path: 源数据库路径，默认为当前数据库
+    """
+    src = sqlite3.connect(src_path or get_db_path())
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def create_readonly_engine(db_path, immutable=False, mmap_size=0):
+    """
+    创建只读引擎
+
+    参数:
+        db_path: 数据库文件路径
+        immutable: 文件保证不会再被修改时为 True，SQLite 将跳过加锁和变更检测
+        mmap_size: 大于 0 时通过 mmap 读取数据库文件（字节数上限）
+    """
+    uri = f"file:{os.path.abspath(db_path)}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+
+    def _connect():
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        if mmap_size:
+            conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        return conn
+
+    return create_engine("sqlite://", creator=_connect)
+
+
+def write_json_atomic(path, data):
+    """先写临时文件并 fsync，再 rename 到 path"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_pointer(snapshot_dir=None):
+    """
+    读取当前快照指针
+
+    返回:
+        {'file', 'generation', 'published_at'}，尚未发布快照时返回 None
+    """
+    try:
+        with open(os.path.join(snapshot_dir or SNAPSHOT_DIR, SNAPSHOT_POINTER), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish_snapshot(generation=None, snapshot_dir=None):
+    """
+    发布只读快照（刷新进程在数据和榜单写完后调用）
+
+    先用在线备份 API 复制到临时文件，整理为不带 WAL 的普通数据库后 rename 为正式文件，
+    最后原子替换指针文件。读取方只会看到完整的快照，切换前一直读上一份快照。
+
+    参数:
+        generation: 快照对应的数据版本号，仅作记录
+        snapshot_dir: 快照目录，默认 SNAPSHOT_DIR
+
+    返回:
+        快照文件路径
+    """
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    os.makedirs(snapshot_dir, exist_ok=True)
+    name = f"stock_data.{datetime.now().strftime('%Y%m%d%H%M%S%f')}.db"
+    path = os.path.join(snapshot_dir, name)
+    tmp_path = path + ".tmp"
+
+    backup_database(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # immutable=1 打开时不会读取 WAL 文件，快照必须是普通的回滚日志模式
+        conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+    write_json_atomic(os.path.join(snapshot_dir, SNAPSHOT_POINTER), {
+        'file': name,
+        'generation': generation,
+        'published_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    logger.info(f"只读快照已发布: {path}，generation={generation}")
+
+    # 清理旧快照（已打开旧快照的连接在 POSIX 下不受影响）
+    snapshots = sorted(f for f in os.listdir(snapshot_dir) if f.startswith('stock_data.') and f.endswith('.db'))
+    for old in snapshots[:-SNAPSHOT_KEEP]:
+        try:
+            os.remove(os.path.join(snapshot_dir, old))
+        except OSError as e:
+            logger.warning(f"删除旧快照失败 {old}: {e}")
+    return path
+
+
+class SnapshotReader:
+    """
+    只读快照读取器（Web 进程内单例 SNAPSHOT_READER）
+
+    最多每 SNAPSHOT_CHECK_INTERVAL 秒检查一次指针文件，快照切换时新建引擎，
+    之后打开的会话读新快照，正在进行的查询继续读旧快照。没有快照时退回主库。
+    """
+
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir
+        self._lock = threading.Lock()
+        self._checked = float('-inf')
+        self._pointer = None
+        self._engine = None
+        # (会话工厂, 快照文件路径)，一起替换，避免读到不匹配的组合
+        self._current = (None, None)
+
+    def _refresh(self):
+        pointer = read_snapshot_pointer(self.snapshot_dir)
+        if pointer == self._pointer:
+            return
+        path = os.path.join(self.snapshot_dir or SNAPSHOT_DIR, pointer['file']) if pointer else None
+        if path and not os.path.exists(path):
+            logger.warning(f"快照文件不存在: {path}")
+            return
+        old_engine = self._engine
+        if path:
+            self._engine = create_readonly_engine(path, immutable=True, mmap_size=SNAPSHOT_MMAP_SIZE)
+            self._current = (sessionmaker(autocommit=False, autoflush=False, bind=self._engine), path)
+            logger.info(f"切换到只读快照: {path}，generation={pointer.get('generation')}")
+        else:
+            self._engine = None
+            self._current = (None, None)
+        self._pointer = pointer
+        if old_engine is not None:
+            # 关闭连接池中空闲的连接，已借出的连接归还时关闭
+            old_engine.dispose()
+
+    def current(self):
+        """当前使用的快照指针，没有快照时返回 None"""
+        with self._lock:
+            if time.monotonic() - self._checked >= SNAPSHOT_CHECK_INTERVAL:
+                self._checked = time.monotonic()
+                self._refresh()
+            return self._pointer if self._current[0] else None
+
+    def session(self):
+        """打开只读会话（会话 info['readonly'] 为 True，info['db_path'] 为快照文件），没有快照时返回主库会话"""
+        self.current()
+        factory, path = self._current
+        if factory is None:
+            return SessionLocal()
+        session = factory()
+        session.info['readonly'] = True
+        session.info['db_path'] = path
+        return session
+
+
+SNAPSHOT_READER = SnapshotReader()
+
+
+def get_read_session():
+    """获取只读查询会话：有已发布的快照时读快照，否则读主库"""
+    return SNAPSHOT_READER.session()
+
+
+@contextmanager
+def bulk_load_session(tables, bind=None):
+    """
+    批量导入模式的数据库会话（用于冷启动全量导入）
+
+    在一条专用连接上：
+    - 放宽日志和同步（journal_mode=MEMORY, synchronous=OFF），加大页缓存
+    - 导入期间删除 tables 上的二级索引，结束后重建（唯一约束保留，upsert 依赖它）
+    - 结束后执行 ANALYZE，并恢复原来的日志和同步设置
+
+    导入中途进程崩溃可能导致数据库损坏，只应在没有其他进程写库时使用。
+
+    参数:
+        tables: 需要导入的表（SQLAlchemy Table 对象）
+        bind: 目标引擎，默认为当前数据库
+    """
+    indexes = [index for table in tables for index in table.indexes]
+    with (bind or engine).connect() as conn:
+        journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+        conn.exec_driver_sql("PRAGMA journal_mode=MEMORY")
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        conn.exec_driver_sql("PRAGMA cache_size=-262144")
+        conn.exec_driver_sql("PRAGMA temp_store=MEMORY")
+        for index in indexes:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+        conn.commit()
+        logger.info(f"进入批量导入模式，临时删除索引: {[index.name for index in indexes]}")
+
+        session = Session(bind=conn)
+        try:
+            yield session
+        finally:
+            session.close()
+            conn.rollback()
+            logger.info("重建索引并更新统计信息...")
+            for index in indexes:
+                index.create(bind=conn, checkfirst=True)
+            conn.exec_driver_sql("ANALYZE")
+            conn.commit()
+            conn.exec_driver_sql(f"PRAGMA journal_mode={journal_mode}")
+            conn.exec_driver_sql(f"PRAGMA synchronous={synchronous}")
+            logger.info("已退出批量导入模式")
@@ -33,6 +33,10 @@ Write-Host "Starting Flask backend..."
 Write-Host "Address: http://127.0.0.1:5000"
 Start-Process python -ArgumentList "app.py" -WindowStyle Normal
 
+# Start refresh worker
+Write-Host "Starting data refresh worker..."
+Start-Process python -ArgumentList "-m refresh_worker" -WindowStyle Normal
+
 # Wait for backend to start
 Start-Sleep -Seconds 3
 
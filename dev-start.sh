@@ -29,6 +29,11 @@ echo "   地址: http://127.0.0.1:5000"
 python app.py &
 BACKEND_PID=$!
 
+# 启动数据刷新进程
+echo "🚀 启动数据刷新进程..."
+python -m refresh_worker &
+REFRESH_PID=$!
+
 # 等待后端启动
 sleep 3
 
@@ -45,6 +50,7 @@ echo "✅ 开发服务已启动"
 echo "=========================================="
 echo ""
 echo "后端进程 ID: $BACKEND_PID"
+echo "刷新进程 ID: $REFRESH_PID"
 echo "前端进程 ID: $FRONTEND_PID"
 echo ""
 echo "访问地址: http://127.0.0.1:3000"
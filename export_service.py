@@ -0,0 +1,184 @@
+"""
+数据导出服务
+以 CSV 或 NDJSON 流式导出全市场榜单和日线（热表 + 冷数据归档），供 /api/export/* 接口使用。
+
+导出结果以生成器逐批产出：日线通过 archive.iter_daily_bars 按日期分批读取（热表走 yield_per
+服务端游标，冷数据逐个月份分区读取），每 EXPORT_BATCH_ROWS 行编码一次并交给 Flask 发送，
+进程内存占用与导出的行数无关。
+"""
+import csv
+import io
+import json
+import time
+from sqlalchemy import select
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from archive import ARCHIVE_COLUMNS, iter_daily_bars
+from database import close_session, get_read_session, StockBasic
+from metrics import EXPORT_ROWS
+
+# 每批编码并发送的行数
+EXPORT_BATCH_ROWS = 5000
+# 支持的导出格式
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+MIMETYPES = {
+    FORMAT_CSV: 'text/csv; charset=utf-8',
+    FORMAT_NDJSON: 'application/x-ndjson; charset=utf-8',
+}
+# 导出类型（指标标签）
+KIND_BOARD = 'board'
+KIND_DAILY = 'daily'
+
+
+def _csv_value(value):
+    # 嵌套结构（列表 / 字典）在 CSV 中以 JSON 文本表示
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class _Encoder:
+    """把行（元组）编码为 CSV 或 NDJSON 文本，按批输出"""
+
+    def __init__(self, fmt, columns):
+        self.fmt = fmt
+        self.columns = list(columns)
+
+    def header(self):
+        if self.fmt != FORMAT_CSV:
+            return ''
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerow(self.columns)
+        return buffer.getvalue()
+
+    def encode(self, rows):
+        if self.fmt == FORMAT_CSV:
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator='\n').writerows(
+                [_csv_value(value) for value in row] for row in rows
+            )
+            return buffer.getvalue()
+        columns = self.columns
+        return ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+def _stream(kind, fmt, columns, rows, batch_rows=EXPORT_BATCH_ROWS):
+    """把行迭代器编码为文本块的生成器（先输出 CSV 表头，之后每 batch_rows 行一块）"""
+    encoder = _Encoder(fmt, columns)
+    started = time.perf_counter()
+    header = encoder.header()
+    if header:
+        yield header
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield encoder.encode(batch)
+            total += len(batch)
+            EXPORT_ROWS.inc(len(batch), kind=kind, format=fmt)
+            batch = []
+    if batch:
+        yield encoder.encode(batch)
+        total += len(batch)
+        EXPORT_ROWS.inc(len(batch), kind=kind, format=fmt)
+    logger.info(f"导出 {kind} ({fmt}) 完成: {total} 行，耗时 {time.perf_counter() - started:.2f}s")
+
+
+def check_format(fmt):
+    """校验导出格式，返回规范化后的格式名"""
+    fmt = (fmt or FORMAT_CSV).strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format 仅支持 {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+def resolve_ts_codes(session, ts_codes=None, markets=None):
+    """
+    按代码和市场确定导出的股票范围
+
+    返回:
+        代码列表（已排序）；两者都未指定时返回 None，表示全部股票
+    """
+    if not markets:
+        return sorted(set(ts_codes)) if ts_codes else None
+    query = select(StockBasic.ts_code).where(StockBasic.market.in_(markets))
+    codes = set(session.execute(query).scalars())
+    if ts_codes:
+        codes &= set(ts_codes)
+    return sorted(codes)
+
+
+def export_daily(ts_codes=None, start_date=None, end_date=None, markets=None, fmt=FORMAT_CSV,
+                 columns=ARCHIVE_COLUMNS, archive_dir=None):
+    """
+    流式导出日线
+
+    参数:
+        ts_codes: 股票代码列表，None 表示不按代码过滤
+        start_date / end_date: 日期区间（含两端，YYYYMMDD），None 表示不限
+        markets: 市场列表（stock_basic.market），None 表示不按市场过滤
+        fmt: 'csv' 或 'ndjson'
+        columns: 导出的列（ARCHIVE_COLUMNS 的子集，总会包含 ts_code 和 trade_date）
+        archive_dir: 冷数据归档目录，默认 ARCHIVE_DIR
+
+    返回:
+        文本块生成器，按 trade_date、ts_code 排序；会话由生成器持有，迭代结束或关闭时释放
+    """
+    fmt = check_format(fmt)
+    columns = list(dict.fromkeys(('ts_code', 'trade_date') + tuple(columns)))
+
+    def _generate():
+        session = get_read_session()
+        try:
+            codes = resolve_ts_codes(session, ts_codes, markets)
+            if codes is not None and not codes:
+                rows = iter(())
+            else:
+                rows = iter_daily_bars(session, codes, start_date, end_date, columns,
+                                       archive_dir=archive_dir, batch_rows=EXPORT_BATCH_ROWS)
+            yield from _stream(KIND_DAILY, fmt, columns, rows)
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            logger.error(f"导出日线失败: {e}")
+            raise
+        finally:
+            close_session(session)
+
+    return _generate()
+
+
+def export_board(universe, markets=None, ts_codes=None, fmt=FORMAT_CSV):
+    """
+    流式导出全市场 n 日榜（get_board_universe 的结果，不截断）
+
+    参数:
+        universe: 全市场榜单行（dict 列表）
+        markets: 保留的市场列表，None 表示全部
+        ts_codes: 保留的股票代码，None 表示全部
+        fmt: 'csv' 或 'ndjson'
+
+    返回:
+        文本块生成器，按偏离值从高到低排序（与 /api/stocks/board 一致）
+    """
+    fmt = check_format(fmt)
+    markets = set(markets) if markets else None
+    ts_codes = set(ts_codes) if ts_codes else None
+    rows = [row for row in universe
+            if (markets is None or row['market'] in markets) and (ts_codes is None or row['ts_code'] in ts_codes)]
+    rows.sort(key=lambda x: x['deviation'] if x['deviation'] is not None else float('-inf'), reverse=True)
+    columns = list(universe[0]) if universe else []
+
+    def _generate():
+        try:
+            yield from _stream(KIND_BOARD, fmt, columns, ([row.get(c) for c in columns] for row in rows))
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            logger.error(f"导出榜单失败: {e}")
+            raise
+
+    return _generate()
@@ -0,0 +1,165 @@
+"""
+指数涨幅服务
+库中只有 INDEX_CODES 中的几个指数：每个指数的开盘 / 最高 / 最低 / 收盘 / 昨收按交易日序号
+（交易日历开市日与指数日线日期的并集，升序）排成稠密数组，没有数据的日期为 None。
+任意 [start, end] 的指数涨幅就是 close[end] / pre_close[start] - 1，两次数组下标读取，不再逐只股票查库。
+
+偏离值排行（逐只计算）、股票详情的价格窗口和 T+n 推演共用同一份数据；
+回测可直接调用 get_index_returns(session).change_pct(...)。
+
+缓存按数据库文件区分：只读快照不会变化；主库上再比较 index_daily_data 的行数和最新日期，
+并在 fetch_index_daily_batch / fetch_index_daily_bulk 写入新数据后（mark_index_data_changed）失效，
+其余时间不重新加载。
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from sqlalchemy import text
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from database import get_db_path
+
+# 稠密数组中的价格字段
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'pre_close')
+# 构成交易日序号的交易所日历
+CALENDAR_EXCHANGE = 'SSE'
+# 每个进程缓存的版本数（当前快照和上一份快照）
+MAX_CACHED = 2
+
+
+class IndexReturns:
+    """某一时刻全部指数的稠密价格数组（只读，可在多个线程中共享）"""
+
+    def __init__(self, calendar, prices):
+        """
+        参数:
+            calendar: 升序日期列表（交易日序号 -> 日期）
+            prices: {指数代码: {字段: 与 calendar 等长的价格列表}}
+        """
+        self.calendar = calendar
+        self.ordinals = {date: i for i, date in enumerate(calendar)}
+        self.prices = prices
+
+    @property
+    def index_codes(self):
+        return sorted(self.prices)
+
+    def ordinal(self, date):
+        """日期对应的交易日序号，不在日历中时返回 None"""
+        return self.ordinals.get(date)
+
+    def price(self, index_code, date, field='close'):
+        """指数在某日的价格（字段见 PRICE_FIELDS），没有数据时返回 None"""
+        series = self.prices.get(index_code)
+        i = self.ordinals.get(date)
+        if series is None or i is None:
+            return None
+        return series[field][i]
+
+    def change_pct(self, index_code, start_date, end_date, start_field='pre_close', end_field='close'):
+        """
+        指数从 start_date 到 end_date 的涨幅（%，未舍入）
+
+        默认以开始日的昨收为基准、结束日的收盘价为终点（与榜单一致）；任一端没有数据或为 0 时返回 None
+        """
+        start = self.price(index_code, start_date, start_field)
+        end = self.price(index_code, end_date, end_field)
+        if not start or not end:
+            return None
+        return (end / start - 1) * 100
+
+    def window(self, index_code, start_date, end_date):
+        """
+        指数在 [start_date, end_date] 内有数据的每日价格
+
+        返回:
+            [{'trade_date', 'open', 'high', 'low', 'close', 'pre_close'}, ...]，按日期升序
+        """
+        series = self.prices.get(index_code)
+        if series is None:
+            return []
+        lo = bisect_left(self.calendar, start_date)
+        hi = bisect_right(self.calendar, end_date)
+        rows = []
+        for i in range(lo, hi):
+            if series['close'][i] is None:
+                continue
+            row = {'trade_date': self.calendar[i]}
+            row.update((field, series[field][i]) for field in PRICE_FIELDS)
+            rows.append(row)
+        return rows
+
+
+def load_index_returns(session):
+    """从数据库加载全部指数日线，构建 IndexReturns"""
+    started = time.perf_counter()
+    rows = session.execute(text(
+        "SELECT ts_code, trade_date, open, high, low, close, pre_close FROM index_daily_data"
+    )).all()
+    calendar = {row[0] for row in session.execute(text(
+        "SELECT cal_date FROM trade_cal WHERE exchange = :exchange AND is_open = '1'"
+    ), {'exchange': CALENDAR_EXCHANGE})}
+    calendar.update(row[1] for row in rows)
+    calendar = sorted(calendar)
+    ordinals = {date: i for i, date in enumerate(calendar)}
+
+    prices = {}
+    for ts_code, trade_date, *values in rows:
+        series = prices.get(ts_code)
+        if series is None:
+            series = prices[ts_code] = {field: [None] * len(calendar) for field in PRICE_FIELDS}
+        i = ordinals[trade_date]
+        for field, value in zip(PRICE_FIELDS, values):
+            series[field][i] = float(value) if value is not None else None
+
+    logger.debug(f"指数涨幅表已加载: {len(prices)} 个指数 × {len(calendar)} 个交易日，"
+                 f"耗时 {(time.perf_counter() - started) * 1000:.1f}ms")
+    return IndexReturns(calendar, prices)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# 本进程写入指数日线的次数（mark_index_data_changed 递增）
+_data_version = 0
+
+
+def mark_index_data_changed():
+    """本进程写入了新的指数日线，之后的 get_index_returns 重新加载"""
+    global _data_version
+    with _cache_lock:
+        _data_version += 1
+
+
+def _cache_key(session):
+    db_path = session.info.get('db_path') or get_db_path()
+    if session.info.get('readonly'):
+        return db_path, None
+    # 主库可能被其他进程写入，用行数和最新日期判断是否变化
+    count, latest = session.execute(text("SELECT COUNT(*), MAX(trade_date) FROM index_daily_data")).one()
+    return db_path, (_data_version, count, latest)
+
+
+def get_index_returns(session):
+    """
+    获取 session 所读数据库对应的指数涨幅表（进程内缓存，数据不变时不重新加载）
+
+    返回:
+        IndexReturns
+    """
+    key = _cache_key(session)
+    with _cache_lock:
+        returns = _cache.get(key)
+        if returns is not None:
+            _cache.move_to_end(key)
+            return returns
+
+    returns = load_index_returns(session)
+    with _cache_lock:
+        _cache[key] = returns
+        # 同一数据库文件只保留最新版本
+        for old_key in [k for k in _cache if k[0] == key[0] and k != key]:
+            del _cache[old_key]
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+    return returns
@@ -2,19 +2,78 @@
 """
 项目初始化脚本
 用于初始化数据库和获取基础数据
+
+用法:
+    python init.py                          # 基础数据 + 最近 40 个交易日
+    python init.py --bootstrap --years 3    # 冷启动：批量导入模式下全量导入 N 年历史
 """
+import argparse
 import sys
+import time
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+
+# 必须在导入其他模块之前加载环境变量（DATABASE_URL 等）
+load_dotenv()
+
 import logger_config  # noqa: F401  初始化日志配置
-from database import init_db
+from database import init_db, bulk_load_session, StockDailyData, IndexDailyData
 from data_manager import DataManager
+from trade_calendar import TradeCalendarManager
+from monitor import INDEX_CODES
 
-# 加载环境变量
-load_dotenv()
+
+# 全量导入时每累计多少行提交一次事务
+BOOTSTRAP_BATCH_ROWS = 50000
+
+
+def bootstrap(years, max_workers):
+    """
+    冷启动全量导入：所有股票和 INDEX_CODES 最近 years 年的日线
+
+    在批量导入模式下写库（见 database.bulk_load_session），
+    股票部分沿用抓取任务断点续传，中断后重新运行会跳过已完成的股票。
+    """
+    tcm = TradeCalendarManager()
+    end_date = tcm.get_prev_trading_day(datetime.now().strftime('%Y%m%d'), 'SSE')
+    start_date = tcm.get_next_trading_day(
+        (datetime.strptime(end_date, '%Y%m%d') - timedelta(days=365 * years)).strftime('%Y%m%d'), 'SSE'
+    )
+    print(f"\n🚀 全量导入 {start_date} - {end_date} 的日线数据（{max_workers} 线程）...")
+
+    ts_codes = [stock.ts_code for stock in DataManager().get_stock_list()]
+    with bulk_load_session([StockDailyData.__table__, IndexDailyData.__table__]) as session:
+        dm = DataManager(session=session)
+
+        started = time.perf_counter()
+        stock_rows = dm.fetch_stock_daily_batch(
+            ts_codes, start_date=start_date, end_date=end_date,
+            max_workers=max_workers, batch_rows=BOOTSTRAP_BATCH_ROWS, return_data=False
+        )
+        failed = dm.retry_failed_stock_daily()
+        elapsed = time.perf_counter() - started
+        print(f"✅ 股票日线 {stock_rows} 条，用时 {elapsed:.1f}s（{stock_rows / max(elapsed, 1e-6):.0f} 行/秒）")
+        if failed:
+            print(f"⚠️  {failed} 只股票获取失败，重新运行可继续（任务 {dm.last_fetch_run_id}）")
+
+        started = time.perf_counter()
+        index_rows = dm.fetch_index_daily_bulk(INDEX_CODES, start_date, end_date)
+        elapsed = time.perf_counter() - started
+        print(f"✅ 指数日线 {index_rows} 条，用时 {elapsed:.1f}s（{index_rows / max(elapsed, 1e-6):.0f} 行/秒）")
+
+        started = time.perf_counter()
+    print(f"✅ 重建索引和 ANALYZE 用时 {time.perf_counter() - started:.1f}s")
+    return True
 
 
-def main():
+def main(argv=None):
     """主函数"""
+    parser = argparse.ArgumentParser(description="股票异动监控系统 - 项目初始化")
+    parser.add_argument('--bootstrap', action='store_true', help="冷启动：全量导入所有股票和指数的历史日线")
+    parser.add_argument('--years', type=int, default=3, help="--bootstrap 导入的年数，默认 3")
+    parser.add_argument('--workers', type=int, default=30, help="--bootstrap 并发抓取线程数，默认 30")
+    args = parser.parse_args(argv)
+
     print("=" * 50)
     print("股票异动监控系统 - 项目初始化")
     print("=" * 50)
@@ -54,6 +113,35 @@ def main():
     except Exception as e:
         print(f"⚠️  获取交易日历失败: {e}")
 
+    if args.bootstrap:
+        try:
+            if not bootstrap(args.years, args.workers):
+                return False
+        except Exception as e:
+            print(f"❌ 全量导入失败: {e}（重新运行可从断点继续）")
+            return False
+        return _print_done()
+
+    # 获取股票日线数据（可断点续传：中断后重新运行 init.py 只抓取未完成的股票）
+    print("\n📥 获取最近 40 个交易日的股票日线数据...")
+    try:
+        dm = DataManager()
+        tcm = TradeCalendarManager()
+        end_date = tcm.get_prev_trading_day(datetime.now().strftime('%Y%m%d'), 'SSE')
+        trading_days = tcm.get_last_n_trading_days(40, end_date, 'SSE')
+        if trading_days:
+            ts_codes = [stock.ts_code for stock in dm.get_stock_list()]
+            dm.fetch_stock_daily_batch(ts_codes, start_date=trading_days[0], end_date=trading_days[-1])
+            failed = dm.retry_failed_stock_daily()
+            if failed:
+                print(f"⚠️  {failed} 只股票获取失败，重新运行 init.py 可继续（任务 {dm.last_fetch_run_id}）")
+            else:
+                print("✅ 成功获取股票日线数据")
+        else:
+            print("⚠️  未获取到交易日数据，跳过股票日线")
+    except Exception as e:
+        print(f"⚠️  获取股票日线数据失败: {e}（重新运行 init.py 可从断点继续）")
+
     # 获取指数数据
     print("\n📥 获取指数数据...")
     try:
@@ -63,7 +151,12 @@ def main():
         print("✅ 成功获取上证指数数据")
     except Exception as e:
         print(f"⚠️  获取指数数据失败: {e}")
-    
+
+    return _print_done()
+
+
+def _print_done():
+    """打印初始化完成提示"""
     print("\n" + "=" * 50)
     print("✅ 初始化完成！")
     print("=" * 50)
@@ -0,0 +1,338 @@
+"""
+指标模块
+进程内的 Counter / Gauge / Histogram 注册表，输出 Prometheus 文本格式。
+
+多进程聚合：每个进程（Gunicorn worker、刷新进程）定期把自己的指标快照写到
+METRICS_DIR/<主机名>-<pid>.json（最多每 FLUSH_INTERVAL 秒一次，退出时再写一次），
+/metrics 读取目录下所有快照合并：Counter / Histogram 求和，Gauge 取最近一次更新的值。
+METRICS_DIR 需要在 Web 和刷新进程之间共享（docker-compose 中为 ./data 卷）。
+
+热路径上的开销只有一次加锁的字典更新和一次时间比较。
+"""
+import atexit
+import bisect
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from config import RUNTIME_DIR
+
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(RUNTIME_DIR, 'metrics'))
+# 快照写盘的最小间隔（秒）
+FLUSH_INTERVAL = 2.0
+# 超过该天数未更新的快照视为已退出进程的残留，聚合时删除
+STALE_SNAPSHOT_DAYS = 7
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"标签不匹配: 需要 {labelnames}，实际 {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {
+            'type': self.metric_type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'samples': samples,
+        }
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+
+class Gauge(_Metric):
+    """瞬时值；多进程合并时取最近一次更新的值"""
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = [value, time.time()]
+        self.registry.maybe_flush()
+
+
+class Histogram(_Metric):
+    """直方图（累计桶 + sum + count）"""
+    metric_type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各桶计数..., +Inf 桶计数, sum]
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+        self.registry.maybe_flush()
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文，退出时记录耗时（秒），异常时也会记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+class Registry:
+    """指标注册表，负责本进程快照写盘和跨进程聚合"""
+
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._pid = None
+        self._path = None
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def _snapshot_path(self):
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._path = os.path.join(self.metrics_dir, f"{socket.gethostname()}-{pid}.json")
+        return self._path
+
+    def _reset_after_fork(self):
+        """fork 出的子进程继承了父进程的值，清空后写自己的快照文件，避免重复计数"""
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+            metric._values.clear()
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def maybe_flush(self):
+        """距上次写盘超过 FLUSH_INTERVAL 时写快照"""
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """把本进程的指标快照写入 METRICS_DIR"""
+        self._last_flush = time.monotonic()
+        path = self._snapshot_path()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        data = {'updated_at': time.time(), 'metrics': {metric.name: metric.snapshot() for metric in metrics}}
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            # 指标写盘失败不能影响业务
+            pass
+
+    def collect(self):
+        """读取所有进程的快照并合并，返回 {name: snapshot}"""
+        self.flush()
+        merged = {}
+        stale_before = time.time() - STALE_SNAPSHOT_DAYS * 86400
+        try:
+            filenames = [f for f in os.listdir(self.metrics_dir) if f.endswith('.json')]
+        except FileNotFoundError:
+            filenames = []
+
+        for filename in filenames:
+            path = os.path.join(self.metrics_dir, filename)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if data.get('updated_at', 0) < stale_before:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            for name, metric in data['metrics'].items():
+                _merge_metric(merged, name, metric)
+        return merged
+
+    def render(self):
+        """输出所有进程合并后的 Prometheus 文本格式"""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labelnames = metric['labelnames']
+            for key, value in sorted(metric['samples'].items()):
+                if metric['type'] == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else _format_value(bound)
+                        lines.append(f"{name}_bucket{_format_labels(labelnames, key, le=le)} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(value[-1])}")
+                    lines.append(f"{name}_count{_format_labels(labelnames, key)} {cumulative}")
+                elif metric['type'] == 'gauge':
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value[0])}")
+                else:
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _merge_metric(merged, name, metric):
+    target = merged.get(name)
+    if target is None:
+        target = merged[name] = {
+            'type': metric['type'],
+            'help': metric['help'],
+            'labelnames': metric['labelnames'],
+            'buckets': metric.get('buckets'),
+            'samples': {},
+        }
+    samples = target['samples']
+    for key, value in metric['samples']:
+        key = tuple(key)
+        current = samples.get(key)
+        if current is None:
+            samples[key] = list(value) if isinstance(value, list) else value
+        elif metric['type'] == 'gauge':
+            if value[1] > current[1]:
+                samples[key] = list(value)
+        elif metric['type'] == 'histogram':
+            samples[key] = [a + b for a, b in zip(current, value)]
+        else:
+            samples[key] = current + value
+
+
+def _format_labels(labelnames, key, **extra):
+    pairs = list(zip(labelnames, key)) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+atexit.register(REGISTRY.flush)
+os.register_at_fork(after_in_child=REGISTRY._reset_after_fork)
+
+# ---------- 指标定义 ----------
+
+REFRESH_STAGE_SECONDS = REGISTRY.histogram(
+    'pyst_refresh_stage_duration_seconds', "refresh_data 各阶段耗时", ('stage',))
+REFRESH_RUNS = REGISTRY.counter(
+    'pyst_refresh_runs_total', "refresh_data 执行次数", ('result',))
+REFRESH_LAST_SUCCESS = REGISTRY.gauge(
+    'pyst_refresh_last_success_timestamp_seconds', "最近一次刷新成功的时间")
+
+FETCH_SECONDS = REGISTRY.histogram(
+    'pyst_fetch_duration_seconds', "数据源单次请求耗时", ('source',),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+FETCH_ERRORS = REGISTRY.counter(
+    'pyst_fetch_errors_total', "数据源请求失败次数", ('source',))
+FETCH_BACKUP_REQUESTS = REGISTRY.counter(
+    'pyst_fetch_backup_requests_total', "日线备用数据源请求次数（hedge：主源超过 P90 未返回；failover：主源失败）",
+    ('source', 'reason'))
+FETCH_WINS = REGISTRY.counter(
+    'pyst_fetch_wins_total', "日线请求最终采用的数据源", ('source',))
+
+UPSERT_ROWS = REGISTRY.counter(
+    'pyst_upsert_rows_total', "upsert 写入行数", ('table',))
+UPSERT_SECONDS = REGISTRY.histogram(
+    'pyst_upsert_duration_seconds', "单批 upsert 耗时", ('table',))
+UPSERT_ROWS_PER_SECOND = REGISTRY.gauge(
+    'pyst_upsert_rows_per_second', "最近一批 upsert 的写入速度", ('table',))
+
+CACHE_REQUESTS = REGISTRY.counter(
+    'pyst_cache_requests_total', "CacheManager 读取次数", ('key', 'result'))
+CACHE_SETS = REGISTRY.counter(
+    'pyst_cache_sets_total', "CacheManager 写入次数", ('key',))
+
+BOARD_COMPUTE_SECONDS = REGISTRY.histogram(
+    'pyst_board_compute_duration_seconds', "榜单计算耗时", ('n',))
+BOARD_ROWS = REGISTRY.gauge(
+    'pyst_board_rows', "最近一次计算的榜单行数", ('n', 'kind'))
+DATA_WATERMARK = REGISTRY.gauge(
+    'pyst_data_watermark_trade_date', "库中最新交易日（YYYYMMDD）", ('table',))
+
+DB_QUERIES = REGISTRY.counter(
+    'pyst_db_queries_total', "各操作执行的 SQL 语句数", ('operation',))
+DB_QUERY_SECONDS = REGISTRY.counter(
+    'pyst_db_query_seconds_total', "各操作执行 SQL 的累计耗时", ('operation',))
+
+ANALYTICS_QUERY_SECONDS = REGISTRY.histogram(
+    'pyst_analytics_query_duration_seconds', "分析查询耗时（按后端）", ('backend', 'query'))
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'pyst_http_requests_total', "HTTP 请求数", ('endpoint', 'status'))
+HTTP_SECONDS = REGISTRY.histogram(
+    'pyst_http_request_duration_seconds', "HTTP 请求耗时", ('endpoint',))
+EXPORT_ROWS = REGISTRY.counter(
+    'pyst_export_rows_total', "导出接口输出的行数", ('kind', 'format'))
+
+PUSH_CLIENTS = REGISTRY.gauge(
+    'pyst_push_clients', "推送服务当前的 SSE 连接数")
+PUSH_EVENTS = REGISTRY.counter(
+    'pyst_push_events_total', "推送服务发布的事件数", ('event',))
+
+
+def cache_key_label(cache_key):
+    """缓存键归一为有限的标签值（去掉 ':' 之后的参数部分和 '@' 之后的版本号），避免标签基数失控"""
+    return cache_key.split(':', 1)[0].split('@', 1)[0]
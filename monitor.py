@@ -2,10 +2,14 @@
 股票异动监控模块
 计算股票异动指标和监控规则
 """
+import os
 from datetime import datetime, timedelta
 import logger_config  # 必须在导入 logger 之前
 from loguru import logger
-from database import get_session, close_session, StockDailyData, IndexDailyData, TradeCal, StockBasic
+from database import get_session, close_session, StockDailyData, TradeCal, StockBasic
+from analytics import fetch_rows
+from archive import get_daily_bars
+from index_returns import get_index_returns
 
 # 全局常量定义
 INDEX_CODES = [
@@ -16,12 +20,236 @@ INDEX_CODES = [
     '899050.BJ'   # 北交所指数
 ]
 
+# T+n 推演的天数（与前端 T+1~T+5 卡片一致）
+T_PLUS_DAYS = 5
+
+# 主板按沪深区分对应指数，其他市场的对应指数见 MARKET_INDEX_CODES
+SZ_MAIN_BOARD_INDEX_CODE = '399107.SZ'    # 深证A指
+DEFAULT_INDEX_CODE = '000001.SH'          # 上证指数
+MARKET_INDEX_CODES = {
+    '创业板': '399102.SZ',    # 创业板综
+    '科创板': '000688.SH',    # 科创板指
+    '北交所': '899050.BJ',    # 北交所指数
+}
+
+# 各市场涨停幅度（%）
+LIMIT_UP_PERCENTAGES = {
+    '主板': 10,
+    '创业板': 20,
+    '科创板': 20,
+    '北交所': 30,
+}
+DEFAULT_LIMIT_UP_PERCENTAGE = 10
+
+# 上市不足该交易日数的股票视为新股（is_sg=False 时过滤）
+NEW_STOCK_TRADING_DAYS = 60
+
+# query_stocks 的排行方式：sql 为单条窗口函数语句（get_deviation_ranking），python 为逐只股票计算
+RANKING_MODE = os.getenv('RANKING_MODE', 'sql')
+
+# 单条语句计算全市场偏离值排行（SQLite 3.28+ 窗口函数；只用 SQLite 和 DuckDB 共有的语法，见 analytics.py）：
+# - dates / bounds：库中最新的 n 个交易日（递归 CTE 沿 trade_date 索引逐个跳到上一个日期，不扫描全表）
+# - win / stocks：窗口内每只股票按 pre_close 排名取最低价及其日期（同价取较早日期），
+#   再按股票聚合出开始日 pre_close、结束日收盘价，只保留开始日和结束日都有数据的股票
+# - cal：交易日历按日期累计的开市日数（去重）和开市记录数（各交易所分别计，与逐只计算时的新股判断一致），
+#   区间内的交易日数 = 两端累计数之差；日期不在日历中时退回逐行计数
+# - 对应指数在开始日 / 最低价日 / 结束日的价格通过 index_daily_data 关联得到
+_INDEX_CODE_CASE = (
+    "CASE sb.market WHEN '主板' THEN CASE WHEN w.ts_code LIKE '%.SZ' "
+    f"THEN '{SZ_MAIN_BOARD_INDEX_CODE}' ELSE '{DEFAULT_INDEX_CODE}' END "
+    + ''.join(f"WHEN '{market}' THEN '{code}' " for market, code in MARKET_INDEX_CODES.items())
+    + f"ELSE '{DEFAULT_INDEX_CODE}' END"
+)
+
+_DEVIATION_RANKING_SQL = f"""
+WITH RECURSIVE dates(trade_date, k) AS (
+    SELECT MAX(trade_date), 1 FROM stock_daily_data
+    UNION ALL
+    SELECT (SELECT MAX(trade_date) FROM stock_daily_data WHERE trade_date < dates.trade_date), k + 1
+    FROM dates WHERE k < :n AND dates.trade_date IS NOT NULL
+),
+bounds AS (
+    SELECT MIN(trade_date) AS start_date, MAX(trade_date) AS end_date, COUNT(trade_date) AS days FROM dates
+),
+win AS (
+    SELECT d.ts_code, d.trade_date, d.close, d.pre_close,
+           ROW_NUMBER() OVER (
+               PARTITION BY d.ts_code ORDER BY d.pre_close IS NULL, d.pre_close, d.trade_date
+           ) AS low_rank
+    FROM stock_daily_data d
+    JOIN bounds b ON d.trade_date BETWEEN b.start_date AND b.end_date
+    WHERE b.days >= 2
+),
+stocks AS (
+    SELECT w.ts_code,
+           MAX(CASE WHEN w.trade_date = b.start_date THEN w.pre_close END) AS start_price,
+           MAX(CASE WHEN w.trade_date = b.end_date THEN w.close END) AS end_price,
+           MAX(CASE WHEN w.low_rank = 1 THEN w.pre_close END) AS low_price,
+           MAX(CASE WHEN w.low_rank = 1 THEN w.trade_date END) AS low_date,
+           sb.name, sb.market, sb.list_date, {_INDEX_CODE_CASE} AS index_code
+    FROM win w
+    CROSS JOIN bounds b
+    JOIN stock_basic sb ON sb.ts_code = w.ts_code
+    WHERE :all_markets OR sb.market IN :markets
+    GROUP BY w.ts_code, sb.name, sb.market, sb.list_date
+    HAVING COUNT(CASE WHEN w.trade_date = b.start_date THEN 1 END) > 0
+       AND COUNT(CASE WHEN w.trade_date = b.end_date THEN 1 END) > 0
+),
+cal AS (
+    SELECT cal_date, open_day, open_rows_day,
+           SUM(open_day) OVER (ORDER BY cal_date) AS open_days,
+           SUM(open_rows_day) OVER (ORDER BY cal_date) AS open_rows
+    FROM (
+        SELECT cal_date,
+               MAX(CASE WHEN is_open = '1' THEN 1 ELSE 0 END) AS open_day,
+               SUM(CASE WHEN is_open = '1' THEN 1 ELSE 0 END) AS open_rows_day
+        FROM trade_cal GROUP BY cal_date
+    ) days
+),
+cal_end AS (
+    SELECT c.* FROM cal c JOIN bounds b ON c.cal_date = b.end_date
+),
+ranked AS (
+    SELECT w.ts_code, w.name, w.market, b.start_date, b.end_date,
+           w.start_price, w.end_price, w.low_price, w.low_date, w.index_code,
+           i_start.pre_close AS index_start, i_low.pre_close AS index_low, i_end.close AS index_end,
+           CASE WHEN c_low.cal_date IS NOT NULL AND c_end.cal_date IS NOT NULL
+                THEN c_end.open_days - c_low.open_days + c_low.open_day
+                ELSE (SELECT COUNT(DISTINCT cal_date) FROM trade_cal
+                      WHERE cal_date >= w.low_date AND cal_date <= b.end_date AND is_open = '1')
+           END AS date_span,
+           CASE WHEN w.list_date IS NULL THEN 0
+                WHEN c_list.cal_date IS NOT NULL AND c_end.cal_date IS NOT NULL
+                THEN c_end.open_rows - c_list.open_rows + c_list.open_rows_day
+                WHEN c_end.cal_date IS NOT NULL AND w.list_date < (SELECT MIN(cal_date) FROM cal)
+                THEN c_end.open_rows
+                ELSE (SELECT COUNT(*) FROM trade_cal
+                      WHERE cal_date >= w.list_date AND cal_date <= b.end_date AND is_open = '1')
+           END AS listed_days
+    FROM stocks w
+    CROSS JOIN bounds b
+    LEFT JOIN index_daily_data i_start ON i_start.ts_code = w.index_code AND i_start.trade_date = b.start_date
+    LEFT JOIN index_daily_data i_low ON i_low.ts_code = w.index_code AND i_low.trade_date = w.low_date
+    LEFT JOIN index_daily_data i_end ON i_end.ts_code = w.index_code AND i_end.trade_date = b.end_date
+    LEFT JOIN cal_end c_end ON c_end.cal_date = b.end_date
+    LEFT JOIN cal c_low ON c_low.cal_date = w.low_date
+    LEFT JOIN cal c_list ON c_list.cal_date = w.list_date
+)
+SELECT r.*,
+       CASE WHEN r.low_price > 0 THEN (r.end_price / r.low_price - 1) * 100 END AS price_change_low_pct,
+       CASE WHEN r.low_price > 0 THEN (r.end_price / r.low_price - 1) * 100
+            - CASE WHEN r.index_low <> 0 AND r.index_end <> 0 THEN (r.index_end / r.index_low - 1) * 100 ELSE 0 END
+       END AS deviation
+FROM ranked r
+WHERE :include_new OR r.listed_days >= :min_listed_days
+ORDER BY {{order_by}} DESC NULLS LAST, r.ts_code
+{{limit}}
+"""
+
+# get_deviation_ranking 支持的排序字段
+RANKING_ORDER_FIELDS = ('deviation', 'price_change_low_pct')
+
+
+def _calculate_t_plus_day(stock_prices, index_prices, day, base_days, threshold, limit_up, extra_percent):
+    """计算单个 T+day 的数据（与前端 tplusCalculation.calculateTPlusData 逻辑一致）"""
+    last_price = stock_prices[-1]['close']
+
+    # 生成 T+day 的价格序列
+    extra_prices = []
+    current_price = last_price
+    for i in range(day):
+        daily_percent = extra_percent[i] if i < len(extra_percent) else limit_up
+        current_price = current_price * (1 + daily_percent / 100)
+        extra_prices.append(round(current_price, 2))
+
+    all_prices = list(stock_prices) + [
+        {
+            'trade_date': f'T+{idx + 1}',
+            'close': price,
+            'pre_close': last_price if idx == 0 else extra_prices[idx - 1],
+        }
+        for idx, price in enumerate(extra_prices)
+    ]
+
+    # 滑动窗口：第 day 天到 T+day 天（窗口大小为 base_days），在窗口内找最低价
+    window = all_prices[day:day + base_days]
+    lowest_price = window[0]['pre_close']
+    lowest_date = window[0]['trade_date'] or '-'
+    for item in window:
+        if item['pre_close'] < lowest_price:
+            lowest_price = item['pre_close']
+            lowest_date = item['trade_date'] or '-'
+
+    t_plus_current_price = extra_prices[day - 1]
+    stock_change_pct = (t_plus_current_price - lowest_price) / lowest_price * 100
+
+    # 指数从 lowest_date 到最后一天的涨幅
+    index_change_pct = 0
+    if index_prices:
+        index_lowest_price = index_prices[0]['pre_close']
+        for item in index_prices:
+            if item['trade_date'] == lowest_date:
+                index_lowest_price = item['pre_close']
+                break
+        index_current_price = index_prices[-1]['close']
+        index_change_pct = (index_current_price - index_lowest_price) / index_lowest_price * 100
+
+    deviation = stock_change_pct - index_change_pct
+    prev_price = last_price if day == 1 else extra_prices[day - 2]
+    daily_change = (t_plus_current_price - prev_price) / prev_price * 100
+
+    # 可能最高价 = lowest_price * (1 + threshold/100 + index_change_pct/100)
+    possible_highest_price = lowest_price * (1 + threshold / 100 + index_change_pct / 100)
+    possible_change = (possible_highest_price - last_price) / last_price * 100
+
+    return {
+        'lowest_price': round(lowest_price, 2),
+        'lowest_date': lowest_date,
+        'current_close': t_plus_current_price,
+        'change_percent': round(stock_change_pct, 2),
+        'daily_change': round(daily_change, 2),
+        'index_change_percent': round(index_change_pct, 2),
+        'deviation': round(deviation, 2),
+        'is_abnormal': deviation > threshold,
+        'possible_highest_price': round(possible_highest_price, 2),
+        'possible_change': round(possible_change, 2),
+    }
+
+
+def calculate_t_plus_data(stock_prices, index_prices, base_days, threshold=None, limit_up=None, extra_percent=None):
+    """
+    计算 T+1~T+5 的推演数据
+
+    参数:
+        stock_prices: 股票 n 日价格列表 [{trade_date, close, pre_close, ...}]
+        index_prices: 对应指数 n 日价格列表
+        base_days: 榜单天数（10 或 30）
+        threshold: 异动阈值（%），默认 100
+        limit_up: 涨停幅度（%），默认 10
+        extra_percent: T+1~T+5 每日涨幅（%），默认均为涨停幅度
+
+    返回:
+        {day: {...}}，价格数据不完整时返回空字典
+    """
+    if not stock_prices or not index_prices or len(stock_prices) != base_days:
+        return {}
+
+    threshold = threshold or 100
+    limit_up = limit_up or 10
+    if extra_percent is None:
+        extra_percent = [limit_up] * T_PLUS_DAYS
+
+    return {
+        day: _calculate_t_plus_day(stock_prices, index_prices, day, base_days, threshold, limit_up, extra_percent)
+        for day in range(1, T_PLUS_DAYS + 1)
+    }
+
 
 class StockMonitor:
     """股票监控类"""
     
-    def __init__(self):
-        self.session = get_session()
+    def __init__(self, session=None):
+        self.session = session or get_session()
     
     def __del__(self):
         close_session(self.session)
@@ -344,6 +572,106 @@ class StockMonitor:
             logger.error(f"获取涨幅排序失败: {e}")
             raise
 
+    def get_deviation_ranking(self, n, market_filter=None, include_new=True, order_by='deviation',
+                              limit=None, threshold=None, backend=None):
+        """
+        用一条 SQL（窗口函数）计算全市场 n 日偏离值排行，结果与 query_stocks 逐只计算的字段和取值一致
+
+        只把最终每只股票一行读入 Python，取舍入、涨停数等在 Python 中完成（与逐只计算的舍入方式相同）。
+        同一条 SQL 也可以交给 DuckDB 执行。
+
+        参数:
+            n: 过去n个交易日
+            market_filter: 市场类型列表，None 表示不过滤
+            include_new: 是否包含新股（上市不足 NEW_STOCK_TRADING_DAYS 个交易日）
+            order_by: 排序字段，deviation 或 price_change_low_pct，从高到低
+            limit: 最多返回的数量，None 表示不限制
+            threshold: 异动阈值（%），原样写入结果
+            backend: 执行后端 sqlite / duckdb / compare，默认取 ANALYTICS_BACKEND（见 analytics.py）
+
+        返回:
+            列表，每项字段同 query_stocks（不含 stock_prices / index_prices）
+        """
+        if order_by not in RANKING_ORDER_FIELDS:
+            raise ValueError(f"不支持的排序字段: {order_by}")
+
+        sql = _DEVIATION_RANKING_SQL.format(
+            order_by=order_by, limit=f"LIMIT {int(limit)}" if limit is not None else '',
+        )
+        params = {
+            'n': n,
+            'all_markets': market_filter is None,
+            'markets': list(market_filter or []),
+            'include_new': bool(include_new),
+            'min_listed_days': NEW_STOCK_TRADING_DAYS,
+        }
+        rows = fetch_rows(self.session, sql, params, name=f"ranking_n{n}", backend=backend)
+
+        results = [self._build_ranking_item(row, threshold) for row in rows]
+        logger.info(f"过去 {n} 个交易日偏离值排行（SQL）: {len(results)} 只，市场过滤: {market_filter}")
+        return results
+
+    def get_window_ranking(self, range_index, n=None, start_date=None, end_date=None, market_filter=None,
+                           include_new=True, order_by='deviation', limit=None, threshold=None):
+        """
+        用区间索引（range_index.RangeIndex）计算任意窗口的偏离值排行，不访问数据库
+
+        参数:
+            range_index: 当前数据版本的区间索引
+            n / start_date / end_date: 窗口（见 RangeIndex.resolve_window）
+            其余参数同 get_deviation_ranking
+
+        返回:
+            列表，每项字段同 get_deviation_ranking
+        """
+        rows = range_index.rank(n=n, start_date=start_date, end_date=end_date, market_filter=market_filter,
+                                include_new=include_new, order_by=order_by, limit=limit)
+        return [self._build_ranking_item(row, threshold) for row in rows]
+
+    def _build_ranking_item(self, row, threshold):
+        """把 get_deviation_ranking 的一行转为 query_stocks 的结果项（舍入方式与逐只计算一致）"""
+        start_price = float(row['start_price'])
+        end_price = float(row['end_price'])
+        low_price = float(row['low_price']) if row['low_price'] is not None else None
+        market = row['market']
+
+        price_change_pct = round((end_price - start_price) / start_price * 100, 2)
+        price_change_low_pct = None
+        if low_price is not None and low_price > 0:
+            price_change_low_pct = round((end_price / low_price - 1) * 100, 2)
+
+        index_change_pct = 0
+        if row['index_start'] and row['index_end']:
+            index_change_pct = round((float(row['index_end']) / float(row['index_start']) - 1) * 100, 2)
+        index_change_low_pct = 0
+        if row['low_date'] and row['index_low'] and row['index_end']:
+            index_change_low_pct = round((float(row['index_end']) / float(row['index_low']) - 1) * 100, 2)
+
+        deviation_low = price_change_low_pct - index_change_low_pct if price_change_low_pct is not None else None
+        limit_up_pct = self._get_limit_up_percentage(market)
+
+        return {
+            'ts_code': row['ts_code'],
+            'name': row['name'],
+            'market': market,
+            'limit_up': limit_up_pct,
+            'threshold': threshold,
+            'start_price': round(start_price, 2),
+            'end_price': round(end_price, 2),
+            'price_change_pct': price_change_pct,
+            'index_change_pct': round(index_change_pct, 2),
+            'deviation': round(deviation_low, 2) if deviation_low is not None else None,
+            'remaining_limit_ups': self._calculate_remaining_limit_ups(round(end_price, 2), limit_up_pct),
+            'start_date': row['start_date'],
+            'end_date': row['end_date'],
+            'low_price': round(low_price, 2) if low_price is not None else None,
+            'low_date': row['low_date'],
+            'price_change_low_pct': price_change_low_pct,
+            'index_change_low_pct': round(index_change_low_pct, 2),
+            'deviation_low': round(deviation_low, 2) if deviation_low is not None else None,
+            'deviation_date_range': row['date_span'] or 0,
+        }
+
     def _get_market_type(self, ts_code):
         """根据股票代码获取市场类型"""
         try:
@@ -371,28 +699,17 @@ class StockMonitor:
         if market == '主板':
             if ts_code and ts_code.endswith('.SZ'):
                 # 深市主板使用深证A指
-                return '399107.SZ'
+                return SZ_MAIN_BOARD_INDEX_CODE
             else:
                 # 沪市主板使用上证指数
-                return '000001.SH'
+                return DEFAULT_INDEX_CODE
 
-        # 其他市场的指数映射
-        index_map = {
-            '创业板': '399102.SZ',    # 创业板综
-            '科创板': '000688.SH',    # 科创板指
-            '北交所': '899050.BJ'     # 北交所指数
-        }
-        return index_map.get(market, '000001.SH')  # 默认上证指数
+        # 其他市场的指数映射，默认上证指数
+        return MARKET_INDEX_CODES.get(market, DEFAULT_INDEX_CODE)
 
     def _get_limit_up_percentage(self, market):
         """根据市场类型获取涨停幅度"""
-        limit_up_map = {
-            '主板': 10,
-            '创业板': 20,
-            '科创板': 20,
-            '北交所': 30
-        }
-        return limit_up_map.get(market, 10)  # 默认10%
+        return LIMIT_UP_PERCENTAGES.get(market, DEFAULT_LIMIT_UP_PERCENTAGE)
 
     def _calculate_remaining_limit_ups(self, current_price, limit_up_pct):
         """计算还能有多少个涨停"""
@@ -433,8 +750,104 @@ class StockMonitor:
         # 理论上任何价格都可能连续涨停
         return True
 
+    def _get_price_windows(self, ts_code, index_code, start_date, end_date):
+        """获取股票和对应指数在 [start_date, end_date] 内的完整价格数据"""
+        # 获取股票在 n 个交易日内的完整价格数据（区间早于热数据窗口时读取归档）
+        columns = ('trade_date', 'open', 'high', 'low', 'close', 'pre_close')
+        stock_prices = [
+            tuple(bar[column] for column in columns)
+            for bar in get_daily_bars(self.session, ts_code, start_date, end_date, columns=columns)
+        ]
+
+        # 获取指数在 n 个交易日内的完整价格数据（来自共享的指数涨幅表）
+        index_prices = [
+            tuple(row[column] for column in columns)
+            for row in get_index_returns(self.session).window(index_code, start_date, end_date)
+        ]
+
+        # 转换为字典列表
+        def _to_dicts(rows):
+            return [
+                {
+                    'trade_date': row[0],
+                    'open': round(float(row[1]), 2),
+                    'high': round(float(row[2]), 2),
+                    'low': round(float(row[3]), 2),
+                    'close': round(float(row[4]), 2),
+                    'pre_close': round(float(row[5]), 2)
+                }
+                for row in rows or []
+            ]
+
+        return _to_dicts(stock_prices), _to_dicts(index_prices)
+
+    def get_stock_detail(self, ts_code, n, threshold=None):
+        """
+        获取单只股票的 n 日详情：价格窗口 + T+1~T+5 推演数据
+
+        参数:
+            ts_code: 股票代码
+            n: 过去n个交易日（与榜单一致，10 或 30）
+            threshold: 异动阈值（%）
+
+        返回:
+            {
+                'ts_code', 'name', 'market', 'limit_up', 'threshold',
+                'start_date', 'end_date',
+                'stock_prices': 股票 n 日价格列表,
+                'index_prices': 对应指数 n 日价格列表,
+                't_plus_data': {1: {...}, ..., 5: {...}}
+            }
+            未找到股票时返回 None
+        """
+        try:
+            stock_basic = self.session.query(StockBasic).filter(
+                StockBasic.ts_code == ts_code
+            ).first()
+            if not stock_basic:
+                logger.warning(f"未找到 {ts_code} 的基本信息")
+                return None
+
+            # 与 get_price_change_ranking 一致：使用数据库中最新的 n 个交易日
+            trading_dates = self.session.query(StockDailyData.trade_date).group_by(
+                StockDailyData.trade_date
+            ).order_by(
+                StockDailyData.trade_date.desc()
+            ).limit(n).all()
+            if not trading_dates:
+                logger.warning("无法获取交易日期")
+                return None
+
+            trading_dates = sorted([d[0] for d in trading_dates])
+            start_date = trading_dates[0]
+            end_date = trading_dates[-1]
+
+            market = stock_basic.market
+            limit_up_pct = self._get_limit_up_percentage(market)
+            index_code = self._get_index_code_by_market(market, ts_code)
+            stock_prices, index_prices = self._get_price_windows(ts_code, index_code, start_date, end_date)
+
+            return {
+                'ts_code': ts_code,
+                'name': stock_basic.name,
+                'market': market,
+                'limit_up': limit_up_pct,
+                'threshold': threshold,
+                'start_date': start_date,
+                'end_date': end_date,
+                'stock_prices': stock_prices,
+                'index_prices': index_prices,
+                't_plus_data': calculate_t_plus_data(
+                    stock_prices, index_prices, n, threshold=threshold, limit_up=limit_up_pct
+                ),
+            }
+        except Exception as e:
+            logger.error(f"获取 {ts_code} 详情失败: {e}")
+            raise
+
     def query_stocks(self, n, top_n=None, threshold=None, is_sg=False,
-                     include_cyb=True, include_kcb=False, include_bj=False):
+                     include_cyb=True, include_kcb=False, include_bj=False,
+                     max_results=100, with_prices=True, market_filter=None):
         """
         查询符合条件的股票信息
 
@@ -446,6 +859,9 @@ class StockMonitor:
             include_cyb: 是否包含创业板，默认 True
             include_kcb: 是否包含科创板，默认 False
             include_bj: 是否包含北交所，默认 False
+            max_results: 未指定 top_n 时最多返回的数量，默认 100，None 表示不限制
+            with_prices: 是否附带 stock_prices/index_prices 价格数据，默认 True
+            market_filter: 市场类型列表，如 ['创业板']，指定后忽略 include_cyb/include_kcb/include_bj
 
         说明:
             根据股票市场类型自动选择对应指数计算偏离值：
@@ -515,231 +931,28 @@ class StockMonitor:
         """
         try:
             # 构建市场过滤列表
-            market_filter = ['主板']
-            if include_cyb:
-                market_filter.append('创业板')
-            if include_kcb:
-                market_filter.append('科创板')
-            if include_bj:
-                market_filter.append('北交所')
+            if market_filter is None:
+                market_filter = ['主板']
+                if include_cyb:
+                    market_filter.append('创业板')
+                if include_kcb:
+                    market_filter.append('科创板')
+                if include_bj:
+                    market_filter.append('北交所')
 
             logger.info(f"查询过去 {n} 个交易日，涨幅阈值 {threshold}%，市场过滤: {market_filter} 的股票")
 
-            # 获取涨幅排序
-            price_changes = self.get_price_change_ranking(n, market_filter=market_filter)
-
-            if not price_changes:
-                logger.warning("未获取到涨幅数据")
-                return []
-
-            # 获取数据库中最新的交易日期作为结束日期
-            latest_date = self.session.query(StockDailyData.trade_date).order_by(
-                StockDailyData.trade_date.desc()
-            ).first()
-            if not latest_date:
-                logger.warning("未获取到最新交易日期")
-                return []
-
-            end_date = latest_date[0]
-
-            # 获取开始和结束日期
-            trading_dates = self.session.query(StockDailyData.trade_date).group_by(
-                StockDailyData.trade_date
-            ).order_by(
-                StockDailyData.trade_date.desc()
-            ).limit(n).all()
-
-            if trading_dates:
-                trading_dates = sorted([d[0] for d in trading_dates])
-                start_date = trading_dates[0]
-                end_date = trading_dates[-1]
+            if RANKING_MODE == 'sql':
+                results = self.get_deviation_ranking(
+                    n, market_filter=market_filter, include_new=is_sg,
+                    order_by='price_change_low_pct', threshold=threshold,
+                )
             else:
-                logger.warning("无法获取交易日期")
+                results = self._rank_stocks_python(n, threshold, is_sg, market_filter)
+            if not results:
                 return []
-
-            # 处理每只股票的数据
-            results = []
-
-            # 缓存指数涨幅：key 为 index_code，value 为涨幅
-            index_change_cache = {}
-
-            # 预先获取所有需要的指数数据，用于 t+i 计算
-            # 使用全局定义的指数代码
-            unique_indices = set(INDEX_CODES)
-
-            # 缓存指数数据：key 为 (index_code, trade_date)，value 为 {pre_close, close}
-            index_data_cache = {}
-            if unique_indices:
-                # 获取所有需要的日期范围内的指数数据
-                all_dates = set()
-                for price_change in price_changes:
-                    t_plus_data = price_change.get('t_plus_data', {})
-                    for i in range(1, 7):
-                        ti_key = f't+{i}'
-                        if ti_key in t_plus_data:
-                            ti_low_date = t_plus_data[ti_key]['low_date']
-                            if ti_low_date:
-                                all_dates.add(ti_low_date)
-                    all_dates.add(end_date)
-
-                # 批量查询指数数据
-                for index_code in unique_indices:
-                    index_data = self.session.query(
-                        IndexDailyData.trade_date,
-                        IndexDailyData.pre_close,
-                        IndexDailyData.close
-                    ).filter(
-                        IndexDailyData.ts_code == index_code,
-                        IndexDailyData.trade_date.in_(list(all_dates))
-                    ).all()
-
-                    for trade_date, pre_close, close in index_data:
-                        index_data_cache[(index_code, trade_date)] = {
-                            'pre_close': pre_close,
-                            'close': close
-                        }
-
-            for price_change in price_changes:
-                ts_code = price_change['ts_code']
-                price_change_pct = price_change['price_change_pct']
-                low_price = price_change['low_price']
-                low_date = price_change['low_date']
-                price_change_low_pct = price_change['price_change_low_pct']
-
-                # 获取股票基本信息
-                stock_basic = self.session.query(StockBasic).filter(
-                    StockBasic.ts_code == ts_code
-                ).first()
-
-                if not stock_basic:
-                    logger.warning(f"未找到 {ts_code} 的基本信息")
-                    continue
-
-                # 过滤新股：如果 is_sg=False，过滤掉上市日期到现在少于60个交易日的股票
-                if not is_sg:
-                    # 计算从上市日期到现在的交易日数
-                    trading_days_since_listing = self.session.query(TradeCal).filter(
-                        TradeCal.cal_date >= stock_basic.list_date,
-                        TradeCal.cal_date <= end_date,
-                        TradeCal.is_open == '1'
-                    ).count()
-
-                    if trading_days_since_listing < 60:
-                        logger.debug(f"过滤掉新股 {ts_code}，上市交易日数: {trading_days_since_listing}")
-                        continue
-
-                # 根据股票市场类型获取对应的指数代码
-                market = stock_basic.market
-                stock_index_code = self._get_index_code_by_market(market, ts_code)
-
-                # 从缓存中获取该股票对应的指数涨幅，如果缓存中没有则计算
-                if stock_index_code not in index_change_cache:
-                    try:
-                        # 获取 start_date 的指数 pre_close
-                        index_start = self.session.query(IndexDailyData.pre_close).filter(
-                            IndexDailyData.ts_code == stock_index_code,
-                            IndexDailyData.trade_date == start_date
-                        ).first()
-
-                        # 获取 end_date 的指数收盘价
-                        index_end = self.session.query(IndexDailyData.close).filter(
-                            IndexDailyData.ts_code == stock_index_code,
-                            IndexDailyData.trade_date == end_date
-                        ).first()
-
-                        if index_start and index_end and index_start[0] and index_end[0]:
-                            start_close = float(index_start[0])
-                            end_close = float(index_end[0])
-                            change_pct = round((end_close / start_close - 1) * 100, 2)
-                            index_change_cache[stock_index_code] = change_pct
-                            logger.debug(f"指数 {stock_index_code} 从 {start_date} 到 {end_date} 的涨幅: {change_pct}%")
-                        else:
-                            logger.warning(f"指数 {stock_index_code} 在 {start_date} 或 {end_date} 的数据不足")
-                            index_change_cache[stock_index_code] = 0
-                    except Exception as e:
-                        logger.warning(f"计算指数涨幅失败 ({stock_index_code}): {e}")
-                        index_change_cache[stock_index_code] = 0
-
-                # 从缓存中获取该股票对应的指数涨幅
-                index_change_pct = index_change_cache.get(stock_index_code, 0)
-
-                # 计算指数从 low_date 到 end_date 的涨幅
-                index_change_low_pct = 0
-                try:
-                    if low_date:
-                        # 获取 low_date 的指数 pre_close
-                        index_low = self.session.query(IndexDailyData.pre_close).filter(
-                            IndexDailyData.ts_code == stock_index_code,
-                            IndexDailyData.trade_date == low_date
-                        ).first()
-
-                        # 获取 end_date 的指数收盘价
-                        index_end_for_low = self.session.query(IndexDailyData.close).filter(
-                            IndexDailyData.ts_code == stock_index_code,
-                            IndexDailyData.trade_date == end_date
-                        ).first()
-
-                        if index_low and index_end_for_low and index_low[0] and index_end_for_low[0]:
-                            low_close = float(index_low[0])
-                            end_close_for_low = float(index_end_for_low[0])
-                            index_change_low_pct = round((end_close_for_low / low_close - 1) * 100, 2)
-                            logger.debug(f"指数 {stock_index_code} 从 {low_date} 到 {end_date} 的涨幅: {index_change_low_pct}%")
-                        else:
-                            logger.debug(f"指数 {stock_index_code} 在 {low_date} 或 {end_date} 的数据不足")
-                            index_change_low_pct = 0
-                except Exception as e:
-                    logger.warning(f"计算指数从 {low_date} 到 {end_date} 的涨幅失败 ({stock_index_code}): {e}")
-                    index_change_low_pct = 0
-
-                # 计算基于 low_price 的偏离值（直接使用 deviation_low）
-                deviation_low = price_change_low_pct - index_change_low_pct if price_change_low_pct is not None else None
-
-                # 计算 low_date 到 end_date 的交易日周期
-                deviation_date_range = 0
-                try:
-                    if low_date and end_date:
-                        deviation_date_range = self.session.query(TradeCal.cal_date).filter(
-                            TradeCal.cal_date >= low_date,
-                            TradeCal.cal_date <= end_date,
-                            TradeCal.is_open == '1'
-                        ).distinct().count()
-                        logger.debug(f"股票 {ts_code} 从 {low_date} 到 {end_date} 的交易日数: {deviation_date_range}")
-                except Exception as e:
-                    logger.warning(f"计算交易日周期失败 ({ts_code}): {e}")
-                    deviation_date_range = 0
-
-                # 获取涨停幅度
-                limit_up_pct = self._get_limit_up_percentage(market)
-
-                # 计算还能有多少个涨停
-                remaining_limit_ups = self._calculate_remaining_limit_ups(
-                    price_change['end_price'],
-                    limit_up_pct
-                )
-
-                result_item = {
-                    'ts_code': ts_code,
-                    'name': stock_basic.name,
-                    'market': market,
-                    'limit_up': limit_up_pct,
-                    'threshold': threshold,
-                    'start_price': price_change['start_price'],
-                    'end_price': price_change['end_price'],
-                    'price_change_pct': price_change_pct,
-                    'index_change_pct': round(index_change_pct, 2),
-                    'deviation': round(deviation_low, 2) if deviation_low is not None else None,
-                    'remaining_limit_ups': remaining_limit_ups,
-                    'start_date': start_date,
-                    'end_date': end_date,
-                    'low_price': low_price,
-                    'low_date': low_date,
-                    'price_change_low_pct': price_change_low_pct,
-                    'index_change_low_pct': round(index_change_low_pct, 2),
-                    'deviation_low': round(deviation_low, 2) if deviation_low is not None else None,
-                    'deviation_date_range': deviation_date_range,
-                }
-
-                results.append(result_item)
+            start_date = results[0]['start_date']
+            end_date = results[0]['end_date']
 
             logger.info(f"共找到 {len(results)} 只符合条件的股票")
 
@@ -747,81 +960,178 @@ class StockMonitor:
             if top_n is not None:
                 results = results[:top_n]
                 logger.info(f"返回前 {top_n} 只股票")
-            else:
+            elif max_results is not None:
                 # 如果没有指定 top_n，为了避免超时，默认只返回前 100 只
-                if len(results) > 100:
-                    logger.warning(f"结果数量过多 ({len(results)} 只)，为避免超时，只返回前 100 只")
-                    results = results[:100]
+                if len(results) > max_results:
+                    logger.warning(f"结果数量过多 ({len(results)} 只)，为避免超时，只返回前 {max_results} 只")
+                    results = results[:max_results]
+
+            if not with_prices:
+                return results
 
             # 为每只股票添加完整的价格数据
             for result in results:
-                ts_code = result['ts_code']
-                stock_index_code = self._get_index_code_by_market(result['market'], ts_code)
-
-                # 获取股票在 n 个交易日内的完整价格数据
-                stock_prices = self.session.query(
-                    StockDailyData.trade_date,
-                    StockDailyData.open,
-                    StockDailyData.high,
-                    StockDailyData.low,
-                    StockDailyData.close,
-                    StockDailyData.pre_close
-                ).filter(
-                    StockDailyData.ts_code == ts_code,
-                    StockDailyData.trade_date >= start_date,
-                    StockDailyData.trade_date <= end_date
-                ).order_by(StockDailyData.trade_date.asc()).all()
-
-                # 获取指数在 n 个交易日内的完整价格数据
-                index_prices = self.session.query(
-                    IndexDailyData.trade_date,
-                    IndexDailyData.open,
-                    IndexDailyData.high,
-                    IndexDailyData.low,
-                    IndexDailyData.close,
-                    IndexDailyData.pre_close
-                ).filter(
-                    IndexDailyData.ts_code == stock_index_code,
-                    IndexDailyData.trade_date >= start_date,
-                    IndexDailyData.trade_date <= end_date
-                ).order_by(IndexDailyData.trade_date.asc()).all()
-
-                # 如果查询失败，使用空列表
-                if stock_prices is None:
-                    stock_prices = []
-                if index_prices is None:
-                    index_prices = []
-
-                # 转换为字典列表
-                result['stock_prices'] = [
-                    {
-                        'trade_date': row[0],
-                        'open': round(float(row[1]), 2),
-                        'high': round(float(row[2]), 2),
-                        'low': round(float(row[3]), 2),
-                        'close': round(float(row[4]), 2),
-                        'pre_close': round(float(row[5]), 2)
-                    }
-                    for row in stock_prices
-                ]
-
-                result['index_prices'] = [
-                    {
-                        'trade_date': row[0],
-                        'open': round(float(row[1]), 2),
-                        'high': round(float(row[2]), 2),
-                        'low': round(float(row[3]), 2),
-                        'close': round(float(row[4]), 2),
-                        'pre_close': round(float(row[5]), 2)
-                    }
-                    for row in index_prices
-                ]
+                stock_index_code = self._get_index_code_by_market(result['market'], result['ts_code'])
+                result['stock_prices'], result['index_prices'] = self._get_price_windows(
+                    result['ts_code'], stock_index_code, start_date, end_date
+                )
 
             return results
         except Exception as e:
             logger.error(f"查询股票失败: {e}")
             raise
 
+    def _rank_stocks_python(self, n, threshold, is_sg, market_filter):
+        """逐只股票计算 query_stocks 的排行（RANKING_MODE=python，按最低起涨幅从高到低排序）"""
+        # 获取涨幅排序
+        price_changes = self.get_price_change_ranking(n, market_filter=market_filter)
+
+        if not price_changes:
+            logger.warning("未获取到涨幅数据")
+            return []
+
+        # 获取数据库中最新的交易日期作为结束日期
+        latest_date = self.session.query(StockDailyData.trade_date).order_by(
+            StockDailyData.trade_date.desc()
+        ).first()
+        if not latest_date:
+            logger.warning("未获取到最新交易日期")
+            return []
+
+        end_date = latest_date[0]
+
+        # 获取开始和结束日期
+        trading_dates = self.session.query(StockDailyData.trade_date).group_by(
+            StockDailyData.trade_date
+        ).order_by(
+            StockDailyData.trade_date.desc()
+        ).limit(n).all()
+
+        if trading_dates:
+            trading_dates = sorted([d[0] for d in trading_dates])
+            start_date = trading_dates[0]
+            end_date = trading_dates[-1]
+        else:
+            logger.warning("无法获取交易日期")
+            return []
+
+        # 处理每只股票的数据
+        results = []
+
+        # 缓存指数涨幅：key 为 index_code，value 为涨幅
+        index_change_cache = {}
+
+        # 指数价格按交易日序号查表，不再逐只股票查询 index_daily_data
+        index_returns = get_index_returns(self.session)
+
+        for price_change in price_changes:
+            ts_code = price_change['ts_code']
+            price_change_pct = price_change['price_change_pct']
+            low_price = price_change['low_price']
+            low_date = price_change['low_date']
+            price_change_low_pct = price_change['price_change_low_pct']
+
+            # 获取股票基本信息
+            stock_basic = self.session.query(StockBasic).filter(
+                StockBasic.ts_code == ts_code
+            ).first()
+
+            if not stock_basic:
+                logger.warning(f"未找到 {ts_code} 的基本信息")
+                continue
+
+            # 过滤新股：如果 is_sg=False，过滤掉上市日期到现在少于60个交易日的股票
+            if not is_sg:
+                # 计算从上市日期到现在的交易日数
+                trading_days_since_listing = self.session.query(TradeCal).filter(
+                    TradeCal.cal_date >= stock_basic.list_date,
+                    TradeCal.cal_date <= end_date,
+                    TradeCal.is_open == '1'
+                ).count()
+
+                if trading_days_since_listing < NEW_STOCK_TRADING_DAYS:
+                    logger.debug(f"过滤掉新股 {ts_code}，上市交易日数: {trading_days_since_listing}")
+                    continue
+
+            # 根据股票市场类型获取对应的指数代码
+            market = stock_basic.market
+            stock_index_code = self._get_index_code_by_market(market, ts_code)
+
+            # 从缓存中获取该股票对应的指数涨幅，如果缓存中没有则计算
+            if stock_index_code not in index_change_cache:
+                change_pct = index_returns.change_pct(stock_index_code, start_date, end_date)
+                if change_pct is not None:
+                    index_change_cache[stock_index_code] = round(change_pct, 2)
+                    logger.debug(f"指数 {stock_index_code} 从 {start_date} 到 {end_date} 的涨幅: {change_pct:.2f}%")
+                else:
+                    logger.warning(f"指数 {stock_index_code} 在 {start_date} 或 {end_date} 的数据不足")
+                    index_change_cache[stock_index_code] = 0
+
+            # 从缓存中获取该股票对应的指数涨幅
+            index_change_pct = index_change_cache.get(stock_index_code, 0)
+
+            # 计算指数从 low_date 到 end_date 的涨幅
+            index_change_low_pct = 0
+            if low_date:
+                change_pct = index_returns.change_pct(stock_index_code, low_date, end_date)
+                if change_pct is not None:
+                    index_change_low_pct = round(change_pct, 2)
+                    logger.debug(f"指数 {stock_index_code} 从 {low_date} 到 {end_date} 的涨幅: {index_change_low_pct}%")
+                else:
+                    logger.debug(f"指数 {stock_index_code} 在 {low_date} 或 {end_date} 的数据不足")
+
+            # 计算基于 low_price 的偏离值（直接使用 deviation_low）
+            deviation_low = price_change_low_pct - index_change_low_pct if price_change_low_pct is not None else None
+
+            # 计算 low_date 到 end_date 的交易日周期
+            deviation_date_range = 0
+            try:
+                if low_date and end_date:
+                    deviation_date_range = self.session.query(TradeCal.cal_date).filter(
+                        TradeCal.cal_date >= low_date,
+                        TradeCal.cal_date <= end_date,
+                        TradeCal.is_open == '1'
+                    ).distinct().count()
+                    logger.debug(f"股票 {ts_code} 从 {low_date} 到 {end_date} 的交易日数: {deviation_date_range}")
+            except Exception as e:
+                logger.warning(f"计算交易日周期失败 ({ts_code}): {e}")
+                deviation_date_range = 0
+
+            # 获取涨停幅度
+            limit_up_pct = self._get_limit_up_percentage(market)
+
+            # 计算还能有多少个涨停
+            remaining_limit_ups = self._calculate_remaining_limit_ups(
+                price_change['end_price'],
+                limit_up_pct
+            )
+
+            result_item = {
+                'ts_code': ts_code,
+                'name': stock_basic.name,
+                'market': market,
+                'limit_up': limit_up_pct,
+                'threshold': threshold,
+                'start_price': price_change['start_price'],
+                'end_price': price_change['end_price'],
+                'price_change_pct': price_change_pct,
+                'index_change_pct': round(index_change_pct, 2),
+                'deviation': round(deviation_low, 2) if deviation_low is not None else None,
+                'remaining_limit_ups': remaining_limit_ups,
+                'start_date': start_date,
+                'end_date': end_date,
+                'low_price': low_price,
+                'low_date': low_date,
+                'price_change_low_pct': price_change_low_pct,
+                'index_change_low_pct': round(index_change_low_pct, 2),
+                'deviation_low': round(deviation_low, 2) if deviation_low is not None else None,
+                'deviation_date_range': deviation_date_range,
+            }
+
+            results.append(result_item)
+
+        return results
+
 
 if __name__ == "__main__":
     monitor = StockMonitor()
@@ -0,0 +1,389 @@
+"""
+按需性能剖析模块
+对刷新进程的各阶段和指定的 API 请求做剖析，结果写入 PROFILE_DIR（默认 RUNTIME_DIR/profiles）：
+
+- <时间>-<类别>-<名称>-<pid>.collapsed  折叠栈（每行 "栈;帧 次数"），可直接交给
+  flamegraph.pl / speedscope / inferno 生成火焰图
+- <时间>-<类别>-<名称>-<pid>.txt        摘要（自身 / 累计采样最多的函数）
+- <时间>-<类别>-<名称>-<pid>.pstats     PROFILE_MODE=cprofile 时的 cProfile 结果
+
+两种剖析方式（环境变量 PROFILE_MODE）：
+- sample（默认）：后台线程每 PROFILE_INTERVAL_MS 毫秒采样一次调用栈，开销很小
+- cprofile：确定性剖析，结果精确但会明显拖慢被剖析的代码
+
+开启方式：
+- 环境变量 PROFILE=refresh,api（或 all），进程启动时读取
+- 运行时开关：python profiler.py enable --minutes 30 [--kinds api]，写入 RUNTIME_DIR/profiling.json，
+  Web 和刷新进程最多 FLAG_CHECK_INTERVAL 秒后生效，到期自动关闭
+- 临时剖析：python profiler.py refresh / python profiler.py api /api/stocks/both
+
+关闭时每个阶段 / 请求只有一次时间比较，不产生任何文件。
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from config import RUNTIME_DIR
+
+KIND_REFRESH = 'refresh'
+KIND_API = 'api'
+PROFILE_KINDS = (KIND_REFRESH, KIND_API)
+
+MODE_SAMPLE = 'sample'
+MODE_CPROFILE = 'cprofile'
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(RUNTIME_DIR, 'profiles'))
+PROFILE_FLAG_PATH = os.path.join(RUNTIME_DIR, 'profiling.json')
+PROFILE_MODE = os.getenv('PROFILE_MODE', MODE_SAMPLE)
+# 采样间隔（毫秒）
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+# 剖析的 API 路由（路由模板，逗号分隔）
+PROFILE_ENDPOINTS = tuple(
+    e.strip() for e in os.getenv('PROFILE_ENDPOINTS', '/api/stocks/both,/api/stocks/board').split(',') if e.strip()
+)
+# 保留最近的剖析结果数量和天数
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+PROFILE_RETENTION_DAYS = 7
+# 运行时开关文件的检查间隔（秒）
+FLAG_CHECK_INTERVAL = 5.0
+# 摘要中列出的函数数
+SUMMARY_TOP = 30
+
+
+def _parse_kinds(value):
+    kinds = {k.strip() for k in (value or '').split(',') if k.strip()}
+    if kinds & {'1', 'all', 'true'}:
+        return set(PROFILE_KINDS)
+    return kinds & set(PROFILE_KINDS)
+
+
+_env_kinds = _parse_kinds(os.getenv('PROFILE'))
+_flag_kinds = set()
+_flag_checked_at = float('-inf')
+_forced_kinds = set()
+
+
+def _flag_file_kinds():
+    """读取运行时开关（到期或不存在时返回空集合）"""
+    try:
+        with open(PROFILE_FLAG_PATH, encoding='utf-8') as f:
+            flag = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if flag.get('until') and flag['until'] < time.time():
+        return set()
+    return set(flag.get('kinds', PROFILE_KINDS)) & set(PROFILE_KINDS)
+
+
+def is_enabled(kind):
+    """kind 类别的剖析是否开启（环境变量、运行时开关或 CLI 临时开启）"""
+    global _flag_kinds, _flag_checked_at
+    if kind in _env_kinds or kind in _forced_kinds:
+        return True
+    now = time.monotonic()
+    if now - _flag_checked_at >= FLAG_CHECK_INTERVAL:
+        _flag_checked_at = now
+        _flag_kinds = _flag_file_kinds()
+    return kind in _flag_kinds
+
+
+def should_profile_request(endpoint):
+    """API 请求是否需要剖析（endpoint 为路由模板）"""
+    return endpoint in PROFILE_ENDPOINTS and is_enabled(KIND_API)
+
+
+def set_runtime_flag(kinds=PROFILE_KINDS, minutes=None):
+    """写入运行时开关（kinds 为空表示关闭）"""
+    os.makedirs(os.path.dirname(PROFILE_FLAG_PATH), exist_ok=True)
+    if not kinds:
+        try:
+            os.remove(PROFILE_FLAG_PATH)
+        except FileNotFoundError:
+            pass
+        return
+    flag = {'kinds': list(kinds), 'until': time.time() + minutes * 60 if minutes else None}
+    tmp_path = f"{PROFILE_FLAG_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(flag, f)
+    os.replace(tmp_path, PROFILE_FLAG_PATH)
+
+
+# ---------- 采样 ----------
+
+class StackSampler:
+    """
+    调用栈采样器：后台线程定期读取 sys._current_frames()，按折叠栈计数
+
+    参数:
+        interval: 采样间隔（秒）
+        thread_ids: 只采样这些线程（None 表示除采样线程外的所有线程，栈以线程名开头）
+    """
+
+    def __init__(self, interval, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.stacks = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        thread_names = {}
+        names_refreshed = float('-inf')
+        while not self._stop.wait(self.interval):
+            if self.thread_ids is None and time.monotonic() - names_refreshed > 1.0:
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+                names_refreshed = time.monotonic()
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (self.thread_ids is not None and ident not in self.thread_ids):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(self._frame_label(frame.f_code))
+                    frame = frame.f_back
+                if self.thread_ids is None:
+                    labels.append(thread_names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top=SUMMARY_TOP):
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = sum(self.stacks.values()) or 1
+        lines = [f"采样 {self.samples} 次，间隔 {self.interval * 1000:.1f}ms，栈样本 {sum(self.stacks.values())} 个", '',
+                 f"自身采样最多的 {top} 个函数:"]
+        lines += [f"  {count / samples:7.1%} {count:>8}  {frame}" for frame, count in own.most_common(top)]
+        lines += ['', f"累计采样最多的 {top} 个函数:"]
+        lines += [f"  {count / samples:7.1%} {count:>8}  {frame}" for frame, count in total.most_common(top)]
+        return '\n'.join(lines) + '\n'
+
+
+# ---------- 剖析会话 ----------
+
+def _slug(name):
+    return re.sub(r'[^0-9A-Za-z_-]+', '_', name).strip('_') or 'root'
+
+
+class ProfileSession:
+    """
+    一次剖析：start() 开始，stop() 结束并写入 PROFILE_DIR
+
+    参数:
+        name: 阶段名或路由
+        kind: 类别（refresh / api）
+        all_threads: 采样模式下是否采样所有线程（刷新阶段会用线程池并发抓取）
+    """
+
+    def __init__(self, name, kind, all_threads=False, mode=None, interval_ms=None, profile_dir=None):
+        self.name = name
+        self.kind = kind
+        self.all_threads = all_threads
+        self.mode = mode or PROFILE_MODE
+        self.interval = (interval_ms or PROFILE_INTERVAL_MS) / 1000
+        self.profile_dir = profile_dir or PROFILE_DIR
+        self.paths = []
+        self._profiler = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        if self.mode == MODE_CPROFILE:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            thread_ids = None if self.all_threads else {threading.get_ident()}
+            self._profiler = StackSampler(self.interval, thread_ids).start()
+        return self
+
+    def stop(self):
+        """结束剖析并写文件，返回写入的文件路径列表"""
+        elapsed = time.perf_counter() - self._started
+        if self.mode == MODE_CPROFILE:
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        try:
+            self.paths = self._write(elapsed)
+            prune_profiles(self.profile_dir)
+            logger.info(f"剖析结果已写入 {self.paths[0]}（{self.kind}:{self.name}，{elapsed:.2f}s）")
+        except OSError as e:
+            # 剖析结果写盘失败不能影响业务
+            logger.error(f"写入剖析结果失败: {e}")
+        return self.paths
+
+    def _write(self, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        stem = os.path.join(self.profile_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{self.kind}-"
+                                              f"{_slug(self.name)}-{os.getpid()}")
+        header = f"{self.kind}:{self.name} 耗时 {elapsed:.3f}s，模式 {self.mode}\n"
+        paths = []
+        if self.mode == MODE_CPROFILE:
+            import pstats
+
+            self._profiler.dump_stats(f"{stem}.pstats")
+            paths.append(f"{stem}.pstats")
+            buffer = io.StringIO()
+            pstats.Stats(self._profiler, stream=buffer).sort_stats('cumulative').print_stats(SUMMARY_TOP)
+            summary = buffer.getvalue()
+        else:
+            with open(f"{stem}.collapsed", 'w', encoding='utf-8') as f:
+                f.write(self._profiler.collapsed())
+            paths.append(f"{stem}.collapsed")
+            summary = self._profiler.summary()
+        with open(f"{stem}.txt", 'w', encoding='utf-8') as f:
+            f.write(header + '\n' + summary)
+        paths.append(f"{stem}.txt")
+        return paths
+
+
+@contextmanager
+def profile_block(name, kind, all_threads=False):
+    """kind 类别的剖析开启时剖析代码块，否则直接执行"""
+    if not is_enabled(kind):
+        yield None
+        return
+    session = ProfileSession(name, kind, all_threads=all_threads).start()
+    try:
+        yield session
+    finally:
+        session.stop()
+
+
+def prune_profiles(profile_dir=PROFILE_DIR, keep=PROFILE_KEEP, retention_days=PROFILE_RETENTION_DAYS):
+    """删除超过保留天数、或超出保留数量的旧剖析结果（同一次剖析的文件一起删除），返回删除的文件数"""
+    try:
+        filenames = os.listdir(profile_dir)
+    except FileNotFoundError:
+        return 0
+    groups = {}
+    for filename in filenames:
+        stem, _ = os.path.splitext(filename)
+        groups.setdefault(stem, []).append(os.path.join(profile_dir, filename))
+    # 文件名以时间开头，按名称排序即按时间排序
+    stems = sorted(groups, reverse=True)
+    stale_before = time.time() - retention_days * 86400
+    removed = 0
+    for index, stem in enumerate(stems):
+        paths = groups[stem]
+        if index < keep and all(os.path.getmtime(path) >= stale_before for path in paths):
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+@contextmanager
+def force_enabled(*kinds):
+    """临时开启剖析（CLI 使用）"""
+    _forced_kinds.update(kinds)
+    try:
+        yield
+    finally:
+        _forced_kinds.difference_update(kinds)
+
+
+# ---------- 命令行 ----------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按需性能剖析")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    enable = sub.add_parser('enable', help="开启运行中进程的剖析")
+    enable.add_argument('--kinds', default='all', help="refresh、api 或 all（逗号分隔），默认 all")
+    enable.add_argument('--minutes', type=float, default=60, help="多少分钟后自动关闭，默认 60，0 表示不自动关闭")
+    sub.add_parser('disable', help="关闭运行时剖析开关")
+    sub.add_parser('status', help="查看剖析开关和已有结果")
+    sub.add_parser('prune', help="按保留策略清理旧结果")
+    sub.add_parser('refresh', help="剖析一次完整的数据刷新（每个阶段单独输出）")
+    api = sub.add_parser('api', help="剖析一次 API 请求（进程内调用，不经过网络）")
+    api.add_argument('path', help="请求路径，例如 /api/stocks/both")
+    for command in (sub.choices['refresh'], api):
+        command.add_argument('--mode', choices=(MODE_SAMPLE, MODE_CPROFILE), help="剖析方式，默认取 PROFILE_MODE")
+    args = parser.parse_args(argv)
+
+    global PROFILE_MODE
+    if getattr(args, 'mode', None):
+        PROFILE_MODE = args.mode
+
+    if args.command == 'enable':
+        kinds = _parse_kinds(args.kinds)
+        if not kinds:
+            parser.error(f"--kinds 只能是 {PROFILE_KINDS} 或 all")
+        set_runtime_flag(sorted(kinds), args.minutes or None)
+        until = f"，{args.minutes:g} 分钟后自动关闭" if args.minutes else ''
+        print(f"已开启剖析: {', '.join(sorted(kinds))}{until}（进程最多 {FLAG_CHECK_INTERVAL:g} 秒后生效）")
+    elif args.command == 'disable':
+        set_runtime_flag(())
+        print("已关闭运行时剖析开关")
+    elif args.command == 'status':
+        print(f"环境变量开启: {', '.join(sorted(_env_kinds)) or '无'}")
+        print(f"运行时开关: {', '.join(sorted(_flag_file_kinds())) or '无'}")
+        files = sorted(os.listdir(PROFILE_DIR)) if os.path.isdir(PROFILE_DIR) else []
+        print(f"{PROFILE_DIR}: {len(files)} 个文件")
+        for filename in files[-10:]:
+            print(f"  {filename}")
+    elif args.command == 'prune':
+        print(f"已删除 {prune_profiles()} 个文件")
+    elif args.command == 'refresh':
+        from refresh_worker import refresh_data
+
+        with force_enabled(KIND_REFRESH):
+            refresh_data()
+        print(f"结果目录: {PROFILE_DIR}")
+    elif args.command == 'api':
+        from app import app
+
+        # 直接剖析整个请求（不依赖 PROFILE_ENDPOINTS），包括路由、视图和序列化
+        session = ProfileSession(args.path, KIND_API).start()
+        try:
+            response = app.test_client().get(args.path)
+        finally:
+            session.stop()
+        print(f"{args.path} -> {response.status_code}，{len(response.data)} 字节")
+        for path in session.paths:
+            print(f"  {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
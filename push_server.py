@@ -0,0 +1,266 @@
+"""
+榜单更新推送服务（Server-Sent Events）
+独立于 Gunicorn Web 进程运行：Web 进程是同步 worker，每个长连接会占住一个 worker，
+这里用一个 asyncio 事件循环持有所有 SSE 连接，空闲连接只占一个 socket 和一个协程。
+
+进程内只有一个监视任务，每 PUSH_POLL_SECONDS 秒读取一次当前发布的数据版本（与 Web 进程读同一份快照），
+版本变化时把 "generation" 事件编码一次，唤醒所有连接写出；客户端收到新版本号后再请求榜单接口。
+无论连接数多少，读库次数都不变。
+
+事件格式:
+    id: <generation>
+    event: generation
+    data: {"generation", "end_date", "seq", "previous", "computed_at"}
+
+连接建立时立即推送当前版本；客户端断线重连时带上 Last-Event-ID（或查询参数 generation），
+版本未变则不重复推送。空闲时每 PUSH_HEARTBEAT_SECONDS 秒发送注释行保活。
+
+用法:
+    python -m push_server                     # 监听 PUSH_HOST:PUSH_PORT（默认 0.0.0.0:5001）
+    python -m push_server --port 5001 --poll 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import signal
+import time
+from urllib.parse import parse_qs, urlsplit
+from dotenv import load_dotenv
+
+# 必须在导入其他模块之前加载环境变量
+load_dotenv()
+
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from board_service import get_generation_info
+from metrics import REGISTRY, PUSH_CLIENTS, PUSH_EVENTS
+
+# 监听地址和端口
+PUSH_HOST = os.getenv('PUSH_HOST', '0.0.0.0')
+PUSH_PORT = int(os.getenv('PUSH_PORT', '5001'))
+# SSE 路径（与 Web 接口同在 /api 下，便于反向代理按路径转发）
+EVENTS_PATH = '/api/events'
+# 检查数据版本的间隔（秒）
+PUSH_POLL_SECONDS = float(os.getenv('PUSH_POLL_SECONDS', '2'))
+# 空闲连接的保活间隔（秒），需小于反向代理的读超时
+PUSH_HEARTBEAT_SECONDS = float(os.getenv('PUSH_HEARTBEAT_SECONDS', '15'))
+# 最大连接数，超出时返回 503
+PUSH_MAX_CLIENTS = int(os.getenv('PUSH_MAX_CLIENTS', '10000'))
+# 客户端断线后重连的等待时间（毫秒，SSE retry 字段）
+RETRY_MS = 5000
+# 读取请求头的超时（秒）和长度上限（字节）
+REQUEST_TIMEOUT = 10
+REQUEST_MAX_BYTES = 8192
+# 单个连接写出的超时（秒），超过则视为慢客户端断开
+WRITE_TIMEOUT = 10
+
+_SSE_HEADERS = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/event-stream; charset=utf-8\r\n"
+    b"Cache-Control: no-cache\r\n"
+    b"Connection: keep-alive\r\n"
+    b"X-Accel-Buffering: no\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"\r\n"
+)
+_HEARTBEAT = b": ping\n\n"
+
+
+def encode_event(info):
+    """把版本信息编码为 SSE 事件（bytes）"""
+    data = json.dumps(info, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {info['generation']}\nevent: generation\ndata: {data}\n\n".encode('utf-8')
+
+
+class EventHub:
+    """
+    当前事件 + 变更通知（只在事件循环线程中使用）
+
+    每次发布替换 asyncio.Event 并唤醒等待者，连接协程醒来后读取 current；
+    连续多次发布只会让落后的连接收到最新一次，不会积压。
+    """
+
+    def __init__(self):
+        self.current_id = None
+        self.current = None
+        # 正在推送的连接 {writer: 连接协程任务}（停止服务时逐个关闭）
+        self.connections = {}
+        self._changed = asyncio.Event()
+
+    def publish(self, info):
+        self.current_id = info['generation']
+        self.current = encode_event(info)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def changed(self):
+        """下一次发布时完成的 awaitable"""
+        return self._changed.wait()
+
+
+def _read_generation():
+    info = get_generation_info()
+    if not info or not info.get('generation'):
+        return None
+    return {key: info.get(key) for key in ('generation', 'end_date', 'seq', 'previous', 'computed_at')}
+
+
+async def watch_generation(hub, poll_seconds=PUSH_POLL_SECONDS):
+    """定期读取当前发布的数据版本，变化时发布事件"""
+    while True:
+        try:
+            info = await asyncio.to_thread(_read_generation)
+            if info and info['generation'] != hub.current_id:
+                hub.publish(info)
+                PUSH_EVENTS.inc(event='generation')
+                logger.info(f"推送新数据版本 {info['generation']} 给 {len(hub.connections)} 个连接")
+        except Exception as e:
+            logger.error(f"读取数据版本失败: {e}")
+        await asyncio.sleep(poll_seconds)
+
+
+async def _write(writer, data):
+    writer.write(data)
+    await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+
+
+async def _simple_response(writer, status, body):
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('ascii') + payload
+    )
+    await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+
+
+def _parse_request(raw):
+    """解析请求行和请求头，返回 (method, path, query, headers)"""
+    lines = raw.decode('latin-1').split('\r\n')
+    method, target, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), headers
+
+
+async def _stream_events(hub, reader, writer, last_id):
+    await _write(writer, _SSE_HEADERS + f"retry: {RETRY_MS}\n\n".encode('ascii'))
+    # 客户端发完请求后不再发送数据，读到 EOF 即已断开（不必等到下一次写出失败）
+    closed = asyncio.ensure_future(reader.read(1))
+    changed = None
+    try:
+        while True:
+            if hub.current is not None and hub.current_id != last_id:
+                last_id = hub.current_id
+                await _write(writer, hub.current)
+            changed = asyncio.ensure_future(hub.changed())
+            done, _ = await asyncio.wait((changed, closed), timeout=PUSH_HEARTBEAT_SECONDS,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if closed in done:
+                return
+            if changed not in done:
+                changed.cancel()
+                await _write(writer, _HEARTBEAT)
+    finally:
+        closed.cancel()
+        if changed is not None:
+            changed.cancel()
+
+
+async def handle_client(hub, reader, writer):
+    """处理一个连接：GET /api/events 保持 SSE 推送，/health 返回状态，其余 404"""
+    streaming = False
+    try:
+        raw = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+        method, path, query, headers = _parse_request(raw)
+        if method != 'GET':
+            await _simple_response(writer, '405 Method Not Allowed', {'code': 405, 'message': 'method not allowed'})
+        elif path == '/health':
+            await _simple_response(writer, '200 OK', {
+                'code': 0, 'clients': len(hub.connections), 'generation': hub.current_id,
+            })
+        elif path != EVENTS_PATH:
+            await _simple_response(writer, '404 Not Found', {'code': 404, 'message': 'not found'})
+        elif len(hub.connections) >= PUSH_MAX_CLIENTS:
+            await _simple_response(writer, '503 Service Unavailable', {'code': 503, 'message': 'too many clients'})
+        else:
+            streaming = True
+            hub.connections[writer] = asyncio.current_task()
+            PUSH_CLIENTS.set(len(hub.connections))
+            last_id = headers.get('last-event-id') or (query.get('generation') or [None])[0]
+            await _stream_events(hub, reader, writer, last_id)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+            ConnectionError, ValueError):
+        # 客户端断开、请求不完整或过长、写出超时
+        pass
+    except Exception as e:
+        logger.error(f"推送连接异常: {e}")
+    finally:
+        if streaming:
+            hub.connections.pop(writer, None)
+            PUSH_CLIENTS.set(len(hub.connections))
+        writer.close()
+
+
+def _raise_nofile_limit():
+    """把打开文件数软限制提高到硬限制（每个连接一个文件描述符）"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, PUSH_MAX_CLIENTS + 256)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError) as e:
+            logger.warning(f"提高打开文件数限制失败: {e}")
+    if soft < PUSH_MAX_CLIENTS + 64:
+        logger.warning(f"打开文件数限制 {soft} 低于 PUSH_MAX_CLIENTS={PUSH_MAX_CLIENTS}")
+
+
+async def serve(host=PUSH_HOST, port=PUSH_PORT, poll_seconds=PUSH_POLL_SECONDS):
+    """启动推送服务，直到收到 SIGINT / SIGTERM"""
+    hub = EventHub()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client(hub, reader, writer),
+        host, port, limit=REQUEST_MAX_BYTES, backlog=1024,
+    )
+    watcher = asyncio.create_task(watch_generation(hub, poll_seconds))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"推送服务已启动: http://{host}:{port}{EVENTS_PATH}")
+    started = time.monotonic()
+    try:
+        await stop.wait()
+    finally:
+        logger.info(f"推送服务停止（运行 {time.monotonic() - started:.0f}s，当前连接 {len(hub.connections)}）")
+        watcher.cancel()
+        server.close()
+        # 关闭连接后各连接协程读到 EOF 正常退出
+        tasks = list(hub.connections.values())
+        for writer in list(hub.connections):
+            writer.close()
+        if tasks:
+            await asyncio.wait(tasks, timeout=WRITE_TIMEOUT)
+        REGISTRY.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="榜单更新推送服务（SSE）")
+    parser.add_argument('--host', default=PUSH_HOST, help="监听地址")
+    parser.add_argument('--port', type=int, default=PUSH_PORT, help="监听端口")
+    parser.add_argument('--poll', type=float, default=PUSH_POLL_SECONDS, help="检查数据版本的间隔（秒）")
+    args = parser.parse_args()
+
+    _raise_nofile_limit()
+    asyncio.run(serve(args.host, args.port, args.poll))
+
+
+if __name__ == '__main__':
+    main()
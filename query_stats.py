@@ -0,0 +1,228 @@
+"""
+SQL 查询统计模块
+通过 SQLAlchemy 引擎事件统计一次逻辑操作（一个请求、一个刷新阶段、一次基准运行）
+执行的语句数、影响行数和耗时，并按语句形状（参数化后的 SQL）归类，用于发现 N+1 查询。
+
+- QueryTracker：统计代码块内的查询，可嵌套，退出时写入指标并对重复过多的 SELECT 告警
+- QueryBudget：在 QueryTracker 基础上断言查询预算，超出时记录最常重复的语句形状；
+  既可以作为上下文管理器，也可以作为装饰器
+
+    with QueryBudget(max_queries=20, name='detail'):
+        monitor.get_stock_detail(ts_code, 10)
+
+    @QueryBudget(max_queries=5, max_repeats=1)
+    def load_board(): ...
+
+只统计当前线程内执行的语句；线程池 / 子进程中的查询不计入。
+引擎事件在第一次开始统计时才注册，未使用时没有任何开销。
+"""
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ContextDecorator
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from metrics import DB_QUERIES, DB_QUERY_SECONDS
+
+# 同一形状的 SELECT 在一次操作中重复超过该次数时告警（疑似 N+1）
+N_PLUS_ONE_THRESHOLD = 50
+# 日志中列出的语句形状数
+TOP_SHAPES = 5
+
+_local = threading.local()
+_install_lock = threading.Lock()
+_installed = False
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+
+
+def statement_shape(statement):
+    """把 SQL 归一为语句形状：合并空白，字面量替换为 ?，IN (?, ?, ...) 合并为 IN (?...)"""
+    shape = _WHITESPACE_RE.sub(' ', statement).strip()
+    shape = _STRING_RE.sub('?', shape)
+    shape = _NUMBER_RE.sub('?', shape)
+    return _PLACEHOLDER_LIST_RE.sub('(?...)', shape)
+
+
+def _active_trackers():
+    trackers = getattr(_local, 'trackers', None)
+    if trackers is None:
+        trackers = _local.trackers = []
+    return trackers
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_trackers():
+        conn.info.setdefault('query_stats_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trackers = _active_trackers()
+    if not trackers:
+        return
+    started = conn.info.get('query_stats_started')
+    elapsed = time.perf_counter() - started.pop() if started else 0.0
+    rows = max(cursor.rowcount, 0)
+    shape = statement_shape(statement)
+    for tracker in trackers:
+        tracker._record(shape, rows, elapsed)
+
+
+def _install():
+    """在 Engine 类上注册事件，覆盖所有引擎（主库、只读快照、基准临时库）"""
+    global _installed
+    with _install_lock:
+        if not _installed:
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            _installed = True
+
+
+class QueryTracker(ContextDecorator):
+    """
+    统计代码块内执行的 SQL
+
+    属性:
+        queries: 语句执行次数（executemany 计 1 次）
+        rows: 影响的行数（INSERT / UPDATE / DELETE；SQLite 的 SELECT 不返回行数，计 0）
+        seconds: 语句执行耗时之和
+        shapes: {语句形状: 执行次数}
+    """
+
+    def __init__(self, name=None, record_metrics=True):
+        self.name = name
+        self.record_metrics = record_metrics
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.shape_seconds = Counter()
+
+    def _recreate_cm(self):
+        # 作为装饰器时每次调用使用新的实例，避免并发和递归调用共享计数
+        return type(self)(**self._init_kwargs())
+
+    def _init_kwargs(self):
+        return {'name': self.name, 'record_metrics': self.record_metrics}
+
+    def _record(self, shape, rows, elapsed):
+        self.queries += 1
+        self.rows += rows
+        self.seconds += elapsed
+        self.shapes[shape] += 1
+        self.shape_seconds[shape] += elapsed
+
+    def start(self):
+        _install()
+        _active_trackers().append(self)
+        return self
+
+    def stop(self):
+        trackers = _active_trackers()
+        if self in trackers:
+            trackers.remove(self)
+        if self.record_metrics and self.name:
+            DB_QUERIES.inc(self.queries, operation=self.name)
+            DB_QUERY_SECONDS.inc(self.seconds, operation=self.name)
+        suspects = self.repeated_selects()
+        if suspects:
+            logger.warning(f"疑似 N+1 查询（{self.name or '未命名操作'}）: "
+                           f"{suspects[0][1]} 次 {_truncate(suspects[0][0])}")
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def max_repeats(self):
+        """同一语句形状的最多执行次数"""
+        return max(self.shapes.values(), default=0)
+
+    def repeated_selects(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """重复次数达到 threshold 的 SELECT 形状 [(形状, 次数), ...]（写入语句批量重复属正常）"""
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count >= threshold and shape.upper().startswith(('SELECT', 'WITH'))]
+
+    def top_shapes(self, limit=TOP_SHAPES):
+        """执行次数最多的语句形状 [(形状, 次数, 耗时秒), ...]"""
+        return [(shape, count, self.shape_seconds[shape]) for shape, count in self.shapes.most_common(limit)]
+
+    def summary(self):
+        return {
+            'queries': self.queries,
+            'rows': self.rows,
+            'seconds': round(self.seconds, 4),
+            'distinct_shapes': len(self.shapes),
+            'max_repeats': self.max_repeats(),
+        }
+
+    def format_top_shapes(self, limit=TOP_SHAPES):
+        return '\n'.join(f"  {count:>6} 次 {seconds * 1000:>9.1f}ms  {_truncate(shape)}"
+                         for shape, count, seconds in self.top_shapes(limit))
+
+
+class QueryBudgetExceeded(AssertionError):
+    """代码块执行的查询超出预算"""
+
+
+class QueryBudget(QueryTracker):
+    """
+    查询预算：代码块内的语句数或同一形状的重复次数超出上限时，
+    记录最常重复的语句形状，并抛出 QueryBudgetExceeded（raise_error=False 时只记录日志）
+
+    参数:
+        max_queries: 语句总数上限（None 表示不限制）
+        max_repeats: 同一语句形状的执行次数上限（None 表示不限制）
+        name: 操作名称，用于日志和指标
+        raise_error: 超出预算时是否抛出异常
+    """
+
+    def __init__(self, max_queries=None, max_repeats=None, name=None, raise_error=True, record_metrics=False):
+        super().__init__(name=name, record_metrics=record_metrics)
+        self.max_queries = max_queries
+        self.max_repeats_limit = max_repeats
+        self.raise_error = raise_error
+        self.exceeded = False
+
+    def _init_kwargs(self):
+        return {
+            'max_queries': self.max_queries,
+            'max_repeats': self.max_repeats_limit,
+            'name': self.name,
+            'raise_error': self.raise_error,
+            'record_metrics': self.record_metrics,
+        }
+
+    def violations(self):
+        """超出预算的原因列表（为空表示未超出）"""
+        problems = []
+        if self.max_queries is not None and self.queries > self.max_queries:
+            problems.append(f"执行了 {self.queries} 条语句，预算 {self.max_queries}")
+        if self.max_repeats_limit is not None and self.max_repeats() > self.max_repeats_limit:
+            problems.append(f"同一语句重复 {self.max_repeats()} 次，上限 {self.max_repeats_limit}")
+        return problems
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        problems = self.violations()
+        if problems:
+            self.exceeded = True
+            message = f"查询预算超出（{self.name or '未命名操作'}）: {'；'.join(problems)}"
+            logger.error(f"{message}，最常执行的语句:\n{self.format_top_shapes()}")
+            # 代码块本身抛出的异常优先
+            if self.raise_error and exc_type is None:
+                raise QueryBudgetExceeded(message)
+        return False
+
+
+def _truncate(shape, width=160):
+    return shape if len(shape) <= width else shape[:width - 3] + '...'
@@ -0,0 +1,385 @@
+"""
+任意窗口排行模块
+每个数据版本构建一次全市场区间索引，之后任意窗口长度、任意结束日期的偏离值排行都只做 O(1) 查表：
+
+- 最近 RANGE_INDEX_DAYS 个交易日的 pre_close / close 按 股票 × 交易日 排成稠密矩阵（停牌为 NaN），
+  开始日、结束日价格和对应指数价格直接按下标读取
+- pre_close 的稀疏表（sparse table）：第 k 层记录每个位置起 2^k 个交易日内最低 pre_close 的下标，
+  任意区间 [a, b] 的最低价和最低价日期由两段重叠区间比较得到（同价取较早日期，与排行 SQL 一致）
+- 交易日历的开市日期（去重）和开市记录（各交易所分别计）排成有序数组，
+  区间内的交易日数和上市交易日数用二分查找的下标差（前缀计数）得到
+
+所有股票一次向量化计算，结果字段和取值与 StockMonitor.get_deviation_ranking 相同。
+热表（stock_daily_data）不足 RANGE_INDEX_DAYS 个交易日且有冷数据归档时（ARCHIVE_HOT_DAYS 较小），
+更早的交易日按交易日历补齐，价格通过 archive.iter_daily_bars 从归档读取。
+
+刷新进程发布快照后构建索引并保存为 RANGE_INDEX_PATH（npz，带数据版本号），
+Web 进程按版本号直接加载；文件不存在或版本不符时才从只读快照现场构建。
+numpy 只在构建 / 加载索引时导入，Web 进程启动时不加载。
+"""
+import itertools
+import os
+import time
+from sqlalchemy import text
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from database import SNAPSHOT_DIR
+from archive import ARCHIVE_EXCHANGE, iter_daily_bars, read_manifest
+from monitor import (
+    DEFAULT_INDEX_CODE, MARKET_INDEX_CODES, NEW_STOCK_TRADING_DAYS, RANKING_ORDER_FIELDS, SZ_MAIN_BOARD_INDEX_CODE,
+)
+
+# 索引覆盖的最近交易日数（窗口的开始日不能早于索引的第一天）
+RANGE_INDEX_DAYS = int(os.getenv('RANGE_INDEX_DAYS', '250'))
+# 刷新进程保存、Web 进程加载的索引文件（与只读快照放在同一共享目录）
+RANGE_INDEX_PATH = os.getenv('RANGE_INDEX_PATH', os.path.join(SNAPSHOT_DIR, 'range_index.npz'))
+# 索引文件中的数组（稀疏表在加载时重建）
+_SAVED_ARRAYS = ('dates', 'ts_codes', 'names', 'markets', 'list_dates', 'has_list_date', 'pre_close', 'close',
+                 'present', 'index_codes', 'index_pre_close', 'index_close', 'open_days', 'open_rows')
+
+_DATES_SQL = text("""
+WITH RECURSIVE dates(trade_date, k) AS (
+    SELECT MAX(trade_date), 1 FROM stock_daily_data
+    UNION ALL
+    SELECT (SELECT MAX(trade_date) FROM stock_daily_data WHERE trade_date < dates.trade_date), k + 1
+    FROM dates WHERE k < :days AND dates.trade_date IS NOT NULL
+)
+SELECT trade_date FROM dates WHERE trade_date IS NOT NULL ORDER BY trade_date
+""")
+# 热表之前、冷数据归档覆盖的开市日（最近的 :days 个）
+_ARCHIVED_DATES_SQL = text("""
+SELECT cal_date FROM trade_cal
+WHERE exchange = :exchange AND is_open = '1' AND cal_date >= :start AND cal_date < :end
+ORDER BY cal_date DESC LIMIT :days
+""")
+
+
+def _index_code(market, ts_code):
+    if market == '主板':
+        return SZ_MAIN_BOARD_INDEX_CODE if ts_code.endswith('.SZ') else DEFAULT_INDEX_CODE
+    return MARKET_INDEX_CODES.get(market, DEFAULT_INDEX_CODE)
+
+
+def _date_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RangeIndex:
+    """全市场区间索引（只读，可在多个线程中共享）"""
+
+    def __init__(self, dates, ts_codes, names, markets, list_dates, has_list_date, pre_close, close, present,
+                 index_codes, index_pre_close, index_close, open_days, open_rows, generation=None):
+        import numpy as np
+
+        self.generation = generation
+        self.dates = [str(d) for d in dates]
+        self._date_ints = np.array([int(d) for d in self.dates], dtype=np.int64)
+        self.ts_codes = [str(code) for code in ts_codes]
+        self.names = [str(name) for name in names]
+        self.markets = np.asarray(markets, dtype=str)
+        self.list_dates = np.asarray(list_dates, dtype=str)
+        self.has_list_date = np.asarray(has_list_date, dtype=bool)
+        self.pre_close = pre_close
+        self.close = close
+        self.present = present
+        self.index_codes = [str(code) for code in index_codes]
+        self._stock_index = np.array([self.index_codes.index(_index_code(market, code))
+                                      for market, code in zip(self.markets, self.ts_codes)], dtype=np.int64)
+        self.index_pre_close = index_pre_close
+        self.index_close = index_close
+        self.open_days = open_days
+        self.open_rows = open_rows
+        self._list_rank = np.searchsorted(
+            open_rows, np.array([_date_int(d) or 0 for d in self.list_dates], dtype=np.int64), side='left'
+        )
+        # 空的 pre_close 视为无穷大，排在最后
+        self._low_values = np.where(np.isnan(pre_close), np.inf, pre_close)
+        self._sparse = self._build_sparse_table(self._low_values)
+
+    @staticmethod
+    def _build_sparse_table(values):
+        """第 k 层 [s, i] 为 values[s, i:i + 2^k] 中最小值的下标（同值取左侧）"""
+        import numpy as np
+
+        stocks, days = values.shape
+        index_type = np.int16 if days < 2 ** 15 else np.int32
+        level = np.broadcast_to(np.arange(days, dtype=index_type), (stocks, days)).copy()
+        table = [level]
+        k = 1
+        while (1 << k) <= days:
+            half = 1 << (k - 1)
+            width = days - (1 << k) + 1
+            left = table[-1][:, :width]
+            right = table[-1][:, half:half + width]
+            take_right = (np.take_along_axis(values, right.astype(np.int64), axis=1)
+                          < np.take_along_axis(values, left.astype(np.int64), axis=1))
+            table.append(np.where(take_right, right, left))
+            k += 1
+        return table
+
+    @property
+    def nbytes(self):
+        return (sum(level.nbytes for level in self._sparse)
+                + self.pre_close.nbytes + self.close.nbytes + self._low_values.nbytes)
+
+    def range_min(self, a, b):
+        """
+        区间 [a, b]（交易日下标，含两端）内每只股票最低 pre_close 的下标
+
+        返回:
+            int 数组（每只股票一个）；区间内 pre_close 全为空时为 a
+        """
+        import numpy as np
+
+        k = (b - a + 1).bit_length() - 1
+        level = self._sparse[k]
+        left = level[:, a].astype(np.int64)
+        right = level[:, b - (1 << k) + 1].astype(np.int64)
+        rows = np.arange(len(left))
+        left_value = self._low_values[rows, left]
+        right_value = self._low_values[rows, right]
+        take_right = (right_value < left_value) | ((right_value == left_value) & (right < left))
+        return np.where(take_right, right, left)
+
+    def resolve_window(self, n=None, start_date=None, end_date=None):
+        """
+        把 (n 或 start_date, end_date) 换算为交易日下标区间
+
+        参数:
+            n: 窗口交易日数，与 start_date 二选一；都不指定时报错
+            start_date: 开始日期，取该日及之后的第一个交易日
+            end_date: 结束日期，取该日及之前的最后一个交易日，默认最新交易日
+
+        返回:
+            (a, b)
+        """
+        import numpy as np
+
+        if end_date:
+            b = int(np.searchsorted(self._date_ints, int(end_date), side='right')) - 1
+            if b < 0:
+                raise ValueError(f"结束日期 {end_date} 早于索引的第一个交易日 {self.dates[0]}")
+        else:
+            b = len(self.dates) - 1
+        if start_date:
+            if int(start_date) < self._date_ints[0]:
+                raise ValueError(f"开始日期 {start_date} 早于索引的第一个交易日 {self.dates[0]}"
+                                 f"（RANGE_INDEX_DAYS={len(self.dates)}）")
+            a = int(np.searchsorted(self._date_ints, int(start_date), side='left'))
+        elif n:
+            a = b - int(n) + 1
+            if a < 0:
+                raise ValueError(f"窗口 {n} 个交易日超出索引范围（结束日前共 {b + 1} 个交易日）")
+        else:
+            raise ValueError("需要指定 n 或 start_date")
+        if b - a + 1 < 2:
+            raise ValueError("窗口至少包含 2 个交易日")
+        return a, b
+
+    def rank(self, n=None, start_date=None, end_date=None, market_filter=None, include_new=True,
+             order_by='deviation', limit=None):
+        """
+        全市场窗口排行
+
+        参数同 StockMonitor.get_deviation_ranking，窗口由 n / start_date / end_date 指定（见 resolve_window）
+
+        返回:
+            与排行 SQL 相同字段的 dict 列表（交给 StockMonitor._build_ranking_item 转为榜单项）
+        """
+        import numpy as np
+
+        if order_by not in RANKING_ORDER_FIELDS:
+            raise ValueError(f"不支持的排序字段: {order_by}")
+        a, b = self.resolve_window(n, start_date, end_date)
+        low = self.range_min(a, b)
+        rows = np.arange(len(low))
+
+        start_price = self.pre_close[:, a]
+        end_price = self.close[:, b]
+        low_price = self.pre_close[rows, low]
+        index_start = self.index_pre_close[self._stock_index, a]
+        index_low = self.index_pre_close[self._stock_index, low]
+        index_end = self.index_close[self._stock_index, b]
+
+        end_date_int = self._date_ints[b]
+        date_span = (np.searchsorted(self.open_days, end_date_int, side='right')
+                     - np.searchsorted(self.open_days, self._date_ints[low], side='left'))
+        listed_days = np.where(self.has_list_date,
+                               np.searchsorted(self.open_rows, end_date_int, side='right') - self._list_rank, 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            price_change_low_pct = np.where(low_price > 0, (end_price / low_price - 1) * 100, np.nan)
+            index_ok = (index_low != 0) & (index_end != 0) & ~np.isnan(index_low) & ~np.isnan(index_end)
+            index_change = np.where(index_ok, (index_end / index_low - 1) * 100, 0.0)
+        deviation = price_change_low_pct - index_change
+
+        keep = self.present[:, a] & self.present[:, b]
+        if market_filter is not None:
+            keep &= np.isin(self.markets, list(market_filter))
+        if not include_new:
+            keep &= listed_days >= NEW_STOCK_TRADING_DAYS
+        selected = np.flatnonzero(keep)
+
+        # 按排序字段从高到低（空值在后），同值按股票代码（股票已按代码排列，下标即代码顺序）
+        sort_values = (deviation if order_by == 'deviation' else price_change_low_pct)[selected]
+        order = np.lexsort((selected, np.where(np.isnan(sort_values), np.inf, -sort_values)))
+        selected = selected[order]
+        if limit is not None:
+            selected = selected[:int(limit)]
+
+        def _value(x):
+            return None if np.isnan(x) else float(x)
+
+        start_date_str, end_date_str = self.dates[a], self.dates[b]
+        return [{
+            'ts_code': self.ts_codes[i],
+            'name': self.names[i],
+            'market': str(self.markets[i]) or None,
+            'start_date': start_date_str,
+            'end_date': end_date_str,
+            'start_price': _value(start_price[i]),
+            'end_price': _value(end_price[i]),
+            'low_price': _value(low_price[i]),
+            'low_date': self.dates[low[i]],
+            'index_code': self.index_codes[self._stock_index[i]],
+            'index_start': _value(index_start[i]),
+            'index_low': _value(index_low[i]),
+            'index_end': _value(index_end[i]),
+            'date_span': int(date_span[i]),
+            'listed_days': int(listed_days[i]),
+            'price_change_low_pct': _value(price_change_low_pct[i]),
+            'deviation': _value(deviation[i]),
+        } for i in selected]
+
+
+def _archived_dates(session, first_hot_date, days):
+    """热表第一天之前、归档中最近 days 个交易日（按交易日历，不早于最早的归档分区），升序"""
+    manifest = read_manifest()
+    partitions = (manifest or {}).get('partitions')
+    if not manifest or not manifest.get('cutoff') or not partitions:
+        return []
+    rows = session.execute(_ARCHIVED_DATES_SQL, {
+        'exchange': ARCHIVE_EXCHANGE, 'start': f"{min(partitions)}01", 'end': first_hot_date, 'days': days,
+    })
+    return sorted(row[0] for row in rows)
+
+
+def build_range_index(session, days=None, generation=None):
+    """
+    从数据库（主库或只读快照）构建最近 days 个交易日的区间索引，generation 为对应的数据版本号
+
+    返回:
+        RangeIndex；库中不足 2 个交易日时返回 None
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    days = days or RANGE_INDEX_DAYS
+    dates = [row[0] for row in session.execute(_DATES_SQL, {'days': days})]
+    # 热表天数不足时从归档补齐更早的交易日
+    archived_dates = _archived_dates(session, dates[0], days - len(dates)) if 0 < len(dates) < days else []
+    if archived_dates:
+        logger.info(f"热表只有 {len(dates)} 个交易日，从归档补齐 {len(archived_dates)} 个"
+                    f"（{archived_dates[0]} ~ {archived_dates[-1]}）")
+        dates = archived_dates + dates
+    if len(dates) < 2:
+        return None
+    date_pos = {date: i for i, date in enumerate(dates)}
+
+    stocks = [dict(row) for row in session.execute(text(
+        "SELECT ts_code, name, market, list_date FROM stock_basic ORDER BY ts_code"
+    )).mappings()]
+    stock_pos = {stock['ts_code']: i for i, stock in enumerate(stocks)}
+
+    shape = (len(stocks), len(dates))
+    pre_close = np.full(shape, np.nan)
+    close = np.full(shape, np.nan)
+    present = np.zeros(shape, dtype=bool)
+    bars = session.execute(text(
+        "SELECT ts_code, trade_date, close, pre_close FROM stock_daily_data WHERE trade_date >= :start"
+    ), {'start': dates[len(archived_dates)]})
+    if archived_dates:
+        # 归档部分（iter_daily_bars 同时读取热表中残留的早期行并以热表为准）
+        cold_bars = iter_daily_bars(session, start_date=archived_dates[0], end_date=archived_dates[-1],
+                                    columns=('close', 'pre_close'))
+        bars = itertools.chain(cold_bars, bars)
+    for ts_code, trade_date, close_value, pre_close_value in bars:
+        i, j = stock_pos.get(ts_code), date_pos.get(trade_date)
+        if i is None or j is None:
+            continue
+        present[i, j] = True
+        if close_value is not None:
+            close[i, j] = close_value
+        if pre_close_value is not None:
+            pre_close[i, j] = pre_close_value
+
+    index_codes = sorted({_index_code(stock['market'], stock['ts_code']) for stock in stocks} or {DEFAULT_INDEX_CODE})
+    index_pos = {code: i for i, code in enumerate(index_codes)}
+    index_pre_close = np.full((len(index_codes), len(dates)), np.nan)
+    index_close = np.full((len(index_codes), len(dates)), np.nan)
+    index_bars = session.execute(text(
+        "SELECT ts_code, trade_date, close, pre_close FROM index_daily_data "
+        "WHERE trade_date >= :start AND trade_date <= :end"
+    ), {'start': dates[0], 'end': dates[-1]})
+    for ts_code, trade_date, close_value, pre_close_value in index_bars:
+        i, j = index_pos.get(ts_code), date_pos.get(trade_date)
+        if i is None or j is None:
+            continue
+        if close_value is not None:
+            index_close[i, j] = close_value
+        if pre_close_value is not None:
+            index_pre_close[i, j] = pre_close_value
+
+    open_rows = np.array(sorted(_date_int(row[0]) for row in session.execute(text(
+        "SELECT cal_date FROM trade_cal WHERE is_open = '1'"
+    )) if _date_int(row[0]) is not None), dtype=np.int64)
+    open_days = np.unique(open_rows)
+
+    index = RangeIndex(
+        dates, [stock['ts_code'] for stock in stocks], [stock['name'] or '' for stock in stocks],
+        [stock['market'] or '' for stock in stocks], [stock['list_date'] or '' for stock in stocks],
+        [stock['list_date'] is not None for stock in stocks], pre_close, close, present,
+        index_codes, index_pre_close, index_close, open_days, open_rows, generation=generation,
+    )
+    logger.info(f"区间索引构建完成: {len(stocks)} 只股票 × {len(dates)} 个交易日（{dates[0]} ~ {dates[-1]}），"
+                f"{index.nbytes / 1024 / 1024:.1f}MB，耗时 {time.perf_counter() - started:.2f}s")
+    return index
+
+
+def save_range_index(index, path=None):
+    """保存索引（先写临时文件再 rename，Web 进程不会读到写了一半的文件）"""
+    import numpy as np
+
+    path = path or RANGE_INDEX_PATH
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    arrays = {name: np.asarray(getattr(index, name)) for name in _SAVED_ARRAYS}
+    np.savez(tmp_path, generation=np.asarray(index.generation or ''), **arrays)
+    os.replace(tmp_path, path)
+    logger.info(f"区间索引已保存: {path}，generation={index.generation}")
+
+
+def load_range_index(generation, path=None):
+    """
+    加载刷新进程保存的索引
+
+    返回:
+        RangeIndex；文件不存在、损坏或数据版本号不是 generation 时返回 None
+    """
+    import numpy as np
+
+    path = path or RANGE_INDEX_PATH
+    try:
+        with np.load(path) as data:
+            if str(data['generation']) != str(generation):
+                return None
+            arrays = {name: data[name] for name in _SAVED_ARRAYS}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"加载区间索引 {path} 失败: {e}")
+        return None
+    return RangeIndex(generation=generation, **arrays)
@@ -62,6 +62,9 @@ export const Home: React.FC = () => {
     fetchData()
   }, [])
 
+  // 刷新进程发布新榜单时由推送服务通知，收到后才重新获取
+  useEffect(() => useStockStore.getState().subscribeUpdates(), [])
+
   return (
     <Layout className="home-layout">
       {/* 页头 */}
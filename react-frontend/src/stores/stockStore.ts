@@ -2,9 +2,9 @@
  * 股票数据状态管理 - Zustand Store
  */
 import { create } from 'zustand'
-import { getBothStocks, getChangelog } from '@/utils/api'
-import type { StockData, ChangelogItem } from '@/utils/api'
-import { calculateAllTPlusData } from '@/utils/tplusCalculation'
+import { getBothStocksSummary, getBothStocksDelta, getStockDetail, getChangelog, subscribeGeneration } from '@/utils/api'
+import type { StockData, ChangelogItem, BoardDelta, BothStocksDelta } from '@/utils/api'
+import { calculateAllTPlusData, fromServerTPlusData } from '@/utils/tplusCalculation'
 
 interface StockStore {
   // 状态
@@ -14,14 +14,18 @@ interface StockStore {
   error: string | null
   lastUpdateTime: string | null
   fromCache: boolean
+  generation: string | null
   changelog: ChangelogItem[]
 
   // 方法
   fetchBothStocks: () => Promise<void>
+  updateBothStocks: () => Promise<void>
+  subscribeUpdates: () => () => void
   fetchChangelog: () => Promise<void>
   searchStocks: (keyword: string, period: '10' | '30') => StockData[]
   getTopDeviationStocks: (period: '10' | '30', limit: number) => StockData[]
-  updateStockExtraPercent: (tsCode: string, day: number, value: number) => void
+  fetchStockDetail: (tsCode: string, baseDays: number) => Promise<void>
+  updateStockExtraPercent: (tsCode: string, day: number, value: number) => Promise<void>
 
   // 计算属性（作为方法）
   getCount10: () => number
@@ -32,6 +36,44 @@ interface StockStore {
   getMergedStocks: () => StockData[]
 }
 
+// 为服务端返回的股票添加 baseDays、extraPercent 和服务端预计算的 tPlusData
+const withTPlus = (stock: StockData, baseDays: number): StockData => ({
+  ...stock,
+  baseDays,
+  extraPercent: stock.extraPercent || Array(5).fill(stock.limit_up || 10),
+  tPlusData: fromServerTPlusData(stock.t_plus_data)
+})
+
+// 用户是否修改过 T+n 的假设涨幅（与默认的涨停幅度不同）
+const hasEditedExtraPercent = (stock: StockData) =>
+  !!stock.extraPercent && stock.extraPercent.some(value => value !== (stock.limit_up || 10))
+
+// 按增量更新榜单：未变化的行原样保留；变化的行合并服务端字段、保留用户修改的 extraPercent，
+// 已获取的价格数据作废（按需重新获取）。用户未修改涨幅时直接采用服务端预计算的 tPlusData，
+// 修改过的行由 updateBothStocks 获取新的价格数据后按用户的涨幅重新计算
+const applyBoardDelta = (rows: StockData[], delta: BoardDelta, baseDays: number): StockData[] => {
+  const byCode = new Map(rows.map(stock => [stock.ts_code, stock]))
+  delta.exited.forEach(code => byCode.delete(code))
+  delta.entered.forEach(stock => byCode.set(stock.ts_code, withTPlus(stock, baseDays)))
+  delta.changed.forEach(patch => {
+    const existing = byCode.get(patch.ts_code)
+    if (!existing) return
+    const merged = {
+      ...existing,
+      ...patch,
+      extraPercent: existing.extraPercent,
+      stock_prices: undefined,
+      index_prices: undefined
+    }
+    byCode.set(patch.ts_code, patch.t_plus_data !== undefined && !hasEditedExtraPercent(existing)
+      ? { ...merged, tPlusData: fromServerTPlusData(merged.t_plus_data) }
+      : merged)
+  })
+  return delta.order
+    .map(code => byCode.get(code))
+    .filter((stock): stock is StockData => stock !== undefined)
+}
+
 export const useStockStore = create<StockStore>((set, get) => ({
   // 初始状态
   stocks10: [],
@@ -40,6 +82,7 @@ export const useStockStore = create<StockStore>((set, get) => ({
   error: null,
   lastUpdateTime: null,
   fromCache: false,
+  generation: null,
   changelog: [
     {
       version: '1.0.0',
@@ -128,30 +171,20 @@ export const useStockStore = create<StockStore>((set, get) => ({
       .map((stock, index) => ({ ...stock, index: index + 1 }))
   },
 
-  // 获取双榜数据
+  // 获取双榜数据（精简榜单，价格数据按需通过详情接口获取）
   fetchBothStocks: async () => {
     set({ loading: true, error: null })
     try {
-      const result = await getBothStocks()
+      const result = await getBothStocksSummary()
       if (result.code === 0) {
-        // 为每个股票添加 baseDays、extraPercent 和 tPlusData
-        const stocks10 = (result.data.stocks_10 || []).map(stock => ({
-          ...stock,
-          baseDays: 10,
-          extraPercent: stock.extraPercent || Array(5).fill(stock.limit_up || 10),
-          tPlusData: calculateAllTPlusData({ ...stock, baseDays: 10, extraPercent: stock.extraPercent || Array(5).fill(stock.limit_up || 10) })
-        }))
-        const stocks30 = (result.data.stocks_30 || []).map(stock => ({
-          ...stock,
-          baseDays: 30,
-          extraPercent: stock.extraPercent || Array(5).fill(stock.limit_up || 10),
-          tPlusData: calculateAllTPlusData({ ...stock, baseDays: 30, extraPercent: stock.extraPercent || Array(5).fill(stock.limit_up || 10) })
-        }))
+        const stocks10 = (result.data.stocks_10 || []).map(stock => withTPlus(stock, 10))
+        const stocks30 = (result.data.stocks_30 || []).map(stock => withTPlus(stock, 30))
 
         set({
           stocks10,
           stocks30,
           fromCache: result.from_cache || false,
+          generation: result.generation ?? null,
           lastUpdateTime: new Date().toLocaleString('zh-CN')
         })
       } else {
@@ -166,6 +199,77 @@ export const useStockStore = create<StockStore>((set, get) => ({
     }
   },
 
+  // 更新到最新版本：只获取相对当前版本的增量，版本过旧或增量不可用时重新获取完整榜单
+  updateBothStocks: async () => {
+    const { generation } = get()
+    if (!generation) return get().fetchBothStocks()
+    try {
+      const result = await getBothStocksDelta(generation)
+      if (result.code !== 0 || result.mode === 'full' || !result.generation) {
+        return get().fetchBothStocks()
+      }
+      if (result.mode === 'delta' && result.data) {
+        const delta = result.data as BothStocksDelta
+        const { stocks10, stocks30 } = get()
+        // 数据变化且用户修改过涨幅的行，更新后需按用户的涨幅重新计算 T+n
+        const edited = [
+          ...delta.stocks_10.changed.map(patch => [patch.ts_code, 10] as const),
+          ...delta.stocks_30.changed.map(patch => [patch.ts_code, 30] as const)
+        ].filter(([tsCode, baseDays]) => {
+          const stock = (baseDays === 10 ? stocks10 : stocks30).find(s => s.ts_code === tsCode)
+          return stock !== undefined && hasEditedExtraPercent(stock)
+        })
+        set({
+          stocks10: applyBoardDelta(stocks10, delta.stocks_10, 10),
+          stocks30: applyBoardDelta(stocks30, delta.stocks_30, 30),
+          generation: result.generation,
+          lastUpdateTime: new Date().toLocaleString('zh-CN')
+        })
+        await Promise.allSettled(edited.map(async ([tsCode, baseDays]) => {
+          await get().fetchStockDetail(tsCode, baseDays)
+          const key = baseDays === 10 ? 'stocks10' : 'stocks30'
+          const updated = get()[key].map(stock =>
+            stock.ts_code === tsCode && stock.stock_prices
+              ? { ...stock, tPlusData: calculateAllTPlusData(stock) }
+              : stock
+          )
+          set(key === 'stocks10' ? { stocks10: updated } : { stocks30: updated })
+        }))
+      }
+    } catch (err) {
+      console.error('获取增量榜单失败，重新获取完整榜单:', err)
+      await get().fetchBothStocks()
+    }
+  },
+
+  // 订阅数据版本推送：版本号与当前榜单不同时按增量更新（不再轮询），返回取消订阅的函数
+  subscribeUpdates: () => {
+    return subscribeGeneration((event) => {
+      const { generation, loading } = get()
+      if (event.generation !== generation && !loading) {
+        console.log('收到新数据版本，更新榜单:', event.generation)
+        get().updateBothStocks()
+      }
+    })
+  },
+
+  // 获取单只股票的价格数据，合并到对应榜单中
+  fetchStockDetail: async (tsCode: string, baseDays: number) => {
+    const key = baseDays === 10 ? 'stocks10' : 'stocks30'
+    const existing = get()[key].find(stock => stock.ts_code === tsCode)
+    if (!existing || existing.stock_prices) return
+
+    const result = await getStockDetail(tsCode, baseDays)
+    if (result.code !== 0 || !result.data) return
+
+    const updated = get()[key].map(stock =>
+      stock.ts_code === tsCode
+        ? { ...stock, stock_prices: result.data.stock_prices, index_prices: result.data.index_prices }
+        : stock
+    )
+    set(key === 'stocks10' ? { stocks10: updated } : { stocks30: updated })
+  },
+
   // 获取更新日志
   fetchChangelog: async () => {
     try {
@@ -198,7 +302,12 @@ export const useStockStore = create<StockStore>((set, get) => ({
   },
 
   // 更新股票的 extraPercent 并重新计算 T+n 数据
-  updateStockExtraPercent: (tsCode: string, day: number, value: number) => {
+  updateStockExtraPercent: async (tsCode: string, day: number, value: number) => {
+    // 重新计算需要价格数据，精简榜单中没有时先按需获取
+    await Promise.all([
+      get().fetchStockDetail(tsCode, 10),
+      get().fetchStockDetail(tsCode, 30)
+    ])
     const { stocks10, stocks30 } = get()
 
     console.log('更新股票 extraPercent:', { tsCode, day, value })
@@ -10,6 +10,7 @@ export interface ApiResponse<T = any> {
   message: string
   data: T
   count?: Record<string, number>
+  generation?: string | null
   from_cache?: boolean
 }
 
@@ -46,9 +47,12 @@ export interface StockData {
   threshold?: number
   remaining_limit_ups?: number
 
-  // 详细数据
-  stock_prices: PriceData[]
-  index_prices: PriceData[]
+  // 详细数据（精简榜单不返回，通过详情接口按需获取）
+  stock_prices?: PriceData[]
+  index_prices?: PriceData[]
+
+  // 服务端预计算的 T+1~T+5 数据（精简榜单返回）
+  t_plus_data?: Record<string, ServerTPlusData>
 
   // 其他字段
   price_change_low_pct?: number
@@ -67,6 +71,32 @@ export interface StockData {
   [key: string]: any
 }
 
+export interface ServerTPlusData {
+  lowest_price: number
+  lowest_date: string
+  current_close: number
+  change_percent: number
+  daily_change: number
+  index_change_percent: number
+  deviation: number
+  is_abnormal: boolean
+  possible_highest_price: number
+  possible_change: number
+}
+
+export interface StockDetail {
+  ts_code: string
+  name: string
+  market: string
+  limit_up: number
+  threshold: number
+  start_date: string
+  end_date: string
+  stock_prices: PriceData[]
+  index_prices: PriceData[]
+  t_plus_data: Record<string, ServerTPlusData>
+}
+
 export interface ChangelogItem {
   version: string
   date: string
@@ -78,6 +108,32 @@ export interface BothStocksResponse {
   stocks_30: StockData[]
 }
 
+// 单个榜单相对上一版本的增量
+export interface BoardDelta {
+  entered: StockData[]
+  exited: string[]
+  changed: Array<Partial<StockData> & { ts_code: string }>
+  order: string[]
+}
+
+export interface BothStocksDelta {
+  stocks_10: BoardDelta
+  stocks_30: BoardDelta
+}
+
+export interface BothStocksDeltaResponse extends ApiResponse<BothStocksDelta | BothStocksResponse | null> {
+  mode: 'delta' | 'full' | 'unchanged'
+  since: string | null
+}
+
+export interface GenerationEvent {
+  generation: string
+  end_date: string
+  seq: number
+  previous: string | null
+  computed_at: string
+}
+
 // ============ API 实例 ============
 
 const api = axios.create({
@@ -107,6 +163,45 @@ export const getBothStocks = async (): Promise<ApiResponse<BothStocksResponse>>
   }
 }
 
+/**
+ * 获取精简双榜数据（不含价格数组，附带预计算的 T+1~T+5 数据）
+ */
+export const getBothStocksSummary = async (): Promise<ApiResponse<BothStocksResponse>> => {
+  try {
+    const { data } = await api.get<ApiResponse<BothStocksResponse>>('/stocks/both/summary')
+    return data
+  } catch (error) {
+    console.error('获取精简双榜数据失败:', error)
+    throw error
+  }
+}
+
+/**
+ * 获取精简双榜相对 since 版本的增量（since 过旧时 mode 为 full，返回完整精简榜单）
+ */
+export const getBothStocksDelta = async (since: string): Promise<BothStocksDeltaResponse> => {
+  try {
+    const { data } = await api.get<BothStocksDeltaResponse>('/stocks/both/delta', { params: { since, summary: 1 } })
+    return data
+  } catch (error) {
+    console.error('获取增量双榜数据失败:', error)
+    throw error
+  }
+}
+
+/**
+ * 获取单只股票的 n 日价格数据和 T+n 数据
+ */
+export const getStockDetail = async (tsCode: string, n: number): Promise<ApiResponse<StockDetail>> => {
+  try {
+    const { data } = await api.get<ApiResponse<StockDetail>>(`/stocks/${tsCode}/detail`, { params: { n } })
+    return data
+  } catch (error) {
+    console.error('获取股票详情失败:', error)
+    throw error
+  }
+}
+
 /**
  * 获取更新日志
  */
@@ -120,4 +215,25 @@ export const getChangelog = async (): Promise<ApiResponse<ChangelogItem[]>> => {
   }
 }
 
+// 推送服务地址（独立进程，默认与页面同源，由反向代理转发 /api/events）
+const EVENTS_URL = import.meta.env.VITE_EVENTS_URL || '/api/events'
+
+/**
+ * 订阅数据版本推送（SSE），刷新进程发布新榜单时回调
+ *
+ * 连接建立时会先收到当前版本；断线后浏览器自动重连。返回取消订阅的函数
+ */
+export const subscribeGeneration = (onGeneration: (event: GenerationEvent) => void): (() => void) => {
+  if (typeof EventSource === 'undefined') return () => {}
+  const source = new EventSource(EVENTS_URL)
+  source.addEventListener('generation', (event) => {
+    try {
+      onGeneration(JSON.parse((event as MessageEvent).data))
+    } catch (error) {
+      console.error('解析推送事件失败:', error)
+    }
+  })
+  return () => source.close()
+}
+
 export default api
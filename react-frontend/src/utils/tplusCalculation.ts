@@ -144,3 +144,26 @@ export const calculateAllTPlusData = (stock: any) => {
   return tPlusData
 }
 
+
+/**
+ * 将服务端预计算的 T+n 数据（snake_case）转换为前端格式
+ */
+export const fromServerTPlusData = (serverData: Record<string, any> | undefined) => {
+  const tPlusData: Record<number, TPlusDataFormat> = {}
+  if (!serverData) return tPlusData
+  Object.entries(serverData).forEach(([day, item]) => {
+    tPlusData[Number(day)] = {
+      lowestPrice: item.lowest_price,
+      lowestDate: item.lowest_date,
+      currentClose: item.current_close,
+      changePercent: item.change_percent,
+      dailyChange: item.daily_change,
+      indexChangePercent: item.index_change_percent,
+      deviation: item.deviation,
+      isAbnormal: item.is_abnormal,
+      possibleHighestPrice: item.possible_highest_price,
+      possibleChange: item.possible_change
+    }
+  })
+  return tPlusData
+}
@@ -16,6 +16,11 @@ export default defineConfig({
   },
   server: {
     proxy: {
+      // SSE 推送服务（python -m push_server），需在 /api 之前匹配
+      '/api/events': {
+        target: 'http://127.0.0.1:5001',
+        changeOrigin: true
+      },
       '/api': {
         target: 'http://127.0.0.1:5000',
         changeOrigin: true,
@@ -0,0 +1,165 @@
+"""
+刷新进度模块
+刷新进程把当前进度（阶段、已完成 / 失败 / 总数、速度、预计剩余时间）写入
+RUNTIME_DIR/refresh_status.json（先写临时文件再 rename，最多每 PUBLISH_INTERVAL 秒一次），
+Web 进程的 /api/status 只读该文件，不访问数据库。
+
+只有 start_run() 之后的进度才会发布；init.py 等直接调用 DataManager 时 advance() 不做任何事。
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from config import RUNTIME_DIR
+
+STATUS_PATH = os.getenv('REFRESH_STATUS_PATH', os.path.join(RUNTIME_DIR, 'refresh_status.json'))
+# 进度写盘的最小间隔（秒）
+PUBLISH_INTERVAL = 1.0
+# 运行中每隔该秒数写一次心跳（没有计数变化的阶段，如榜单计算）
+HEARTBEAT_INTERVAL = 30.0
+# 运行中的状态超过该秒数未更新，视为刷新进程已退出
+STALE_AFTER_SECONDS = 300
+
+STATE_IDLE = 'idle'
+STATE_RUNNING = 'running'
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class RefreshProgress:
+    """刷新进度发布器（刷新进程内单例 PROGRESS）"""
+
+    def __init__(self, path=STATUS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._active = False
+        self._last_publish = 0.0
+        self._status = {'state': STATE_IDLE, 'last_run': None}
+        self._stage_started = None
+        self._stopped = threading.Event()
+
+    def _heartbeat(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            self.publish(force=True)
+
+    def start_run(self):
+        """开始一次刷新"""
+        with self._lock:
+            self._active = True
+            self._status = {
+                'state': STATE_RUNNING,
+                'started_at': _now(),
+                'stage': None,
+                'stage_started_at': None,
+                'total': None,
+                'done': 0,
+                'failed': 0,
+                'last_run': self._status.get('last_run') or _read(self.path, {}).get('last_run'),
+            }
+        self._stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, name='refresh-status-heartbeat', daemon=True).start()
+        self.publish(force=True)
+
+    def start_stage(self, stage, total=None):
+        """进入新阶段，计数清零"""
+        if not self._active:
+            return
+        with self._lock:
+            self._stage_started = time.monotonic()
+            self._status.update(stage=stage, stage_started_at=_now(), total=total, done=0, failed=0)
+        self.publish(force=True)
+
+    def set_total(self, total):
+        """设置当前阶段的总数（股票 / 指数数量）"""
+        if not self._active:
+            return
+        with self._lock:
+            self._status.update(total=total, done=0, failed=0)
+        self.publish()
+
+    def advance(self, done=0, failed=0):
+        """当前阶段完成 done 个、失败 failed 个"""
+        if not self._active:
+            return
+        with self._lock:
+            self._status['done'] += done
+            self._status['failed'] += failed
+        self.publish()
+
+    def finish(self, result, error=None):
+        """结束本次刷新，记录结果"""
+        if not self._active:
+            return
+        self._stopped.set()
+        with self._lock:
+            self._active = False
+            self._stage_started = None
+            self._status = {
+                'state': STATE_IDLE,
+                'last_run': {
+                    'started_at': self._status.get('started_at'),
+                    'finished_at': _now(),
+                    'result': result,
+                    'error': error,
+                },
+            }
+        self.publish(force=True)
+
+    def snapshot(self):
+        """当前进度（含速度和预计剩余秒数）"""
+        with self._lock:
+            status = dict(self._status)
+            stage_started = self._stage_started
+        if status['state'] == STATE_RUNNING and stage_started is not None:
+            processed = status['done'] + status['failed']
+            elapsed = time.monotonic() - stage_started
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            status['rate'] = round(rate, 2)
+            status['eta_seconds'] = (round((status['total'] - processed) / rate)
+                                     if rate > 0 and status['total'] else None)
+        status['updated_at'] = time.time()
+        return status
+
+    def publish(self, force=False):
+        """写入状态文件（写盘失败不影响刷新）"""
+        if not force and time.monotonic() - self._last_publish < PUBLISH_INTERVAL:
+            return
+        self._last_publish = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+def _read(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def read_status(path=STATUS_PATH):
+    """
+    读取刷新进度（Web 进程使用）
+
+    返回:
+        状态 dict；从未运行过刷新时 state 为 idle。运行中但长时间未更新时 stale 为 True
+    """
+    status = _read(path) or {'state': STATE_IDLE, 'last_run': None}
+    updated_at = status.pop('updated_at', None)
+    status['updated_at'] = (datetime.fromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S')
+                            if updated_at else None)
+    status['stale'] = bool(status['state'] == STATE_RUNNING and updated_at
+                           and time.time() - updated_at > STALE_AFTER_SECONDS)
+    return status
+
+
+PROGRESS = RefreshProgress()
@@ -0,0 +1,317 @@
+"""
+数据刷新进程
+独立于 Web 进程运行，负责定时任务调度和所有数据写入：
+更新交易日历、股票基本信息、股票/指数日线，计算并发布双榜缓存。
+Web 进程只读取这里发布的结果。
+
+用法:
+    python -m refresh_worker            # 启动时刷新一次，之后每天 17:00 刷新
+    python -m refresh_worker --once     # 只刷新一次后退出
+    python -m refresh_worker --no-initial-refresh
+"""
+import argparse
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+
+# 必须在导入其他模块之前加载环境变量
+load_dotenv()
+
+import logger_config  # 必须在导入 logger 之前
+from loguru import logger
+from apscheduler.schedulers.blocking import BlockingScheduler
+from database import init_db, get_data_watermarks, publish_snapshot, read_snapshot_pointer
+from data_manager import DataManager
+from trade_calendar import TradeCalendarManager
+from monitor import INDEX_CODES
+from analytics import AnalyticsUnavailable, export_parquet, import_duckdb, needs_parquet_export
+from archive import ARCHIVE_HOT_DAYS, archive_daily
+from range_index import build_range_index, save_range_index
+from cache_manager import CacheManager
+from board_service import compute_board, compute_boards_parallel, get_data_generation, publish_boards, sweep_cache
+from metrics import (
+    REGISTRY, REFRESH_STAGE_SECONDS, REFRESH_RUNS, REFRESH_LAST_SUCCESS, DATA_WATERMARK,
+)
+from query_stats import QueryTracker
+from profiler import KIND_REFRESH, profile_block
+from refresh_status import PROGRESS
+
+# 每天定时刷新的时间
+REFRESH_HOUR = 17
+REFRESH_MINUTE = 0
+# 缓存清理（过期、旧版本、超出容量）的间隔（分钟）
+CACHE_SWEEP_MINUTES = 30
+
+# 刷新互斥锁：启动时的首次刷新（date 任务）和每日定时刷新（cron 任务）是两个任务，
+# max_instances 只限制单个任务，两者重叠时后开始的一个等待前一个完成，而不是并发写库；
+# 定时缓存清理也持有该锁，避免在 publish_boards 写入新版本、尚未切换版本指针时把新版本当作旧版本删除
+_refresh_lock = threading.Lock()
+
+
+@contextmanager
+def _stage(name):
+    """刷新阶段：发布进度，记录耗时，统计本阶段执行的 SQL（疑似 N+1 时告警），开启剖析时输出剖析结果"""
+    PROGRESS.start_stage(name)
+    with REFRESH_STAGE_SECONDS.time(stage=name), QueryTracker(f"refresh:{name}"), \
+            profile_block(name, KIND_REFRESH, all_threads=True):
+        yield
+
+
+def _record_watermark(session):
+    """记录库中最新交易日"""
+    watermarks = get_data_watermarks(session)
+    for table in ('stock_daily_data', 'index_daily_data'):
+        if watermarks[table]:
+            DATA_WATERMARK.set(int(watermarks[table]), table=table)
+
+
+def refresh_data():
+    """定期刷新数据的任务（进程内串行执行，任何时刻只有一个刷新在写库和发布榜单）"""
+    if not _refresh_lock.acquire(blocking=False):
+        logger.info("上一次刷新尚未结束，等待其完成后再开始本次刷新")
+        _refresh_lock.acquire()
+    try:
+        PROGRESS.start_run()
+        try:
+            with REFRESH_STAGE_SECONDS.time(stage='total'):
+                _refresh_data()
+            REFRESH_RUNS.inc(result='success')
+            REFRESH_LAST_SUCCESS.set(time.time())
+            PROGRESS.finish('success')
+        except Exception as e:
+            REFRESH_RUNS.inc(result='failure')
+            PROGRESS.finish('failure', error=str(e))
+            logger.error(f"数据刷新失败: {e}")
+        finally:
+            # 刷新进程大部分时间空闲，结束时立即写出指标快照
+            REGISTRY.flush()
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh_data():
+    """刷新数据各阶段（每个阶段的耗时和 SQL 语句数记入指标）"""
+    logger.info("开始刷新股票和指数数据...")
+    dm = DataManager()
+    tcm = TradeCalendarManager()
+    cache_mgr = CacheManager()
+
+    # 更新交易日历
+    logger.info("更新交易日历...")
+    with _stage('trade_cal'):
+        dm.update_trade_cal_if_needed('SSE', days_threshold=180)
+        dm.update_trade_cal_if_needed('SZSE', days_threshold=180)
+
+    # 更新股票基本信息
+    logger.info("更新股票基本信息...")
+    with _stage('stock_basic'):
+        dm.fetch_stock_basic()
+
+    # 获取过去40个交易日的数据
+    logger.info("获取过去40个交易日的股票数据...")
+    try:
+        # 判断今天是否为交易日且在17:00之后
+        today = datetime.now().strftime('%Y%m%d')
+        current_hour = datetime.now().hour
+
+        # 如果今天是交易日且在17:00之后，则包括今天；否则从上一个交易日开始
+        if tcm.is_trading_day(today, 'SSE') and current_hour >= 17:
+            end_date = today
+            logger.info(f"今天 {today} 是交易日且已过17:00，包括今天")
+        else:
+            end_date = tcm.get_prev_trading_day(today, 'SSE')
+            logger.info(f"使用上一个交易日 {end_date} 作为结束日期")
+
+        # 获取最后40个交易日
+        trading_days = tcm.get_last_n_trading_days(40, end_date, 'SSE')
+
+        if trading_days:
+            start_date = trading_days[0]
+            end_date = trading_days[-1]
+            logger.info(f"获取 {start_date} 到 {end_date} 的股票数据")
+
+            # 获取所有上市股票列表
+            stocks = dm.get_stock_list()
+            if stocks:
+                ts_codes = [stock.ts_code for stock in stocks]
+                logger.info(f"准备获取 {len(ts_codes)} 只股票的数据")
+
+                # 批量获取日线数据
+                with _stage('stock_daily'):
+                    dm.fetch_stock_daily_batch(
+                        ts_codes,
+                        start_date=start_date,
+                        end_date=end_date,
+                        exchange='SSE'
+                    )
+                # 失败的股票再重试一轮，仍失败的留待下次同区间刷新时断点续传
+                with _stage('stock_daily_retry'):
+                    failed = dm.retry_failed_stock_daily()
+                if failed:
+                    logger.warning(f"仍有 {failed} 只股票抓取失败，下次刷新时继续")
+                dm.prune_fetch_runs()
+                logger.info("股票日线数据获取完成")
+            else:
+                logger.warning("未找到任何股票")
+        else:
+            logger.warning("未获取到交易日数据")
+    except Exception as e:
+        logger.error(f"获取股票日线数据失败: {e}")
+
+    # 刷新指数日线数据（最近40个交易日）
+    logger.info("刷新指数日线数据...")
+    try:
+        logger.info(f"准备刷新 {len(INDEX_CODES)} 个指数的数据")
+
+        # 使用与股票相同的日期范围（过去40个交易日）
+        if trading_days:
+            start_date = trading_days[0]
+            end_date = trading_days[-1]
+            logger.info(f"获取 {start_date} 到 {end_date} 的指数数据")
+
+            with _stage('index_daily'):
+                dm.fetch_index_daily_batch(
+                    INDEX_CODES,
+                    start_date=start_date,
+                    end_date=end_date,
+                    exchange='SSE'
+                )
+            logger.info("指数日线数据刷新完成")
+        else:
+            logger.warning("未获取到交易日数据，跳过指数数据刷新")
+    except Exception as e:
+        logger.error(f"刷新指数日线数据失败: {e}")
+
+    # DuckDB 读 Parquet 时，在计算榜单前重新导出
+    if needs_parquet_export():
+        try:
+            with _stage('export_parquet'):
+                export_parquet()
+        except Exception as e:
+            logger.error(f"导出 Parquet 失败: {e}")
+
+    # 数据刷新完成后，填充缓存
+    logger.info("填充双榜缓存...")
+    try:
+        with _stage('compute_boards'):
+            try:
+                # 按 榜单 × 板块 分片多进程计算
+                boards = compute_boards_parallel()
+                results_10 = boards[10]['board']
+                results_30 = boards[30]['board']
+            except Exception as e:
+                logger.error(f"多进程计算榜单失败，改为单进程计算: {e}")
+                from monitor import StockMonitor
+                monitor = StockMonitor()
+                boards = {}
+                results_10 = compute_board(monitor, 10)
+                results_30 = compute_board(monitor, 30)
+
+        with _stage('publish'):
+            # 按新版本缓存完整榜单、精简榜单和全市场结果（供参数化榜单接口直接过滤），最后切换版本指针
+            publish_boards(results_10, results_30, cache_mgr,
+                           universes={n: board['universe'] for n, board in boards.items()})
+            sweep_cache(cache_mgr)
+
+        logger.info(f"双榜缓存填充完成，10日榜 {len(results_10)} 只，30日榜 {len(results_30)} 只")
+    except Exception as e:
+        logger.error(f"填充双榜缓存失败: {e}")
+
+    _record_watermark(dm.session)
+
+    # 早于热数据窗口的日线移到 Parquet 归档，快照只包含热数据
+    if ARCHIVE_HOT_DAYS > 0:
+        try:
+            with _stage('archive'):
+                archive_daily(dm.session)
+        except Exception as e:
+            logger.error(f"归档历史日线失败: {e}")
+
+    # 数据和榜单都写完后发布只读快照，Web 进程随后切换到新快照
+    try:
+        with _stage('snapshot'):
+            publish_snapshot(get_data_generation(cache_mgr))
+    except Exception as e:
+        logger.error(f"发布只读快照失败: {e}")
+
+    # 按新数据版本构建任意窗口排行的区间索引，Web 进程直接加载
+    try:
+        with _stage('range_index'):
+            index = build_range_index(dm.session, generation=get_data_generation(cache_mgr))
+            if index is not None:
+                save_range_index(index)
+    except Exception as e:
+        logger.error(f"构建区间索引失败: {e}")
+    logger.info("股票和指数数据刷新完成")
+
+
+def sweep_cache_job():
+    """定时清理缓存表（刷新进行中时跳过，刷新在发布榜单后会自行清理）"""
+    if not _refresh_lock.acquire(blocking=False):
+        logger.info("数据刷新进行中，跳过本次缓存清理")
+        return
+    try:
+        sweep_cache()
+    except Exception as e:
+        logger.error(f"缓存清理失败: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def _handle_sigterm(signum, frame):
+    """容器停止时发送 SIGTERM，转为 SystemExit 让调度器正常退出"""
+    raise SystemExit(0)
+
+
+def main(argv=None):
+    """刷新进程入口"""
+    parser = argparse.ArgumentParser(description="股票异动监控 - 数据刷新进程")
+    parser.add_argument('--once', action='store_true', help='只刷新一次后退出')
+    parser.add_argument('--no-initial-refresh', action='store_true', help='启动时不立即刷新')
+    args = parser.parse_args(argv)
+
+    # 开启日线归档时启动即确认 duckdb 可用，而不是每次刷新都在归档阶段报错
+    if ARCHIVE_HOT_DAYS > 0:
+        try:
+            import_duckdb()
+        except AnalyticsUnavailable as e:
+            logger.error(f"ARCHIVE_HOT_DAYS={ARCHIVE_HOT_DAYS} 需要 duckdb，刷新进程无法启动: {e}")
+            return 1
+
+    # 初始化数据库（Web 进程不再负责建表）
+    init_db()
+    if read_snapshot_pointer() is None:
+        # 还没有快照时先发布一份，Web 进程不必等第一次刷新完成
+        try:
+            publish_snapshot(get_data_generation(CacheManager()))
+        except Exception as e:
+            logger.error(f"发布只读快照失败: {e}")
+
+    if args.once:
+        refresh_data()
+        return 0
+
+    scheduler = BlockingScheduler()
+    # 同一任务不重复排队、错过的执行合并为一次；不同刷新任务之间由 _refresh_lock 串行
+    job_options = {'max_instances': 1, 'coalesce': True, 'misfire_grace_time': 3600}
+    scheduler.add_job(refresh_data, 'cron', hour=REFRESH_HOUR, minute=REFRESH_MINUTE, **job_options)
+    scheduler.add_job(sweep_cache_job, 'interval', minutes=CACHE_SWEEP_MINUTES, **job_options)
+    if not args.no_initial_refresh:
+        # 启动后立即刷新一次
+        scheduler.add_job(refresh_data, 'date', run_date=datetime.now(), **job_options)
+
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    logger.info(f"刷新进程已启动，每天 {REFRESH_HOUR:02d}:{REFRESH_MINUTE:02d} 自动刷新数据")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("刷新进程退出")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())